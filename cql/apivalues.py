@@ -36,11 +36,14 @@ class ProgrammingError (DatabaseError): pass
 class NotSupportedError(DatabaseError): pass
 class NotAuthenticated (DatabaseError): pass
 
+class TooManyRequests(OperationalError): pass  # turned away by a client-side limit
+
 
 # Module constants
 
 apilevel = 1.0
 threadsafety = 1 # Threads may share the module, but not connections/cursors.
+                 # (NativeConnections are the exception; see cql.native.)
 paramstyle = 'named'
 
 # Module Type Objects and Constructors
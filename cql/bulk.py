@@ -0,0 +1,186 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Bulk loading over Thrift batch_mutate, for when building and parsing CQL
+text for every row is too slow. Usually obtained via
+ThriftConnection.bulk_writer():
+
+    >>> writer = conn.bulk_writer('Users', num_connections=4)
+    >>> writer.write('jsmith', {'name': u'John Smith', 'age': 41})
+    >>> writer.write_rows(rows_from_somewhere)
+    >>> writer.close()
+
+Values are serialized according to the column family's schema with the
+same cqltypes classes used everywhere else in this driver. Only column
+families with non-composite comparators (i.e., CQL 2 style or COMPACT
+STORAGE tables without clustering columns) can be written this way.
+"""
+
+from Queue import Queue
+from threading import Thread
+import time
+import cql
+from cql.cqltypes import lookup_casstype, is_counter_type
+from cql.thrifteries import column_family_metadata, lookup_consistency_level
+from cql.cassandra.ttypes import Mutation, ColumnOrSuperColumn, Column
+
+__all__ = ['BulkWriter']
+
+class BulkWriter(object):
+    """
+    Writes rows to one column family with Thrift batch_mutate calls.
+
+    Mutations are gathered into per-key mutation maps of at most batch_size
+    columns each, and every full batch is handed to one of a set of worker
+    threads, one per connection, which send batches concurrently. At most
+    two batches per connection are queued; beyond that, write() blocks until
+    a worker catches up.
+
+    Errors from batch_mutate are raised (as the usual cql exceptions) from
+    the next call to write(), flush() or close().
+    """
+
+    def __init__(self, connections, cfdef, batch_size=500, consistency_level='ONE'):
+        if is_counter_type(cfdef.default_validation_class or 'BytesType'):
+            raise cql.NotSupportedError("BulkWriter can't write to counter column families")
+        self.connections = connections
+        self.column_family = cfdef.name
+        self.schema = column_family_metadata(cfdef)
+        self.keyname = cfdef.key_alias or 'KEY'
+        self.key_type = lookup_casstype(self.schema.value_types[self.keyname])
+        self.name_type = lookup_casstype(self.schema.default_name_type)
+        self.value_types = {}
+        self.batch_size = batch_size
+        self.consistency_level = lookup_consistency_level(consistency_level)
+
+        self.pending = {}
+        self.pending_count = 0
+        self.errors = []
+        self.closed = False
+        self.batches = Queue(maxsize=2 * len(connections))
+        self.workers = []
+        for conn in connections:
+            worker = Thread(target=self.send_batches, args=(conn,))
+            worker.setDaemon(True)
+            worker.start()
+            self.workers.append(worker)
+
+    def value_type(self, namebytes):
+        try:
+            return self.value_types[namebytes]
+        except KeyError:
+            validator = self.schema.value_types.get(namebytes, self.schema.default_value_type)
+            vtype = self.value_types[namebytes] = lookup_casstype(validator)
+            return vtype
+
+    def write(self, key, columns, ttl=None, timestamp=None):
+        """
+        Queue up a write of the given columns (a dict mapping column names to
+        values) to the row with the given key. Columns with a value of None
+        are skipped. If no timestamp is given, the current time is used.
+        """
+
+        self.check_state()
+        if timestamp is None:
+            timestamp = int(time.time() * 1000000)
+        keybytes = self.key_type.to_binary(self.key_type.validate(key))
+        name_type = self.name_type
+        mutations = self.pending.setdefault(keybytes, {}).setdefault(self.column_family, [])
+        for name, val in columns.iteritems():
+            if val is None:
+                continue
+            namebytes = name_type.to_binary(name_type.validate(name))
+            vtype = self.value_type(namebytes)
+            column = Column(name=namebytes, value=vtype.to_binary(vtype.validate(val)),
+                            timestamp=timestamp, ttl=ttl)
+            mutations.append(Mutation(column_or_supercolumn=ColumnOrSuperColumn(column=column)))
+            self.pending_count += 1
+            if self.pending_count >= self.batch_size:
+                self.send_pending()
+                mutations = self.pending.setdefault(keybytes, {}).setdefault(self.column_family, [])
+
+    def write_rows(self, rows, ttl=None, timestamp=None):
+        """
+        Queue up writes for each of the given rows, which should be dicts
+        mapping column names to values. The row key is taken from the entry
+        named by the key alias of the column family ('KEY' if it has none).
+        """
+
+        for row in rows:
+            row = dict(row)
+            try:
+                key = row.pop(self.keyname)
+            except KeyError:
+                raise cql.ProgrammingError("Row has no %r entry: %r" % (self.keyname, row))
+            self.write(key, row, ttl=ttl, timestamp=timestamp)
+
+    def send_pending(self):
+        if self.pending_count:
+            self.batches.put(self.pending)
+        self.pending = {}
+        self.pending_count = 0
+
+    def send_batches(self, conn):
+        cursor = conn.cursor()
+        while True:
+            batch = self.batches.get()
+            try:
+                if batch is None:
+                    return
+                try:
+                    cursor.handle_cql_execution_errors(conn.client.batch_mutate, batch,
+                                                       self.consistency_level)
+                except Exception, e:
+                    self.errors.append(e)
+            finally:
+                self.batches.task_done()
+
+    def check_state(self):
+        if self.closed:
+            raise cql.ProgrammingError("BulkWriter has been closed.")
+        if self.errors:
+            raise self.errors.pop(0)
+
+    def flush(self):
+        """
+        Send everything written so far, and wait until it has all been
+        acknowledged.
+        """
+
+        self.check_state()
+        self.send_pending()
+        self.batches.join()
+        self.check_state()
+
+    def close(self):
+        """
+        Flush any pending writes, then stop the workers and close their
+        connections.
+        """
+
+        if self.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self.closed = True
+            for worker in self.workers:
+                self.batches.put(None)
+            for worker in self.workers:
+                worker.join()
+            for conn in self.connections:
+                conn.close()
@@ -0,0 +1,93 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Column-at-a-time decoding of result sets into NumPy arrays. This is only
+available when NumPy is installed; see Cursor.fetch_columns().
+
+Columns of fixed-width numeric types are decoded in bulk straight from the
+serialized bytes into typed arrays. All other columns are decoded value by
+value, as fetchone() would, into arrays of dtype object. Every column comes
+back as a numpy.ma.MaskedArray whose mask is set where the value was null.
+"""
+
+from cql.apivalues import NotSupportedError
+from cql import cqltypes
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# (serialized dtype, dtype of the resulting array) for each fixed-width type.
+# timestamps are kept as milliseconds since the epoch, as they are serialized.
+fixed_width_dtypes = {
+    cqltypes.Int32Type:         ('>i4', 'i4'),
+    cqltypes.LongType:          ('>i8', 'i8'),
+    cqltypes.CounterColumnType: ('>i8', 'i8'),
+    cqltypes.FloatType:         ('>f4', 'f4'),
+    cqltypes.DoubleType:        ('>f8', 'f8'),
+    cqltypes.DateType:          ('>i8', 'datetime64[ms]'),
+}
+
+def check_numpy():
+    if numpy is None:
+        raise NotSupportedError("Columnar fetching requires NumPy, which could"
+                                " not be imported.")
+
+def decode_fixed_width_column(rawvals, vtype):
+    """
+    Decode a list of serialized values of a fixed-width type into a masked
+    array in one pass. Returns None if the type has no fixed width, or if any
+    non-null value does not have the expected width (so that the caller can
+    fall back to decoding values individually, and report errors the usual
+    way).
+    """
+
+    try:
+        wiredtype, outdtype = fixed_width_dtypes[vtype]
+    except KeyError:
+        return None
+    width = numpy.dtype(wiredtype).itemsize
+    for val in rawvals:
+        if val and len(val) != width:
+            return None
+    filler = '\x00' * width
+    nulls = numpy.fromiter((not val for val in rawvals), dtype=bool, count=len(rawvals))
+    data = numpy.frombuffer(''.join([val or filler for val in rawvals]), dtype=wiredtype)
+    return numpy.ma.MaskedArray(data.astype(outdtype), mask=nulls)
+
+def column_from_values(values):
+    """
+    Build an object-dtype masked array out of already-decoded values.
+    """
+
+    arr = numpy.empty(len(values), dtype=object)
+    arr[:] = values
+    mask = numpy.fromiter((val is None for val in values), dtype=bool, count=len(values))
+    return numpy.ma.MaskedArray(arr, mask=mask)
+
+def decode_column(rawvals, vtype, colname, decoder):
+    """
+    Decode one column's worth of serialized values, using the fixed-width
+    fast path when possible and the given SchemaDecoder otherwise.
+    """
+
+    column = decode_fixed_width_column(rawvals, vtype)
+    if column is None:
+        column = column_from_values([decoder.decode_value(val, vtype, colname)
+                                     for val in rawvals])
+    return column
@@ -19,6 +19,13 @@ from cql.apivalues import ProgrammingError, NotSupportedError
 class Connection(object):
     cql_major_version = 2
 
+    # cql.throttle.RateLimiters for the requests made on this connection's
+    # cursors: one for all of them, a HostLimiters handing out one per host,
+    # and a dict of them by statement class (see Cursor.statement_class)
+    rate_limiter = None
+    host_rate_limiters = None
+    statement_rate_limiters = None
+
     def __init__(self, host, port, keyspace, user=None, password=None, cql_version=None,
                  compression=None):
         """
@@ -57,6 +64,31 @@ class Connection(object):
     def keyspace_changed(self, keyspace):
         self.keyspace = keyspace
 
+    def clone(self, keyspace=None, host=None):
+        """
+        Open a new connection of the same class to the same host (or the
+        given one), with the same credentials and settings as this one.
+        """
+
+        user = password = None
+        if self.credentials:
+            user = self.credentials['username']
+            password = self.credentials['password']
+        conn = self.__class__(host or self.host, self.port, keyspace or self.keyspace,
+                              user, password, self.cql_version, self.compression,
+                              **self.clone_options())
+        conn.rate_limiter = self.rate_limiter
+        conn.host_rate_limiters = self.host_rate_limiters
+        conn.statement_rate_limiters = self.statement_rate_limiters
+        return conn
+
+    def clone_options(self):
+        """
+        Any extra keyword arguments to pass when cloning this connection.
+        """
+
+        return {}
+
     ###
     # Connection API
     ###
@@ -86,9 +118,19 @@ class Connection(object):
 
 # TODO: Pull connections out of a pool instead.
 def connect(host, port=9160, keyspace=None, user=None, password=None,
-            cql_version=None, native=False):
-    if native:
+            cql_version=None, native=False, reactor=None):
+    """
+    Open a connection over Thrift, or over the native protocol if native is
+    true or a cql.reactor.Reactor is given. With a reactor, the connection's
+    socket is driven by the reactor's I/O thread rather than by the threads
+    using the connection.
+    """
+
+    if native or reactor is not None:
         from native import NativeConnection
+        if reactor is not None:
+            return NativeConnection(host, port, keyspace, user, password, cql_version,
+                                    transport_factory=reactor.transport_factory)
         connclass = NativeConnection
     else:
         from thrifteries import ThriftConnection
@@ -18,7 +18,8 @@
 from Queue import Queue, Empty
 from threading import Thread
 from time import sleep
-from cql.connection import Connection
+from cql.connection import connect
+from cql.throttle import InFlightLimiter
 
 __all__ = ['ConnectionPool']
 
@@ -36,10 +37,27 @@ class ConnectionPool(object):
     >>> conn = pool.borrow_connection()
     >>> conn.execute(...)
     >>> pool.return_connection(conn)
+
+    With share_prepared_queries, the pool's connections share one cache of
+    prepared queries (see ThriftCursor.prepare_query), so that a query need
+    only be prepared once per host and keyspace rather than once per
+    connection.
+
+    With max_in_flight, at most that many connections are borrowed at once.
+    Past that, borrow_connection() waits for one to be returned, or raises
+    cql.TooManyRequests, as overload_mode says (see InFlightLimiter, which
+    is kept as self.limiter along with its counters).
+
+    rate_limiter, host_rate_limiters and statement_rate_limiters are set on
+    each of the pool's connections, so that their requests share the same
+    cql.throttle.RateLimiters (see Connection.rate_limiter).
     """
     def __init__(self, hostname, port=9160, keyspace=None, username=None,
                  password=None, decoder=None, max_conns=25, max_idle=5,
-                 eviction_delay=10000):
+                 eviction_delay=10000, share_prepared_queries=False,
+                 max_in_flight=None, max_queued=None, overload_mode='block',
+                 overload_timeout=None, rate_limiter=None, host_rate_limiters=None,
+                 statement_rate_limiters=None):
         self.hostname = hostname
         self.port = port
         self.keyspace = keyspace
@@ -49,6 +67,16 @@ class ConnectionPool(object):
         self.max_conns = max_conns
         self.max_idle = max_idle
         self.eviction_delay = eviction_delay
+        self.prepared_queries = None
+        if share_prepared_queries:
+            self.prepared_queries = {}
+        self.limiter = None
+        if max_in_flight is not None:
+            self.limiter = InFlightLimiter(max_in_flight, max_queued=max_queued,
+                                           mode=overload_mode, timeout=overload_timeout)
+        self.rate_limiter = rate_limiter
+        self.host_rate_limiters = host_rate_limiters
+        self.statement_rate_limiters = statement_rate_limiters
         
         self.connections = Queue()
         self.connections.put(self.__create_connection())
@@ -57,25 +85,39 @@ class ConnectionPool(object):
                                  self.eviction_delay)
     
     def __create_connection(self):
-        return Connection(self.hostname,
-                          port=self.port,
-                          keyspace=self.keyspace,
-                          username=self.username,
-                          password=self.password,
-                          decoder=self.decoder)
+        connection = connect(self.hostname,
+                             port=self.port,
+                             keyspace=self.keyspace,
+                             user=self.username,
+                             password=self.password)
+        if self.prepared_queries is not None:
+            connection.prepared_queries = self.prepared_queries
+        connection.rate_limiter = self.rate_limiter
+        connection.host_rate_limiters = self.host_rate_limiters
+        connection.statement_rate_limiters = self.statement_rate_limiters
+        return connection
         
     def borrow_connection(self):
+        if self.limiter is not None:
+            self.limiter.acquire()
         try:
-            connection = self.connections.get(block=False)
-        except Empty:
-            connection = self.__create_connection()
+            try:
+                connection = self.connections.get(block=False)
+            except Empty:
+                connection = self.__create_connection()
+        except:
+            if self.limiter is not None:
+                self.limiter.release()
+            raise
         return connection
     
     def return_connection(self, connection):
+        if self.limiter is not None:
+            self.limiter.release()
         if self.connections.qsize() > self.max_conns:
             connection.close()
             return
-        if not connection.is_open():
+        if not connection.open_socket:
             return
         self.connections.put(connection)
 
@@ -96,7 +138,7 @@ class Eviction(Thread):
             while(self.connections.qsize() > self.max_idle):
                 connection = self.connections.get(block=False)
                 if connection:
-                    if connection.is_open():
+                    if connection.open_socket:
                         connection.close()
             sleep(self.eviction_delay/1000)
         
@@ -35,15 +35,11 @@ from cql.marshal import (int8_pack, int8_unpack, uint16_pack, uint16_unpack,
                          varint_pack, varint_unpack)
 from decimal import Decimal
 import time
+import struct
 import socket
 import calendar
 import re
 
-try:
-    from cStringIO import StringIO
-except ImportError:
-    from StringIO import StringIO
-
 apache_cassandra_type_prefix = 'org.apache.cassandra.db.marshal.'
 
 def trim_if_startswith(s, prefix):
@@ -137,7 +133,7 @@ def lookup_casstype(casstype):
 
     """
 
-    if isinstance(casstype, CassandraType):
+    if isinstance(casstype, (CassandraType, CassandraTypeType)):
         return casstype
     try:
         return parse_casstype_args(casstype)
@@ -181,6 +177,10 @@ class _CassandraType(object):
     num_subtypes = 0
     empty_binary_ok = False
 
+    # struct format for types whose serialized values always have the same
+    # width. collection types use it to unpack such elements in bulk.
+    fixed_format = None
+
     def __init__(self, val):
         self.val = self.validate(val)
 
@@ -242,6 +242,14 @@ class _CassandraType(object):
         """
         return val
 
+    @staticmethod
+    def from_unpacked(vals):
+        """
+        Given a sequence of values unpacked with this type's fixed_format,
+        hand back the corresponding deserialized values.
+        """
+        return vals
+
     @classmethod
     def cass_parameterized_type_with(cls, subtypes, full=False):
         """
@@ -353,11 +361,16 @@ class DecimalType(_CassandraType):
 
 class UUIDType(_CassandraType):
     typename = 'uuid'
+    fixed_format = '16s'
 
     @staticmethod
     def deserialize(byts):
         return UUID(bytes=byts)
 
+    @staticmethod
+    def from_unpacked(vals):
+        return [UUID(bytes=byts) for byts in vals]
+
     @staticmethod
     def serialize(uuid):
         return uuid.bytes
@@ -383,24 +396,28 @@ class AsciiType(_CassandraType):
 
 class FloatType(_CassandraType):
     typename = 'float'
+    fixed_format = 'f'
 
     deserialize = staticmethod(float_unpack)
     serialize = staticmethod(float_pack)
 
 class DoubleType(_CassandraType):
     typename = 'double'
+    fixed_format = 'd'
 
     deserialize = staticmethod(double_unpack)
     serialize = staticmethod(double_pack)
 
 class LongType(_CassandraType):
     typename = 'bigint'
+    fixed_format = 'q'
 
     deserialize = staticmethod(int64_unpack)
     serialize = staticmethod(int64_pack)
 
 class Int32Type(_CassandraType):
     typename = 'int'
+    fixed_format = 'i'
 
     deserialize = staticmethod(int32_unpack)
     serialize = staticmethod(int32_pack)
@@ -432,6 +449,7 @@ class InetAddressType(_CassandraType):
 
 class CounterColumnType(_CassandraType):
     typename = 'counter'
+    fixed_format = 'q'
 
     deserialize = staticmethod(int64_unpack)
     serialize = staticmethod(int64_pack)
@@ -446,6 +464,7 @@ cql_time_formats = (
 
 class DateType(_CassandraType):
     typename = 'timestamp'
+    fixed_format = 'q'
 
     @classmethod
     def validate(cls, date):
@@ -476,12 +495,17 @@ class DateType(_CassandraType):
     def deserialize(byts):
         return int64_unpack(byts) / 1000.0
 
+    @staticmethod
+    def from_unpacked(vals):
+        return [v / 1000.0 for v in vals]
+
     @staticmethod
     def serialize(timestamp):
         return int64_pack(timestamp * 1000)
 
 class TimeUUIDType(DateType):
     typename = 'timeuuid'
+    fixed_format = '16s'
 
     def my_timestamp(self):
         return unix_time_from_uuid1(self.val)
@@ -490,6 +514,10 @@ class TimeUUIDType(DateType):
     def deserialize(byts):
         return UUID(bytes=byts)
 
+    @staticmethod
+    def from_unpacked(vals):
+        return [UUID(bytes=byts) for byts in vals]
+
     @staticmethod
     def serialize(timeuuid):
         return timeuuid.bytes
@@ -529,6 +557,34 @@ class _ParameterizedType(_CassandraType):
                                       % self.typename)
         return cls.serialize_safe(val)
 
+def unpack_fixed_width_items(byts, numentries, subtypes):
+    """
+    Unpack the entries of a serialized collection in one go, where each entry
+    is one length-prefixed item for each of the given subtypes (one subtype
+    for lists and sets, two for maps). This only works when every subtype
+    has a fixed_format and every item has exactly that width; if not, None
+    is returned and the caller should decode item by item instead.
+
+    Otherwise, a list with one sequence of deserialized values per subtype
+    is returned.
+    """
+
+    formats = [t.fixed_format for t in subtypes]
+    if None in formats:
+        return None
+    sizes = [struct.calcsize('>' + f) for f in formats]
+    if len(byts) != 2 + numentries * (2 * len(sizes) + sum(sizes)):
+        return None
+    entryformat = ''.join(['H' + f for f in formats])
+    unpacked = struct.unpack_from('>' + entryformat * numentries, byts, 2)
+    stride = 2 * len(formats)
+    columns = []
+    for n, (subtype, size) in enumerate(zip(subtypes, sizes)):
+        if unpacked[2 * n::stride].count(size) != numentries:
+            return None
+        columns.append(subtype.from_unpacked(unpacked[2 * n + 1::stride]))
+    return columns
+
 class _SimpleParameterizedType(_ParameterizedType):
     @classmethod
     def validate(cls, val):
@@ -539,26 +595,28 @@ class _SimpleParameterizedType(_ParameterizedType):
     def deserialize_safe(cls, byts):
         subtype, = cls.subtypes
         numelements = uint16_unpack(byts[:2])
+        fixed = unpack_fixed_width_items(byts, numelements, cls.subtypes)
+        if fixed is not None:
+            return cls.adapter(fixed[0])
+        from_binary = subtype.from_binary
         p = 2
         result = []
         for n in xrange(numelements):
             itemlen = uint16_unpack(byts[p:p+2])
             p += 2
-            item = byts[p:p+itemlen]
+            result.append(from_binary(byts[p:p+itemlen]))
             p += itemlen
-            result.append(subtype.from_binary(item))
         return cls.adapter(result)
 
     @classmethod
     def serialize_safe(cls, items):
         subtype, = cls.subtypes
-        buf = StringIO()
-        buf.write(uint16_pack(len(items)))
+        parts = [uint16_pack(len(items))]
         for item in items:
             itembytes = subtype.to_binary(item)
-            buf.write(uint16_pack(len(itembytes)))
-            buf.write(itembytes)
-        return buf.getvalue()
+            parts.append(uint16_pack(len(itembytes)))
+            parts.append(itembytes)
+        return ''.join(parts)
 
 class ListType(_SimpleParameterizedType):
     typename = 'list'
@@ -583,35 +641,36 @@ class MapType(_ParameterizedType):
     def deserialize_safe(cls, byts):
         subkeytype, subvaltype = cls.subtypes
         numelements = uint16_unpack(byts[:2])
+        fixed = unpack_fixed_width_items(byts, numelements, cls.subtypes)
+        if fixed is not None:
+            return dict(zip(*fixed))
+        key_from_binary = subkeytype.from_binary
+        val_from_binary = subvaltype.from_binary
         p = 2
         themap = {}
         for n in xrange(numelements):
             key_len = uint16_unpack(byts[p:p+2])
             p += 2
-            keybytes = byts[p:p+key_len]
+            key = key_from_binary(byts[p:p+key_len])
             p += key_len
             val_len = uint16_unpack(byts[p:p+2])
             p += 2
-            valbytes = byts[p:p+val_len]
+            themap[key] = val_from_binary(byts[p:p+val_len])
             p += val_len
-            key = subkeytype.from_binary(keybytes)
-            val = subvaltype.from_binary(valbytes)
-            themap[key] = val
         return themap
 
     @classmethod
     def serialize_safe(cls, themap):
         subkeytype, subvaltype = cls.subtypes
-        buf = StringIO()
-        buf.write(uint16_pack(len(themap)))
+        parts = [uint16_pack(len(themap))]
         for key, val in themap.iteritems():
             keybytes = subkeytype.to_binary(key)
             valbytes = subvaltype.to_binary(val)
-            buf.write(uint16_pack(len(keybytes)))
-            buf.write(keybytes)
-            buf.write(uint16_pack(len(valbytes)))
-            buf.write(valbytes)
-        return buf.getvalue()
+            parts.append(uint16_pack(len(keybytes)))
+            parts.append(keybytes)
+            parts.append(uint16_pack(len(valbytes)))
+            parts.append(valbytes)
+        return ''.join(parts)
 
 class CompositeType(_ParameterizedType):
     typename = "'org.apache.cassandra.db.marshal.CompositeType'"
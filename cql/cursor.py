@@ -15,7 +15,9 @@
 # limitations under the License.
 
 import cql
+from cql import columnar
 from cql.decoders import SchemaDecoder
+from cql.paging import QueryPager, ReadAhead, iter_row_columns
 from cql.query import prepare_inline
 
 _COUNT_DESCRIPTION = (None, None, None, None, None, None, None)
@@ -46,20 +48,69 @@ class Cursor:
         self.compression = None
         self.decoder = None
 
+        # Optional callable, given the list of column names for a result set,
+        # which hands back a callable used to build each row from its list of
+        # values. See cql.rows. If None, rows are plain lists.
+        self.row_factory = None
+        self.row_class = None
+
+        # The column ids (see columninfo()) that the current description,
+        # name_info and column_types were computed for
+        self.metadata_columns = None
+
+        # For paged queries (see execute_paged()), the QueryPager working out
+        # the queries for the pages after the one in self.result
+        self.pager = None
+
+        # The class of statements this cursor executes (e.g. 'bulk-import'),
+        # picking which of the connection's statement_rate_limiters applies
+        self.statement_class = None
+
     ###
     # Cursor API
     ###
 
     def close(self):
+        self.stop_paging()
         self._connection = None
 
     def pre_execution_setup(self):
         self.__checksock()
+        self.stop_paging()
+        self.reset_result_info()
+
+    def throttle(self, nbytes):
+        """
+        Wait for the connection's rate limiters to admit a request carrying
+        nbytes bytes of query text and values, or raise TooManyRequests.
+        """
+
+        conn = self._connection
+        limiters = []
+        # the narrowest first, so that requests it turns away don't use up
+        # the wider limits
+        if self.statement_class is not None and conn.statement_rate_limiters:
+            limiters.append(conn.statement_rate_limiters.get(self.statement_class))
+        if conn.host_rate_limiters is not None:
+            limiters.append(conn.host_rate_limiters.for_host(conn.host))
+        limiters.append(conn.rate_limiter)
+        for limiter in limiters:
+            if limiter is not None:
+                limiter.admit(nbytes)
+
+    def reset_result_info(self):
         self.rs_idx = 0
         self.rowcount = 0
         self.description = None
         self.name_info = None
         self.column_types = None
+        self.row_class = None
+        self.metadata_columns = None
+
+    def stop_paging(self):
+        if self.pager is not None:
+            self.pager.stop()
+            self.pager = None
 
     def prepare_inline(self, query, params):
         try:
@@ -85,16 +136,105 @@ class Cursor:
         response = self.get_response_prepared(prepared_query, params)
         return self.process_execution_results(response, decoder=decoder)
 
+    def execute_paged(self, cql_query, params={}, page_size=1000, key=None,
+                      clustering=None, decoder=None, read_ahead=0):
+        """
+        Execute a SELECT a page of page_size rows at a time. Rows are fetched
+        as usual with fetchone(), fetchmany(), fetchall() or iteration, and
+        further pages are asked for as needed, so only one page of rows is
+        held at a time. rowcount is the number of rows in the current page.
+
+        To resume each page where the last one ended, the partition key
+        column (key) and, for tables that have any, the clustering columns
+        (clustering; a tuple, if there are several) must be named, and
+        selected. See cql.paging.
+
+        With read_ahead, up to that many further pages are fetched in the
+        background, over a separate connection, while the current one is
+        being consumed.
+        """
+
+        if isinstance(cql_query, unicode):
+            raise ValueError("CQL query must be bytes, not unicode")
+        self.pre_execution_setup()
+        prepared_q = self.prepare_inline(cql_query, params)
+        pager = QueryPager(prepared_q, page_size, self.cql_major_version, key=key,
+                           clustering=clustering, decoder=decoder)
+        if read_ahead > 0:
+            pager = ReadAhead(pager, self._connection.clone(), read_ahead,
+                              statement_class=self.statement_class)
+        self.pager = pager
+        self.result = []
+        self.load_next_page()
+        return True
+
+    def iter_columns(self, column_family, key, page_size=1000, start='', decoder=None,
+                     key_alias='KEY'):
+        """
+        Iterate over the columns of a single CQL 2 row, fetching page_size
+        columns at a time, and yielding a (name, value) tuple for each. Rows
+        with more columns than fit in memory can be read this way. key_alias
+        is the name of the row key in the column family's results.
+        """
+
+        return iter_row_columns(self, column_family, key, page_size=page_size,
+                                start=start, decoder=decoder, key_alias=key_alias)
+
+    def get_page_response(self, query):
+        """
+        Send the query for one page of a query paged on the client (see
+        execute_paged()), and hand back the response.
+        """
+
+        return self.get_response(query)
+
+    def load_next_page(self):
+        """
+        If the current result set is paged, replace the exhausted current
+        page with the next one that has any rows and hand back True, or hand
+        back False if there are no more.
+        """
+
+        self.__checksock()
+        pager = self.pager
+        while pager is not None:
+            response = pager.next_response(self)
+            if response is None:
+                self.stop_paging()
+                break
+            self.reset_result_info()
+            self.process_execution_results(response, decoder=pager.decoder)
+            pager.page_loaded(self)
+            if self.result:
+                return True
+        return False
+
     def get_metadata_info(self, row):
-        self.description = description = []
-        self.name_info = name_info = []
-        self.column_types = column_types = []
-        for colid in self.columninfo(row):
+        colids = list(self.columninfo(row))
+        if colids == self.metadata_columns:
+            return
+        self.metadata_columns = colids
+        self.description, self.name_info, self.column_types = \
+                self.build_metadata_info(colids)
+        if self.row_factory is not None:
+            self.row_class = self.row_factory([d[0] for d in self.description])
+
+    def build_metadata_info(self, colids):
+        """
+        Given the column ids for a row, hand back the corresponding
+        (description, name_info, column_types).
+        """
+
+        description = []
+        name_info = []
+        column_types = []
+        for colid in colids:
             name, nbytes, vtype, ctype = self.get_column_metadata(colid)
             column_types.append(vtype)
             description.append((name, vtype.cass_parameterized_type(),
                                 None, None, None, None, True))
             name_info.append((nbytes, ctype))
+        return description, name_info, column_types
 
     def get_column_metadata(self, column_id):
         return self.decoder.decode_metadata_and_type(column_id)
@@ -104,11 +244,13 @@ class Cursor:
         bytevals = self.columnvalues(row)
         for val, vtype, nameinfo in zip(bytevals, self.column_types, self.name_info):
             values.append(self.decoder.decode_value(val, vtype, nameinfo[0]))
+        if self.row_class is not None:
+            return self.row_class(values)
         return values
 
     def fetchone(self):
         self.__checksock()
-        if self.rs_idx == len(self.result):
+        if self.rs_idx == len(self.result) and not self.load_next_page():
             return None
 
         row = self.result[self.rs_idx]
@@ -127,14 +269,53 @@ class Cursor:
             size = self.arraysize
         # we avoid leveraging fetchone here to avoid decoding metadata unnecessarily
         L = []
-        while len(L) < size and self.rs_idx < len(self.result):
+        while len(L) < size:
+            if self.rs_idx >= len(self.result) and not self.load_next_page():
+                break
             row = self.result[self.rs_idx]
             self.rs_idx += 1
             L.append(self.decode_row(row))
         return L
 
     def fetchall(self):
-        return self.fetchmany(len(self.result) - self.rs_idx)
+        L = self.fetchmany(len(self.result) - self.rs_idx)
+        while self.load_next_page():
+            L.extend(self.fetchmany(len(self.result) - self.rs_idx))
+        return L
+
+    def fetch_columns(self):
+        """
+        Fetch all remaining rows, returning them column by column: a list
+        with one numpy.ma.MaskedArray per column in self.description, masked
+        where values are null. int, bigint, counter, float and double columns
+        are decoded in bulk into arrays of the corresponding numeric dtype,
+        and timestamp columns into datetime64[ms] arrays. Other columns are
+        decoded as fetchone() would, into arrays of dtype object.
+
+        Requires NumPy, and a result set where all rows have the same columns
+        (so, not CQL 2 results from the Thrift transport).
+        """
+
+        self.__checksock()
+        columnar.check_numpy()
+        if self.pager is not None:
+            raise cql.NotSupportedError("Columnar fetching is not supported for"
+                                        " paged queries")
+        counting = self.description is _COUNT_DESCRIPTION
+        if self.cql_major_version < 3 and not counting:
+            raise cql.NotSupportedError("Columnar fetching is not supported for"
+                                        " CQL 2 results")
+        rows = self.result[self.rs_idx:]
+        self.rs_idx = len(self.result)
+        if counting:
+            return [columnar.column_from_values([row[0] for row in rows])]
+        if not self.description:
+            return []
+        rawcolumns = zip(*[self.columnvalues(row) for row in rows]) \
+                     or [()] * len(self.column_types)
+        return [columnar.decode_column(rawvals, vtype, nameinfo[0], self.decoder)
+                for (rawvals, vtype, nameinfo)
+                in zip(rawcolumns, self.column_types, self.name_info)]
 
     def executemany(self, operation_list, argslist):
         self.__checksock()
@@ -161,7 +342,7 @@ class Cursor:
     ###
 
     def next(self):
-        if self.rs_idx >= len(self.result):
+        if self.rs_idx >= len(self.result) and not self.load_next_page():
             raise StopIteration
         return self.fetchone()
 
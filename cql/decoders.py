@@ -17,12 +17,28 @@
 from cql.apivalues import ProgrammingError
 from cql import cqltypes
 
+# column names cached per decoder; past that, the cache starts over, so that
+# the dynamic column names of wide rows can't pile up
+MAX_CACHED_COLUMN_NAMES = 10000
+
 class SchemaDecoder(object):
     """
     Decode binary column names/values according to schema.
     """
     def __init__(self, schema):
         self.schema = schema
+        # column name bytes -> result of decode_metadata_and_type(). CQL 2
+        # results can have many rows with the same (dynamic) column names.
+        self.column_metadata_cache = {}
+        # cassandra type string -> CassandraType class
+        self.casstype_cache = {}
+
+    def lookup_casstype(self, casstype):
+        try:
+            return self.casstype_cache[casstype]
+        except KeyError:
+            typeclass = self.casstype_cache[casstype] = cqltypes.lookup_casstype(casstype)
+            return typeclass
 
     def name_decode_error(self, err, namebytes, expectedtype):
         raise ProgrammingError("column name %r can't be deserialized as %s: %s"
@@ -33,18 +49,34 @@ class SchemaDecoder(object):
                                % (valuebytes, namebytes, expectedtype, err))
 
     def decode_metadata_and_type(self, namebytes):
+        try:
+            return self.column_metadata_cache[namebytes]
+        except KeyError:
+            pass
         schema = self.schema
         comparator = schema.name_types.get(namebytes, schema.default_name_type)
-        comptype = cqltypes.lookup_casstype(comparator)
+        comptype = self.lookup_casstype(comparator)
         validator = schema.value_types.get(namebytes, schema.default_value_type)
-        valdtype = cqltypes.lookup_casstype(validator)
+        valdtype = self.lookup_casstype(validator)
 
         try:
             name = comptype.from_binary(namebytes)
         except Exception, e:
             name = self.name_decode_error(e, namebytes, comptype.cql_parameterized_type())
 
-        return name, namebytes, valdtype, comptype
+        cache = self.column_metadata_cache
+        if len(cache) >= MAX_CACHED_COLUMN_NAMES:
+            cache.clear()
+        result = cache[namebytes] = (name, namebytes, valdtype, comptype)
+        return result
+
+    def forget_column_names(self):
+        """
+        Drop the cached column names, keeping the parsed types. For decoders
+        kept across many pages of rows whose names don't repeat.
+        """
+
+        self.column_metadata_cache.clear()
 
     def decode_value(self, valbytes, vtype, colname):
         try:
@@ -0,0 +1,263 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A direct reader for the responses to execute_cql_query and
+execute_prepared_cql_query, for use when Thrift's fastbinary extension is
+not available. The pure-Python Thrift code builds a CqlRow and a Column
+object for every row and cell, only for ThriftCursor to pull the names and
+values back out of them; this reader parses a whole framed reply straight
+into RawCqlResult rows instead.
+
+Only successful results are handled here. Anything else (exceptions, or
+anything unexpected in the reply) is handed back to the generated Thrift
+code, which then sees exactly the same bytes.
+"""
+
+import struct
+from thrift.Thrift import TType, TMessageType
+from thrift.transport import TTransport
+from thrift.protocol import TBinaryProtocol
+from cql.cassandra import Cassandra
+from cql.cassandra.ttypes import CqlMetadata
+
+try:
+    from thrift.protocol import fastbinary
+except ImportError:
+    fastbinary = None
+
+__all__ = ['RawCqlResult', 'read_cql_result']
+
+_int16 = struct.Struct('>h').unpack_from
+_int32 = struct.Struct('>i').unpack_from
+
+VERSION_MASK = -65536  # 0xffff0000 as a signed int32
+VERSION_1 = -2147418112  # 0x80010000 as a signed int32
+
+# sizes of the fixed-width thrift types, for skipping fields
+fixed_type_sizes = {
+    TType.BOOL: 1,
+    TType.BYTE: 1,
+    TType.I16: 2,
+    TType.I32: 4,
+    TType.I64: 8,
+    TType.DOUBLE: 8,
+}
+
+class RawCqlResult(object):
+    """
+    Like a thrift CqlResult, except that each row is a (names, values) pair
+    of lists holding the raw column name and value bytes.
+    """
+
+    def __init__(self, type=None, rows=None, num=None, schema=None):
+        self.type = type
+        self.rows = rows
+        self.num = num
+        self.schema = schema
+
+class Unhandled(Exception):
+    pass
+
+def read_frame(tsocket):
+    size = _int32(tsocket.readAll(4))[0]
+    return tsocket.readAll(size)
+
+def read_cql_result(tsocket, method):
+    """
+    Read one framed reply to the given method ('execute_cql_query' or
+    'execute_prepared_cql_query') directly from the underlying socket
+    transport, and hand back a RawCqlResult. Errors are raised the same way
+    the generated Cassandra.Client recv_* methods raise them.
+    """
+
+    frame = read_frame(tsocket)
+    try:
+        return parse_reply(frame)
+    except (Unhandled, struct.error, IndexError):
+        iprot = TBinaryProtocol.TBinaryProtocol(TTransport.TMemoryBuffer(frame))
+        return getattr(Cassandra.Client(iprot), 'recv_' + method)()
+
+def parse_reply(buf):
+    version = _int32(buf, 0)[0]
+    if version & VERSION_MASK != VERSION_1:
+        raise Unhandled()
+    if version & 0xff != TMessageType.REPLY:
+        raise Unhandled()
+    namelen = _int32(buf, 4)[0]
+    p = 8 + namelen + 4  # skip method name and seqid
+
+    # the result struct: field 0 is success, others are exceptions
+    result = None
+    while True:
+        ftype = ord(buf[p])
+        if ftype == TType.STOP:
+            break
+        fid = _int16(buf, p + 1)[0]
+        p += 3
+        if fid != 0 or ftype != TType.STRUCT:
+            raise Unhandled()
+        result, p = parse_cql_result(buf, p)
+    if result is None:
+        raise Unhandled()
+    return result
+
+def parse_cql_result(buf, p):
+    result = RawCqlResult()
+    while True:
+        ftype = ord(buf[p])
+        if ftype == TType.STOP:
+            return result, p + 1
+        fid = _int16(buf, p + 1)[0]
+        p += 3
+        if fid == 1 and ftype == TType.I32:
+            result.type = _int32(buf, p)[0]
+            p += 4
+        elif fid == 2 and ftype == TType.LIST:
+            result.rows, p = parse_rows(buf, p)
+        elif fid == 3 and ftype == TType.I32:
+            result.num = _int32(buf, p)[0]
+            p += 4
+        elif fid == 4 and ftype == TType.STRUCT:
+            result.schema, p = parse_metadata(buf, p)
+        else:
+            p = skip(buf, p, ftype)
+
+def parse_rows(buf, p):
+    if ord(buf[p]) != TType.STRUCT:
+        raise Unhandled()
+    numrows = _int32(buf, p + 1)[0]
+    p += 5
+    rows = []
+    for n in xrange(numrows):
+        names = values = None
+        while True:
+            ftype = ord(buf[p])
+            if ftype == TType.STOP:
+                p += 1
+                break
+            fid = _int16(buf, p + 1)[0]
+            p += 3
+            if fid == 2 and ftype == TType.LIST:
+                names, values, p = parse_columns(buf, p)
+            else:
+                # includes the row key, which cursors don't use
+                p = skip(buf, p, ftype)
+        if names is None:
+            names = []
+            values = []
+        rows.append((names, values))
+    return rows, p
+
+def parse_columns(buf, p):
+    if ord(buf[p]) != TType.STRUCT:
+        raise Unhandled()
+    numcols = _int32(buf, p + 1)[0]
+    p += 5
+    names = []
+    values = []
+    for n in xrange(numcols):
+        name = value = None
+        while True:
+            ftype = ord(buf[p])
+            if ftype == TType.STOP:
+                p += 1
+                break
+            fid = _int16(buf, p + 1)[0]
+            p += 3
+            if ftype == TType.STRING and fid in (1, 2):
+                size = _int32(buf, p)[0]
+                p += 4
+                if fid == 1:
+                    name = buf[p:p + size]
+                else:
+                    value = buf[p:p + size]
+                p += size
+            else:
+                p = skip(buf, p, ftype)
+        names.append(name)
+        values.append(value)
+    return names, values, p
+
+def parse_metadata(buf, p):
+    meta = CqlMetadata()
+    while True:
+        ftype = ord(buf[p])
+        if ftype == TType.STOP:
+            return meta, p + 1
+        fid = _int16(buf, p + 1)[0]
+        p += 3
+        if fid in (1, 2) and ftype == TType.MAP:
+            themap, p = parse_string_map(buf, p)
+            if fid == 1:
+                meta.name_types = themap
+            else:
+                meta.value_types = themap
+        elif fid in (3, 4) and ftype == TType.STRING:
+            s, p = parse_string(buf, p)
+            if fid == 3:
+                meta.default_name_type = s
+            else:
+                meta.default_value_type = s
+        else:
+            p = skip(buf, p, ftype)
+
+def parse_string(buf, p):
+    size = _int32(buf, p)[0]
+    p += 4
+    return buf[p:p + size], p + size
+
+def parse_string_map(buf, p):
+    if ord(buf[p]) != TType.STRING or ord(buf[p + 1]) != TType.STRING:
+        raise Unhandled()
+    size = _int32(buf, p + 2)[0]
+    p += 6
+    themap = {}
+    for n in xrange(size):
+        k, p = parse_string(buf, p)
+        themap[k], p = parse_string(buf, p)
+    return themap, p
+
+def skip(buf, p, ftype):
+    try:
+        return p + fixed_type_sizes[ftype]
+    except KeyError:
+        pass
+    if ftype == TType.STRING:
+        return p + 4 + _int32(buf, p)[0]
+    if ftype == TType.STRUCT:
+        while True:
+            subtype = ord(buf[p])
+            if subtype == TType.STOP:
+                return p + 1
+            p = skip(buf, p + 3, subtype)
+    if ftype == TType.MAP:
+        ktype = ord(buf[p])
+        vtype = ord(buf[p + 1])
+        size = _int32(buf, p + 2)[0]
+        p += 6
+        for n in xrange(size):
+            p = skip(buf, p, ktype)
+            p = skip(buf, p, vtype)
+        return p
+    if ftype in (TType.SET, TType.LIST):
+        etype = ord(buf[p])
+        size = _int32(buf, p + 1)[0]
+        p += 5
+        for n in xrange(size):
+            p = skip(buf, p, etype)
+        return p
+    raise Unhandled()
@@ -0,0 +1,159 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Fetching many rows by key at once over Thrift multiget_slice and
+multiget_count. Usually obtained via ThriftConnection.multigetter():
+
+    >>> getter = conn.multigetter('Users', num_connections=4)
+    >>> for key, columns in getter.get(user_ids, columns=['name', 'age']):
+    ...     process(key, dict(columns))
+    >>> getter.close()
+
+The keys are split into chunks of at most chunk_size keys, and the chunks
+are fetched concurrently, one call per chunk, over the getter's
+connections.
+"""
+
+from Queue import Queue
+from threading import Thread
+import cql
+from cql.cqltypes import lookup_casstype
+from cql.thrifteries import ThriftRowDecoder, lookup_consistency_level
+from cql.cassandra.ttypes import ColumnParent, SlicePredicate, SliceRange
+
+__all__ = ['MultiGetter']
+
+class MultiGetter(object):
+    """
+    Looks up rows of one column family by key, in bounded chunks spread
+    across a set of connections (one worker thread each).
+    """
+
+    def __init__(self, connections, cfdef, chunk_size=50, max_columns=1000,
+                 consistency_level='ONE'):
+        self.connections = connections
+        self.cfdef = cfdef
+        self.rowdecoder = ThriftRowDecoder(cfdef)
+        self.key_type = self.rowdecoder.key_type
+        self.name_type = lookup_casstype(cfdef.comparator_type or 'BytesType')
+        self.chunk_size = chunk_size
+        self.max_columns = max_columns
+        self.consistency_level = lookup_consistency_level(consistency_level)
+        self.column_parent = ColumnParent(column_family=cfdef.name)
+        self.closed = False
+        self.tasks = Queue()
+        self.workers = []
+        for conn in connections:
+            worker = Thread(target=self.serve, args=(conn,))
+            worker.setDaemon(True)
+            worker.start()
+            self.workers.append(worker)
+
+    def make_predicate(self, columns):
+        if columns is None:
+            return SlicePredicate(slice_range=SliceRange(start='', finish='', reversed=False,
+                                                         count=self.max_columns))
+        name_type = self.name_type
+        return SlicePredicate(column_names=[name_type.to_binary(name_type.validate(name))
+                                            for name in columns])
+
+    def encode_keys(self, keys):
+        key_type = self.key_type
+        return [key_type.to_binary(key_type.validate(key)) for key in keys]
+
+    def get(self, keys, columns=None):
+        """
+        Fetch the given rows, returning a list of (key, [(name, value), ...])
+        tuples in the same order as the keys, with one tuple per key even
+        where keys are repeated. Only the named columns are fetched if columns
+        is given; otherwise, the first max_columns columns of each row. Rows
+        that don't exist have an empty column list.
+        """
+
+        keybytes = self.encode_keys(keys)
+        found = self.run('multiget_slice', keybytes, self.make_predicate(columns))
+        # a decoder per call, so that dynamic column names don't pile up in
+        # its cache over the getter's life
+        rowdecoder = ThriftRowDecoder(self.cfdef)
+        return [(rowdecoder.decode_key(kb), rowdecoder.decode_columns(found.get(kb, ())))
+                for kb in keybytes]
+
+    def count(self, keys, columns=None):
+        """
+        Count the columns in the given rows (up to max_columns, or only among
+        the named columns if columns is given), returning a list of
+        (key, count) tuples in the same order as the keys.
+        """
+
+        keybytes = self.encode_keys(keys)
+        found = self.run('multiget_count', keybytes, self.make_predicate(columns))
+        return [(self.rowdecoder.decode_key(kb), found.get(kb, 0)) for kb in keybytes]
+
+    def run(self, method, keybytes, predicate):
+        if self.closed:
+            raise cql.ProgrammingError("MultiGetter has been closed.")
+        # each row is only asked for once, however often its key is repeated
+        seen = set()
+        unique = []
+        for kb in keybytes:
+            if kb not in seen:
+                seen.add(kb)
+                unique.append(kb)
+        keybytes = unique
+        chunks = [keybytes[n:n + self.chunk_size]
+                  for n in xrange(0, len(keybytes), self.chunk_size)]
+        results = Queue()
+        for chunk in chunks:
+            self.tasks.put((method, chunk, predicate, results))
+        found = {}
+        error = None
+        for chunk in chunks:
+            ok, val = results.get()
+            if ok:
+                found.update(val)
+            elif error is None:
+                error = val
+        if error is not None:
+            raise error
+        return found
+
+    def serve(self, conn):
+        cursor = conn.cursor()
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            method, chunk, predicate, results = task
+            try:
+                val = cursor.handle_cql_execution_errors(getattr(conn.client, method), chunk,
+                                                         self.column_parent, predicate,
+                                                         self.consistency_level)
+            except Exception, e:
+                results.put((False, e))
+            else:
+                results.put((True, val))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for worker in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+        for conn in self.connections:
+            conn.close()
@@ -20,9 +20,11 @@ from cql.cqltypes import lookup_cqltype
 from cql.connection import Connection
 from cql.cursor import Cursor, _VOID_DESCRIPTION, _COUNT_DESCRIPTION
 from cql.apivalues import ProgrammingError, OperationalError
-from cql.query import PreparedQuery, prepare_query, cql_quote_name
+from cql.query import PreparedQuery, prepare_query, cql_quote_name, values_size
 import socket
-import itertools
+from threading import Condition, Lock
+from time import time
+from warnings import warn
 try:
     from cStringIO import StringIO
 except ImportError:
@@ -30,19 +32,37 @@ except ImportError:
 
 
 PROTOCOL_VERSION             = 0x01
+MAX_PROTOCOL_VERSION         = 0x02
 PROTOCOL_VERSION_MASK        = 0x7f
 
+# stream ids are signed bytes, and the negative ones are kept for messages
+# pushed by the server
+MAX_STREAM_IDS               = 128
+
 # XXX: should these be called request/response instead? unclear which one will
 # apply if/when the server initiates streams in the other direction.
 HEADER_DIRECTION_FROM_CLIENT = 0x00
 HEADER_DIRECTION_TO_CLIENT   = 0x80
 HEADER_DIRECTION_MASK        = 0x80
 
+consistency_levels = {
+    'ANY':          0x0000,
+    'ONE':          0x0001,
+    'TWO':          0x0002,
+    'THREE':        0x0003,
+    'QUORUM':       0x0004,
+    'ALL':          0x0005,
+    'LOCAL_QUORUM': 0x0006,
+    'EACH_QUORUM':  0x0007,
+}
+
 
 class CqlResult:
-    def __init__(self, column_metadata, rows):
+    def __init__(self, column_metadata, rows, paging_state=None):
         self.column_metadata = column_metadata
         self.rows = rows
+        # (protocol v2) set if there are more pages of rows to fetch
+        self.paging_state = paging_state
 
     def __iter__(self):
         return iter(self.rows)
@@ -52,6 +72,22 @@ class CqlResult:
                % (self.column_metadata, self.rows)
     __repr__ = __str__
 
+class ResultMetadata(list):
+    """
+    The column specs (ksname, cfname, colname, coltype) from the metadata
+    block of a RESULT message. Results with byte-for-byte identical metadata
+    blocks share one ResultMetadata object, so information derived from the
+    column specs can be kept in derived_info and reused across results.
+    """
+
+    def __init__(self, colspecs):
+        list.__init__(self, colspecs)
+        self.derived_info = {}
+
+# raw metadata block bytes -> ResultMetadata
+MAX_CACHED_RESULT_METADATA = 256
+_result_metadata_cache = {}
+
 class PreparedResult:
     def __init__(self, queryid, param_metadata):
         self.queryid = queryid
@@ -75,6 +111,9 @@ class _register_msg_type(type):
 class _MessageType(object):
     __metaclass__ = _register_msg_type
     params = ()
+    # parameter name -> default value, for parameters that may be left out
+    optional_params = {}
+    protocol_version = PROTOCOL_VERSION
 
     def __init__(self, **kwargs):
         for pname in self.params:
@@ -84,18 +123,25 @@ class _MessageType(object):
                 raise ValueError("%s instances need the %s keyword parameter"
                                  % (self.__class__.__name__, pname))
             setattr(self, pname, pval)
+        for pname, default in self.optional_params.items():
+            setattr(self, pname, kwargs.get(pname, default))
+
+    @classmethod
+    def recv(cls, f, protocol_version):
+        return cls.recv_body(f)
 
-    def send(self, f, streamid, compression=False):
+    def send(self, f, streamid, compression=False, protocol_version=PROTOCOL_VERSION):
+        # send_body() implementations check this where the body layout
+        # differs between protocol versions
+        self.protocol_version = protocol_version
         body = StringIO()
         self.send_body(body)
         body = body.getvalue()
-        version = PROTOCOL_VERSION | HEADER_DIRECTION_FROM_CLIENT
+        version = protocol_version | HEADER_DIRECTION_FROM_CLIENT
         flags = 0 # no compression supported yet
         msglen = int32_pack(len(body))
         header = '%c%c%c%c%s' % (version, flags, streamid, self.opcode, msglen)
-        f.write(header)
-        if len(body) > 0:
-            f.write(body)
+        f.write(header + body)
 
     def __str__(self):
         paramstrs = ['%s=%r' % (pname, getattr(self, pname)) for pname in self.params]
@@ -104,18 +150,32 @@ class _MessageType(object):
 
 def read_frame(f):
     header = f.read(8)
+    if len(header) < 8:
+        raise cql.InternalError("short read of %s bytes (8 expected)" % len(header))
+    body_len = check_frame_header(header)
+    return decode_frame(header, f.read(body_len))
+
+def check_frame_header(header):
+    """
+    Check the 8-byte header of a frame from the server, and return the
+    length of the frame's body.
+    """
+
     version, flags, stream, opcode = map(ord, header[:4])
     body_len = int32_unpack(header[4:])
-    assert version & PROTOCOL_VERSION_MASK == PROTOCOL_VERSION, \
+    assert PROTOCOL_VERSION <= version & PROTOCOL_VERSION_MASK <= MAX_PROTOCOL_VERSION, \
             "Unsupported CQL protocol version %d" % version
     assert version & HEADER_DIRECTION_MASK == HEADER_DIRECTION_TO_CLIENT, \
             "Unexpected request from server with opcode %04x, stream id %r" % (opcode, stream)
     assert body_len >= 0, "Invalid CQL protocol body_len %r" % body_len
     if flags:
         warn("Unknown protocol flags set: %02x. May cause problems." % flags)
-    body = f.read(body_len)
+    return body_len
+
+def decode_frame(header, body):
+    version, flags, stream, opcode = map(ord, header[:4])
     msgclass = _message_types_by_opcode[opcode]
-    msg = msgclass.recv_body(StringIO(body))
+    msg = msgclass.recv(StringIO(body), version & PROTOCOL_VERSION_MASK)
     msg.stream_id = stream
     return msg
 
@@ -139,7 +199,7 @@ class ErrorMessage(_MessageType):
         msg = 'code=%04x [%s] message="%s"' \
               % (self.code, self.summary, self.message)
         if self.info is not None:
-            msg += (' ' + self.info)
+            msg += ' info=%r' % (self.info,)
         return msg
 
     def __str__(self):
@@ -225,6 +285,9 @@ class ReadTimeoutErrorMessage(RequestTimeoutException):
             'data_present': bool(read_byte(f)),
         }
 
+# errors showing that a coordinator is struggling to keep up
+overload_errors = (OverloadedErrorMessage, RequestTimeoutException)
+
 class SyntaxException(RequestValidationException):
     summary = 'Syntax error in CQL query'
     errorcode = 0x2000
@@ -316,13 +379,53 @@ class SupportedMessage(_MessageType):
         cqlversions = options.pop('CQL_VERSION')
         return cls(cqlversions=cqlversions, options=options)
 
+def write_query_parameters(f, msg, values):
+    """
+    Write the consistency level, flags, values and paging options of a
+    protocol v2 QUERY or EXECUTE message.
+    """
+
+    flags = 0
+    if values:
+        flags |= QueryMessage.FLAG_VALUES
+    if msg.page_size is not None:
+        flags |= QueryMessage.FLAG_PAGE_SIZE
+    if msg.paging_state is not None:
+        flags |= QueryMessage.FLAG_WITH_PAGING_STATE
+    if msg.skip_metadata:
+        flags |= QueryMessage.FLAG_SKIP_METADATA
+    write_short(f, consistency_levels[msg.consistency_level.upper()])
+    write_byte(f, flags)
+    if values:
+        write_short(f, len(values))
+        for value in values:
+            write_value(f, value)
+    if msg.page_size is not None:
+        write_int(f, msg.page_size)
+    if msg.paging_state is not None:
+        write_value(f, msg.paging_state)
+
 class QueryMessage(_MessageType):
     opcode = 0x07
     name = 'QUERY'
     params = ('query',)
+    # only sent with protocol v2
+    optional_params = {
+        'consistency_level': 'ONE',
+        'page_size': None,
+        'paging_state': None,
+        'skip_metadata': False,
+    }
+
+    FLAG_VALUES            = 0x01
+    FLAG_SKIP_METADATA     = 0x02
+    FLAG_PAGE_SIZE         = 0x04
+    FLAG_WITH_PAGING_STATE = 0x08
 
     def send_body(self, f):
         write_longstring(f, self.query)
+        if self.protocol_version >= 2:
+            write_query_parameters(f, self, ())
 
 class ResultMessage(_MessageType):
     opcode = 0x08
@@ -357,9 +460,19 @@ class ResultMessage(_MessageType):
     }
 
     FLAGS_GLOBAL_TABLES_SPEC = 0x0001
+    FLAGS_HAS_MORE_PAGES     = 0x0002
+    FLAGS_NO_METADATA        = 0x0004
+
+    TYPE_CODE_LIST = 0x0020
+    TYPE_CODE_MAP  = 0x0021
+    TYPE_CODE_SET  = 0x0022
 
     @classmethod
-    def recv_body(cls, f):
+    def recv(cls, f, protocol_version):
+        return cls.recv_body(f, protocol_version)
+
+    @classmethod
+    def recv_body(cls, f, protocol_version=PROTOCOL_VERSION):
         kind = read_int(f)
         if kind == cls.KIND_VOID:
             results = None
@@ -369,27 +482,107 @@ class ResultMessage(_MessageType):
             ksname = read_string(f)
             results = ksname
         elif kind == cls.KIND_PREPARED:
-            results = cls.recv_results_prepared(f)
+            results = cls.recv_results_prepared(f, protocol_version)
         return cls(kind=kind, results=results)
 
     @classmethod
     def recv_results_rows(cls, f):
-        colspecs = cls.recv_results_metadata(f)
+        p = f.tell()
+        f.seek(p + 4)
+        colcount = read_int(f)
+        f.seek(p)
+        colspecs, paging_state = cls.recv_results_metadata(f)
         rowcount = read_int(f)
-        rows = [cls.recv_row(f, len(colspecs)) for x in xrange(rowcount)]
-        return CqlResult(column_metadata=colspecs, rows=rows)
+        rows = [cls.recv_row(f, colcount) for x in xrange(rowcount)]
+        return CqlResult(column_metadata=colspecs, rows=rows, paging_state=paging_state)
 
     @classmethod
-    def recv_results_prepared(self, f):
-        queryid = read_int(f)
-        colspecs = cls.recv_results_metadata(f)
-        return (queryid, colspecs)
+    def recv_results_prepared(cls, f, protocol_version=PROTOCOL_VERSION):
+        """
+        Hand back (queryid, parameter colspecs, result colspecs). Result
+        colspecs are only sent with protocol v2, and are None otherwise.
+        """
+
+        if protocol_version >= 2:
+            queryid = read_short_bytes(f)
+        else:
+            queryid = read_int(f)
+        colspecs = cls.recv_results_metadata(f)[0]
+        resultspecs = None
+        if protocol_version >= 2:
+            resultspecs = cls.recv_results_metadata(f)[0]
+        return (queryid, colspecs, resultspecs)
 
     @classmethod
     def recv_results_metadata(cls, f):
+        """
+        Read a metadata block, handing back a ResultMetadata and the paging
+        state (None unless there are more pages). Parsed blocks are cached by
+        their raw bytes (apart from the paging state), so that the (mostly
+        identical) metadata of repeated queries is only parsed once.
+
+        If the server left the column specs out (see
+        ExecuteMessage.skip_metadata), the ResultMetadata is None.
+        """
+
+        start = f.tell()
+        header = f.read(8)
+        flags = int32_unpack(header[:4])
+        paging_state = None
+        if flags & cls.FLAGS_HAS_MORE_PAGES:
+            paging_state = read_value(f) or None
+        if flags & cls.FLAGS_NO_METADATA:
+            return None, paging_state
+        specstart = f.tell()
+        cls.skip_column_specs(f, flags, int32_unpack(header[4:]))
+        end = f.tell()
+        f.seek(specstart)
+        rawmeta = header + f.read(end - specstart)
+        try:
+            return _result_metadata_cache[rawmeta], paging_state
+        except KeyError:
+            pass
+        f.seek(start)
+        colspecs = ResultMetadata(cls.parse_results_metadata(f))
+        if len(_result_metadata_cache) >= MAX_CACHED_RESULT_METADATA:
+            _result_metadata_cache.clear()
+        _result_metadata_cache[rawmeta] = colspecs
+        return colspecs, paging_state
+
+    @classmethod
+    def skip_column_specs(cls, f, flags, colcount):
+        """
+        Read past the column specs of a metadata block, without decoding
+        anything.
+        """
+
+        glob_tblspec = bool(flags & cls.FLAGS_GLOBAL_TABLES_SPEC)
+        if glob_tblspec:
+            skip_string(f)
+            skip_string(f)
+        for x in xrange(colcount):
+            if not glob_tblspec:
+                skip_string(f)
+                skip_string(f)
+            skip_string(f)
+            cls.skip_type(f)
+
+    @classmethod
+    def skip_type(cls, f):
+        optid = read_short(f)
+        if optid in (cls.TYPE_CODE_LIST, cls.TYPE_CODE_SET):
+            cls.skip_type(f)
+        elif optid == cls.TYPE_CODE_MAP:
+            cls.skip_type(f)
+            cls.skip_type(f)
+
+    @classmethod
+    def parse_results_metadata(cls, f):
         flags = read_int(f)
         glob_tblspec = bool(flags & cls.FLAGS_GLOBAL_TABLES_SPEC)
         colcount = read_int(f)
+        if flags & cls.FLAGS_HAS_MORE_PAGES:
+            read_value(f)  # the paging state
         if glob_tblspec:
             ksname = read_string(f)
             cfname = read_string(f)
@@ -439,13 +632,99 @@ class ExecuteMessage(_MessageType):
     opcode = 0x0A
     name = 'EXECUTE'
     params = ('queryid', 'queryparams')
+    optional_params = QueryMessage.optional_params
 
     def send_body(self, f):
+        if self.protocol_version >= 2:
+            write_short_bytes(f, self.queryid)
+            write_query_parameters(f, self, self.queryparams)
+            return
         write_int(f, self.queryid)
         write_short(f, len(self.queryparams))
         for param in self.queryparams:
             write_value(f, param)
 
+class BatchMessage(_MessageType):
+    """
+    A protocol v2 BATCH. Each of the statements is a (kind, query, values)
+    tuple, where kind is KIND_QUERY with CQL text for the query or
+    KIND_PREPARED with a prepared query id, and values is a list of encoded
+    bound values.
+    """
+
+    opcode = 0x0D
+    name = 'BATCH'
+    params = ('batch_type', 'statements')
+    optional_params = {
+        'consistency_level': 'ONE',
+    }
+
+    batch_types = {
+        'LOGGED':   0,
+        'UNLOGGED': 1,
+        'COUNTER':  2,
+    }
+
+    KIND_QUERY    = 0
+    KIND_PREPARED = 1
+
+    def send_body(self, f):
+        write_byte(f, self.batch_types[self.batch_type.upper()])
+        write_short(f, len(self.statements))
+        for kind, query, values in self.statements:
+            write_byte(f, kind)
+            if kind == self.KIND_PREPARED:
+                write_short_bytes(f, query)
+            else:
+                write_longstring(f, query)
+            write_short(f, len(values))
+            for value in values:
+                write_value(f, value)
+        write_short(f, consistency_levels[self.consistency_level.upper()])
+
+class AuthChallengeMessage(_MessageType):
+    opcode = 0x0E
+    name = 'AUTH_CHALLENGE'
+    params = ('challenge',)
+
+    @classmethod
+    def recv_body(cls, f):
+        return cls(challenge=read_value(f))
+
+class AuthResponseMessage(_MessageType):
+    """
+    A protocol v2 SASL response, which replaces CREDENTIALS.
+    """
+
+    opcode = 0x0F
+    name = 'AUTH_RESPONSE'
+    params = ('response',)
+
+    def send_body(self, f):
+        write_value(f, self.response)
+
+class AuthSuccessMessage(_MessageType):
+    opcode = 0x10
+    name = 'AUTH_SUCCESS'
+    params = ('token',)
+
+    @classmethod
+    def recv_body(cls, f):
+        return cls(token=read_value(f))
+
+def plain_sasl_response(credentials):
+    """
+    The initial response of the SASL PLAIN mechanism, as PasswordAuthenticator
+    expects it: no authorization id, then the username and the password.
+    """
+
+    user, password = credentials['username'], credentials['password']
+    if isinstance(user, unicode):
+        user = user.encode('utf8')
+    if isinstance(password, unicode):
+        password = password.encode('utf8')
+    return '\x00%s\x00%s' % (user, password)
+
 known_event_types = frozenset((
     'TOPOLOGY_CHANGE',
     'STATUS_CHANGE',
@@ -510,6 +789,9 @@ def read_string(f):
     contents = f.read(size)
     return contents.decode('utf8')
 
+def skip_string(f):
+    f.seek(read_short(f), 1)
+
 def write_string(f, s):
     if isinstance(s, unicode):
         s = s.encode('utf8')
@@ -577,6 +859,14 @@ def write_value(f, v):
         write_int(f, len(v))
         f.write(v)
 
+def read_short_bytes(f):
+    size = read_short(f)
+    return f.read(size)
+
+def write_short_bytes(f, b):
+    write_short(f, len(b))
+    f.write(b)
+
 def read_inet(f):
     size = read_byte(f)
     addrbytes = f.read(size)
@@ -601,7 +891,67 @@ def write_inet(f, addrtuple):
     write_int(f, port)
 
 
+def request_size(msg):
+    """
+    The bytes of query text, ids and values in a QUERY or EXECUTE request,
+    as counted by rate limiters (see Cursor.throttle()).
+    """
+
+    if isinstance(msg, ExecuteMessage):
+        if isinstance(msg.queryid, (int, long)):
+            # protocol v1 query ids are ints
+            return 4 + values_size(msg.queryparams)
+        return len(msg.queryid) + values_size(msg.queryparams)
+    return len(msg.query)
+
+class ResultPager(object):
+    """
+    Fetches the further pages of a result paged by the server (protocol v2),
+    by re-sending the original QUERY or EXECUTE request with the paging
+    state of the last page. See Cursor.load_next_page().
+    """
+
+    def __init__(self, request, paging_state, decoder=None):
+        self.request = request
+        self.paging_state = paging_state
+        self.decoder = decoder
+
+    def next_response(self, cursor):
+        if self.paging_state is None:
+            return None
+        self.request.paging_state = self.paging_state
+        cursor.throttle(request_size(self.request))
+        return cursor._connection.wait_for_request(self.request)
+
+    def page_loaded(self, cursor):
+        self.paging_state = cursor.paging_state
+
+    def stop(self):
+        pass
+
 class NativeCursor(Cursor):
+    # number of rows the server should send per page (protocol v2 only). If
+    # set, further pages are fetched as the rows are consumed, and rowcount
+    # is the number of rows in the current page. None gets whole results.
+    page_size = None
+
+    # consistency level for queries (protocol v2 only; with v1 it is part of
+    # the query text)
+    consistency_level = 'ONE'
+
+    # execute_batch() splits batches with more statements than this, or more
+    # bytes of query text, ids and values
+    max_batch_statements = 100
+    max_batch_size = 65536
+
+    def __init__(self, parent_connection):
+        Cursor.__init__(self, parent_connection)
+        self.last_request = None
+        self.paging_state = None
+        # result metadata of the prepared query last executed, for results
+        # sent without any
+        self.expected_metadata = None
+
     def prepare_query(self, query):
         pquery, paramnames = prepare_query(query)
         prepared = self._connection.wait_for_request(PrepareMessage(query=pquery))
@@ -609,20 +959,192 @@ class NativeCursor(Cursor):
             raise cql.Error('Query preparation failed: %s' % prepared.summarymsg())
         if prepared.kind != ResultMessage.KIND_PREPARED:
             raise cql.InternalError('Query preparation did not result in prepared query')
-        queryid, colspecs = prepared.results
-        kss, cfs, names, ctypes = zip(*colspecs)
-        return PreparedQuery(query, queryid, ctypes, paramnames)
+        queryid, colspecs, resultspecs = prepared.results
+        ctypes = [spec[3] for spec in colspecs]
+        pquery = PreparedQuery(query, queryid, ctypes, paramnames)
+        if resultspecs:
+            # with protocol v2, the columns of the results are known up
+            # front, and the server can be asked to leave them out
+            pquery.result_metadata = resultspecs
+        return pquery
 
     def get_response(self, query):
-        return self._connection.wait_for_request(QueryMessage(query=query))
+        return self.query_response(query, self.page_size)
+
+    def get_page_response(self, query):
+        # the page is bounded by the query's LIMIT already; server paging on
+        # top of that would cut it short
+        return self.query_response(query, None)
+
+    def query_response(self, query, page_size):
+        self.last_request = QueryMessage(query=query, page_size=page_size,
+                                         consistency_level=self.consistency_level)
+        self.expected_metadata = None
+        self.throttle(len(query))
+        return self._connection.wait_for_request(self.last_request)
 
     def get_response_prepared(self, prepared_query, params):
-        em = ExecuteMessage(queryid=prepared_query.itemid, queryparams=params)
-        return self._connection.wait_for_request(em)
+        paramvals = prepared_query.encode_params(params)
+        self.expected_metadata = prepared_query.result_metadata
+        self.last_request = ExecuteMessage(queryid=prepared_query.itemid, queryparams=paramvals,
+                                           page_size=self.page_size,
+                                           consistency_level=self.consistency_level,
+                                           skip_metadata=self.expected_metadata is not None)
+        self.throttle(request_size(self.last_request))
+        return self._connection.wait_for_request(self.last_request)
+
+    def execute_batch(self, statements, batch_type='LOGGED'):
+        """
+        Execute a sequence of statements, each a (query, params) pair where
+        query is either a PreparedQuery or CQL text, with protocol v2 BATCH
+        messages. Prepared statements are sent as their ids and encoded
+        values, without being parsed again on the server.
+
+        Statements beyond max_batch_statements or max_batch_size go into
+        further batches, all sent at once. Each batch is applied on its own,
+        so a split LOGGED batch is only atomic batch by batch.
+        """
+
+        if self._connection.protocol_version < 2:
+            raise cql.NotSupportedError("BATCH messages need native protocol v2")
+        self.pre_execution_setup()
+        batches = []
+        current = []
+        cursize = 0
+        for query, params in statements:
+            if isinstance(query, PreparedQuery):
+                stmt = (BatchMessage.KIND_PREPARED, query.itemid, query.encode_params(params))
+            else:
+                stmt = (BatchMessage.KIND_QUERY, self.prepare_inline(query, params), [])
+            stmtsize = len(stmt[1]) + values_size(stmt[2])
+            if current and (len(current) >= self.max_batch_statements
+                            or cursize + stmtsize > self.max_batch_size):
+                batches.append((current, cursize))
+                current = []
+                cursize = 0
+            current.append(stmt)
+            cursize += stmtsize
+        if current:
+            batches.append((current, cursize))
+        if not batches:
+            self.result = []
+            self.description = _VOID_DESCRIPTION
+            return
+        msgs = []
+        for batch, size in batches:
+            self.throttle(size)
+            msgs.append(BatchMessage(batch_type=batch_type, statements=batch,
+                                     consistency_level=self.consistency_level))
+        responses = self._connection.wait_for_requests(*msgs)
+        for response in responses:
+            self.handle_cql_execution_errors(response)
+        return self.process_execution_results(responses[-1])
+
+    def execute_concurrent(self, statement, param_sets, concurrency=100, decoder=None):
+        """
+        Execute one statement (a PreparedQuery, or CQL text) once for each
+        set of params in param_sets, keeping up to concurrency requests in
+        flight at once on this cursor's connection. Return a list with a
+        (success, result) tuple for each params set, in the same order:
+        result is the list of rows fetched if success is true, and the
+        exception raised otherwise. Results are not paged.
+        """
+
+        results = [None] * len(param_sets)
+        for n, success, result in self.iter_concurrent(statement, param_sets,
+                                                       concurrency=concurrency,
+                                                       decoder=decoder):
+            results[n] = (success, result)
+        return results
+
+    def iter_concurrent(self, statement, param_sets, concurrency=100, decoder=None):
+        """
+        Like execute_concurrent(), but yield an (index, success, result)
+        tuple for each params set as its response arrives, where index is
+        the position of the params set in param_sets.
+        """
+
+        conn = self._connection
+        concurrency = max(1, min(concurrency, MAX_STREAM_IDS))
+        self.pre_execution_setup()
+        if isinstance(statement, PreparedQuery):
+            expected_metadata = statement.result_metadata
+        else:
+            expected_metadata = None
+        pending = enumerate(param_sets)
+        unsent = None
+        inflight = {}
+        try:
+            while True:
+                while len(inflight) < concurrency:
+                    if unsent is None:
+                        try:
+                            n, params = pending.next()
+                        except StopIteration:
+                            break
+                        try:
+                            msg = self.concurrent_request(statement, params,
+                                                          expected_metadata)
+                        except Exception, e:
+                            # bad params, or turned away by a rate limiter
+                            yield n, False, e
+                            continue
+                        unsent = (n, msg)
+                    # other threads sharing the connection may hold all the
+                    # stream-ids; if so, wait for our own responses first
+                    reqid = conn.send_msg(unsent[1], block=not inflight)
+                    if reqid is None:
+                        break
+                    inflight[reqid] = unsent[0]
+                    unsent = None
+                if not inflight:
+                    return
+                reqid, response = conn.wait_for_any(inflight)
+                n = inflight.pop(reqid)
+                self.expected_metadata = expected_metadata
+                try:
+                    self.reset_result_info()
+                    self.process_execution_results(response, decoder=decoder)
+                    rows = self.fetchall()
+                except cql.Error, e:
+                    yield n, False, e
+                else:
+                    yield n, True, rows
+        finally:
+            # if iteration was abandoned, the remaining responses still have
+            # to be read to free their stream-ids
+            if inflight:
+                conn.wait_for_results(*inflight)
+
+    def concurrent_request(self, statement, params, expected_metadata):
+        if isinstance(statement, PreparedQuery):
+            msg = ExecuteMessage(queryid=statement.itemid,
+                                 queryparams=statement.encode_params(params),
+                                 consistency_level=self.consistency_level,
+                                 skip_metadata=expected_metadata is not None)
+        else:
+            msg = QueryMessage(query=self.prepare_inline(statement, params),
+                               consistency_level=self.consistency_level)
+        self.throttle(request_size(msg))
+        return msg
 
     def get_column_metadata(self, column_id):
         return self.decoder.decode_metadata_and_type_native(column_id)
 
+    def build_metadata_info(self, colids):
+        # identical metadata blocks share a ResultMetadata object (see
+        # ResultMessage.recv_results_metadata), so this only needs to be
+        # worked out once per distinct metadata and decoder class
+        derived = getattr(self.decoder.schema, 'derived_info', None)
+        if derived is None:
+            return Cursor.build_metadata_info(self, colids)
+        key = (self.decoder.__class__, len(colids))
+        try:
+            return derived[key]
+        except KeyError:
+            info = derived[key] = Cursor.build_metadata_info(self, colids)
+            return info
+
     def columninfo(self, row):
         return xrange(len(row))
 
@@ -653,6 +1175,7 @@ class NativeCursor(Cursor):
         self.description = None
         self.result = []
         self.name_info = ()
+        self.paging_state = None
 
         if response.kind == ResultMessage.KIND_VOID:
             self.description = _VOID_DESCRIPTION
@@ -661,8 +1184,19 @@ class NativeCursor(Cursor):
             self.description = _VOID_DESCRIPTION
         elif response.kind == ResultMessage.KIND_ROWS:
             schema = response.results.column_metadata
+            if schema is None:
+                schema = self.expected_metadata
+                if schema is None:
+                    raise cql.InternalError("Result has no metadata")
+                rows = response.results.rows
+                if rows and len(rows[0]) != len(schema):
+                    raise cql.ProgrammingError("Result columns don't match the prepared"
+                                               " query; it needs to be prepared again")
             self.decoder = (decoder or self.default_decoder)(schema)
             self.result = response.results.rows
+            self.paging_state = response.results.paging_state
+            if self.paging_state is not None and self.pager is None:
+                self.pager = ResultPager(self.last_request, self.paging_state, decoder)
             if self.result:
                 self.get_metadata_info(self.result[0])
         else:
@@ -679,47 +1213,139 @@ class NativeCursor(Cursor):
 
     compression = property(get_compression, set_compression)
 
-class debugsock:
-    def __init__(self, sock):
-        self.sock = sock
+class Transport(object):
+    """
+    Moves the bytes of a NativeConnection to and from the server. A
+    transport factory is called with the connection (which has host and
+    port attributes) each time it connects, and hands back an open
+    transport.
+
+    Transports are used in one of two ways:
+
+    * With background_reads false, the threads waiting for responses read
+      them, by calling read() (one thread at a time), which blocks until
+      exactly size bytes have arrived.
+    * With background_reads true, the transport reads by itself (say, on an
+      event loop's thread), and hands the bytes over as they arrive to the
+      connection's data_received(), or calls its connection_lost() with an
+      exception when the connection breaks. read() is not used.
+
+    write() is called by one thread at a time with the bytes of one or more
+    whole frames. It may queue them (it should, if background_reads is
+    true) rather than wait for them to be sent. close() must not wait.
+    """
+
+    background_reads = False
 
     def write(self, data):
-        print '[sending %r]' % (data,)
-        self.sock.send(data)
-
-    def read(self, readlen):
-        data = ''
-        while readlen > 0:
-            add = self.sock.recv(readlen)
-            print '[received %r]' % (add,)
-            if add == '':
-                raise cql.InternalError("short read of %s bytes (%s expected)"
-                                        % (len(data), len(data) + readlen))
-            data += add
-            readlen -= len(add)
-        return data
+        raise NotImplementedError()
+
+    def read(self, size):
+        raise NotImplementedError()
 
     def close(self):
-        pass
+        raise NotImplementedError()
+
+class SocketTransport(Transport):
+    """
+    The default transport: a blocking TCP socket.
+    """
+
+    def __init__(self, connection):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.connect((connection.host, connection.port))
+        self.sockf = self.sock.makefile(bufsize=0)
+
+    def write(self, data):
+        self.sockf.write(data)
+
+    def read(self, size):
+        return self.sockf.read(size)
+
+    def close(self):
+        self.sockf.close()
+        self.sock.close()
+
+class DebugSocketTransport(SocketTransport):
+    """
+    A SocketTransport printing out everything sent and received.
+    """
+
+    def write(self, data):
+        print '[sending %r]' % (data,)
+        SocketTransport.write(self, data)
+
+    def read(self, size):
+        data = SocketTransport.read(self, size)
+        print '[received %r]' % (data,)
+        return data
 
 class NativeConnection(Connection):
+    """
+    A connection over the native protocol. Unlike Thrift connections, these
+    can be shared between threads (each with its own cursors): requests from
+    all of them are multiplexed over the one socket, by stream-id.
+
+    The bytes go over a SocketTransport unless a transport_factory keyword
+    argument is given (see Transport), such as the transport_factory method
+    of a cql.reactor.Reactor. An in_flight_limiter keyword argument (see
+    cql.throttle) caps the requests in flight, which are otherwise limited
+    only by the number of stream-ids.
+    """
+
     cursorclass = NativeCursor
 
     def __init__(self, *args, **kwargs):
-        self.make_reqid = itertools.count().next
-        self.responses = {}
-        self.waiting = {}
+        # called with this connection to open a Transport
+        self.transport_factory = kwargs.pop('transport_factory', None) or SocketTransport
+        # a cql.throttle.InFlightLimiter for the requests on this connection
+        self.in_flight_limiter = kwargs.pop('in_flight_limiter', None)
+        # guards the stream-id bookkeeping; writes to the socket are
+        # serialized separately
+        self.lock = Condition()
+        self.write_lock = Lock()
+        self.reset_streams()
         self.conn_ready = False
         Connection.__init__(self, *args, **kwargs)
 
+    def clone_options(self):
+        return {'transport_factory': self.transport_factory}
+
+    def open_connection_socket(self):
+        self.transport = self.transport_factory(self)
+        self.open_socket = True
+
+    def reset_streams(self):
+        self.free_reqids = range(MAX_STREAM_IDS - 1, -1, -1)
+        self.responses = {}
+        self.waiting = {}
+        self.reading = False
+        self.error = None
+        # stream-id -> when its request was sent, for the in_flight_limiter
+        self.sent_at = {}
+        # partial frame state for data_received()
+        self.in_chunks = []
+        self.in_len = 0
+        self.in_header = None
+        self.in_needed = 8
+
     def establish_connection(self):
         self.conn_ready = False
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((self.host, self.port))
-        self.socketf = s.makefile(bufsize=0)
-        self.sockfd = s
-        self.open_socket = True
-        supported = self.wait_for_request(OptionsMessage())
+        self.reset_streams()
+        # ask for the newest protocol version we know, and fall back to v1 if
+        # the server won't speak it
+        self.protocol_version = MAX_PROTOCOL_VERSION
+        self.open_connection_socket()
+        try:
+            supported = self.wait_for_request(OptionsMessage())
+        except (socket.error, cql.InternalError):
+            supported = None
+        if not isinstance(supported, SupportedMessage):
+            self.terminate_connection()
+            self.reset_streams()
+            self.protocol_version = PROTOCOL_VERSION
+            self.open_connection_socket()
+            supported = self.wait_for_request(OptionsMessage())
         self.supported_cql_versions = supported.cqlversions
         self.supported_compressions = supported.options['COMPRESSION']
 
@@ -752,8 +1378,19 @@ class NativeConnection(Connection):
                 self.authenticator = startup_response.authenticator
                 if self.credentials is None:
                     raise ProgrammingError('Remote end requires authentication.')
-                cm = CredentialsMessage(creds=self.credentials)
+                if self.protocol_version >= 2:
+                    # protocol v2 drops CREDENTIALS for SASL exchanges
+                    cm = AuthResponseMessage(response=plain_sasl_response(self.credentials))
+                else:
+                    cm = CredentialsMessage(creds=self.credentials)
                 startup_response = self.wait_for_request(cm)
+            elif isinstance(startup_response, AuthSuccessMessage):
+                self.conn_ready = True
+                break
+            elif isinstance(startup_response, AuthChallengeMessage):
+                raise ProgrammingError("Authenticator %r sent a SASL challenge; only"
+                                       " PLAIN authentication is supported"
+                                       % self.authenticator)
             elif isinstance(startup_response, ErrorMessage):
                 raise ProgrammingError("Server did not accept credentials. %s"
                                        % startup_response.summarymsg())
@@ -768,8 +1405,7 @@ class NativeConnection(Connection):
         c.close()
 
     def terminate_connection(self):
-        self.socketf.close()
-        self.sockfd.close()
+        self.transport.close()
 
     def wait_for_request(self, msg):
         """
@@ -784,16 +1420,247 @@ class NativeConnection(Connection):
         Given any number of message objects, send them all to the server
         and wait for responses to each one. Once they arrive, return all
         of the responses in the same order as the messages to which they
-        respond.
+        respond. More messages than there are free stream ids are sent a
+        window at a time.
+        """
+
+        responses = []
+        while len(responses) < len(msgs):
+            reqids = self.send_msgs(msgs[len(responses):])
+            resultdict = self.wait_for_results(*reqids)
+            responses.extend([resultdict[reqid] for reqid in reqids])
+        return responses
+
+    def send_msgs(self, msgs, block=True):
+        """
+        Send as many of the given messages as there are free stream-ids for
+        (waiting for at least one to be freed, if block is true), and return
+        the stream-ids they were sent on, in order. The responses must then
+        be waited for (or callbacks set up for them), which frees the
+        stream-ids again.
+
+        With an in_flight_limiter, at least one message is only sent once
+        the limiter admits it (which may raise cql.TooManyRequests), and the
+        rest only as far as it admits them straight away.
+        """
+
+        limiter = self.in_flight_limiter
+        if limiter is not None:
+            admitted = limiter.acquire_available(len(msgs))
+            if block:
+                # requests held by callbacks are only finished when somebody
+                # reads
+                self.lock.acquire()
+                try:
+                    while not admitted and self.read_for_callbacks():
+                        admitted = limiter.acquire_available(len(msgs))
+                finally:
+                    self.lock.release()
+                if not admitted:
+                    limiter.acquire()
+                    admitted = 1 + limiter.acquire_available(len(msgs) - 1)
+            msgs = msgs[:admitted]
+        try:
+            reqids = self.make_reqids(len(msgs), block)
+        except:
+            if limiter is not None:
+                limiter.release(len(msgs))
+            raise
+        if limiter is not None:
+            if len(reqids) < len(msgs):
+                limiter.release(len(msgs) - len(reqids))
+            now = time()
+            for reqid in reqids:
+                self.sent_at[reqid] = now
+        self.write_lock.acquire()
+        try:
+            for reqid, msg in zip(reqids, msgs):
+                msg.send(self.transport, reqid, protocol_version=self.protocol_version)
+        finally:
+            self.write_lock.release()
+        return reqids
+
+    def send_msg(self, msg, block=True):
+        """
+        Send a message on a free stream-id, and return the stream-id, or None
+        if block is false and none is free.
+        """
+
+        reqids = self.send_msgs([msg], block)
+        if not reqids:
+            return None
+        return reqids[0]
+
+    def release_reqid(self, reqid, response):
+        # called with self.lock held
+        self.free_reqids.append(reqid)
+        self.lock.notifyAll()
+        if self.in_flight_limiter is not None:
+            latency = time() - self.sent_at.pop(reqid)
+            self.in_flight_limiter.finished(latency, isinstance(response, overload_errors))
+
+    def make_reqids(self, count, block=True):
+        self.lock.acquire()
+        try:
+            if self.error is not None:
+                raise self.error
+            while not self.free_reqids:
+                if not block:
+                    return []
+                if self.error is not None:
+                    raise self.error
+                # the stream-ids may all be held by callbacks, which only get
+                # called when somebody reads
+                if not self.read_for_callbacks():
+                    self.lock.wait()
+            count = min(count, len(self.free_reqids))
+            if count == 0:
+                return []
+            reqids = self.free_reqids[-count:]
+            del self.free_reqids[-count:]
+            reqids.reverse()
+            return reqids
+        finally:
+            self.lock.release()
+
+    def read_for_callbacks(self):
+        """
+        Read a frame if there are callbacks waiting for responses and nobody
+        else is reading, and return whether one was read. Called with
+        self.lock held.
+        """
+
+        if self.reading or self.transport.background_reads or not self.waiting:
+            return False
+        self.read_and_dispatch()
+        return True
+
+    def read_and_dispatch(self):
+        """
+        Read one frame from the socket, and hand it to the callback waiting
+        for its stream-id, or keep it for the thread waiting for it. Only
+        one thread reads at a time; it must hold self.lock, which is
+        released while reading.
         """
 
-        reqids = []
-        for msg in msgs:
-            reqid = self.make_reqid()
-            reqids.append(reqid)
-            msg.send(self.socketf, reqid)
-        resultdict = self.wait_for_results(*reqids)
-        return [resultdict[reqid] for reqid in reqids]
+        self.reading = True
+        self.lock.release()
+        error = None
+        try:
+            msg = read_frame(self.transport)
+        except (socket.error, cql.InternalError), error:
+            raise
+        finally:
+            self.lock.acquire()
+            self.reading = False
+            if error is not None:
+                # nothing more can be read off the socket, so the threads
+                # waiting for responses raise the error too, rather than
+                # taking turns at reading
+                self.error = error
+            self.lock.notifyAll()
+        self.dispatch(msg)
+
+    def dispatch(self, msg):
+        # called with self.lock held
+        try:
+            cb = self.waiting.pop(msg.stream_id)
+        except KeyError:
+            self.responses[msg.stream_id] = msg
+            self.lock.notifyAll()
+            return
+        self.release_reqid(msg.stream_id, msg)
+        self.lock.release()
+        try:
+            try:
+                cb(msg)
+            except Exception, e:
+                # the callback's failure is its own; the thread calling it
+                # (often a reactor's) has other responses to hand out
+                warn("Callback %r for %r raised %r" % (cb, msg, e))
+        finally:
+            self.lock.acquire()
+
+    def data_received(self, data):
+        """
+        Take in bytes read by the transport (see Transport), and dispatch
+        any frames they complete.
+        """
+
+        self.in_chunks.append(data)
+        self.in_len += len(data)
+        while self.in_len >= self.in_needed:
+            buf = ''.join(self.in_chunks)
+            if self.in_header is None:
+                self.in_header = buf[:8]
+                self.in_needed = check_frame_header(self.in_header)
+                buf = buf[8:]
+                msg = None
+            else:
+                msg = decode_frame(self.in_header, buf[:self.in_needed])
+                buf = buf[self.in_needed:]
+                self.in_header = None
+                self.in_needed = 8
+            self.in_chunks = [buf]
+            self.in_len = len(buf)
+            if msg is not None:
+                self.lock.acquire()
+                try:
+                    self.dispatch(msg)
+                finally:
+                    self.lock.release()
+
+    def connection_lost(self, exc):
+        """
+        Called when the transport (see Transport) finds the connection
+        closed or broken. Threads waiting for responses, and any later
+        requests, raise exc.
+        """
+
+        self.lock.acquire()
+        try:
+            self.error = exc
+            self.lock.notifyAll()
+        finally:
+            self.lock.release()
+
+    def wait_for_frames(self):
+        # called with self.lock held, by a thread that needs a response (or
+        # a stream-id)
+        if self.error is not None:
+            raise self.error
+        if self.reading or self.transport.background_reads:
+            self.lock.wait()
+        else:
+            self.read_and_dispatch()
+
+    def collect_responses(self, reqids, wait_for_all=True):
+        """
+        Wait until responses have arrived for all of the given stream-ids
+        (or just one of them, unless wait_for_all), and return a dictionary
+        mapping their stream-ids to them. Whichever waiting thread gets to
+        it first reads frames off the socket for all of them.
+        """
+
+        waiting_for = set(reqids)
+        results = {}
+        self.lock.acquire()
+        try:
+            while True:
+                for r in list(waiting_for):
+                    try:
+                        results[r] = self.responses.pop(r)
+                    except KeyError:
+                        continue
+                    self.release_reqid(r, results[r])
+                    waiting_for.remove(r)
+                    if not wait_for_all:
+                        break
+                if not waiting_for or (results and not wait_for_all):
+                    return results
+                self.wait_for_frames()
+        finally:
+            self.lock.release()
 
     def wait_for_results(self, *reqids):
         """
@@ -802,24 +1669,15 @@ class NativeConnection(Connection):
         appropriate results.
         """
 
-        waiting_for = set(reqids)
-        results = {}
-        for r in reqids:
-            try:
-                result = self.responses.pop(r)
-            except KeyError:
-                pass
-            else:
-                results[r] = result
-                waiting_for.remove(r)
-        while waiting_for:
-            newmsg = read_frame(self.socketf)
-            if newmsg.stream_id in waiting_for:
-                results[newmsg.stream_id] = newmsg
-                waiting_for.remove(newmsg.stream_id)
-            else:
-                self.handle_incoming(newmsg)
-        return results
+        return self.collect_responses(reqids)
+
+    def wait_for_any(self, reqids):
+        """
+        Given a collection of stream-ids, wait until a response has arrived
+        for any one of them, and return a (stream-id, msg) tuple.
+        """
+
+        return self.collect_responses(reqids, wait_for_all=False).popitem()
 
     def wait_for_result(self, reqid):
         """
@@ -829,17 +1687,6 @@ class NativeConnection(Connection):
 
         return self.wait_for_results(reqid)[reqid]
 
-    def handle_incoming(self, msg):
-        if msg.stream_id < 0:
-            self.handle_pushed(msg)
-            return
-        try:
-            cb = self.waiting.pop(msg.stream_id)
-        except KeyError:
-            self.responses[msg.stream_id] = msg
-        else:
-            cb(msg)
-
     def callback_when(self, reqid, cb):
         """
         Callback cb with a message object once a message with a stream-id
@@ -848,16 +1695,21 @@ class NativeConnection(Connection):
 
         Otherwise, note also that the callback may not be called immediately
         upon the arrival of the response packet; it may have to wait until
-        something else waits on a result.
+        something else waits on a result. It is called on whichever thread
+        reads the response.
         """
 
+        self.lock.acquire()
         try:
-            msg = self.responses.pop(reqid)
-        except KeyError:
-            pass
-        else:
-            return cb(msg)
-        self.waiting[reqid] = cb
+            try:
+                msg = self.responses.pop(reqid)
+            except KeyError:
+                self.waiting[reqid] = cb
+                return
+            self.release_reqid(reqid, msg)
+        finally:
+            self.lock.release()
+        return cb(msg)
 
     def request_and_callback(self, msg, cb):
         """
@@ -867,6 +1719,5 @@ class NativeConnection(Connection):
         it may have to wait until something else waits on a result.
         """
 
-        reqid = self.make_reqid()
-        msg.send(self.socketf, reqid)
+        reqid = self.send_msg(msg)
         self.callback_when(reqid, cb)
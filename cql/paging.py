@@ -0,0 +1,418 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Client-side paging of big SELECT results, for either transport. Usually used
+via Cursor.execute_paged():
+
+    >>> cursor.execute_paged("SELECT * FROM events", key='id', clustering='ts',
+    ...                      page_size=500)
+    >>> for row in cursor:
+    ...     process(row)
+
+The SELECT is sent with a LIMIT of page_size, and once the rows of a page
+have been consumed, the next page is asked for starting after the last row
+seen: within the same partition first, by clustering columns, and then from
+the next partition on, by token (or by KEY, for CQL 2). Only one page of
+rows is held in memory at a time.
+
+Tables with several clustering columns are paged by all of them, one slice
+at a time; after a page ending at (c1, c2) = (x, y):
+
+    ... WHERE k = ... AND c1 = x AND c2 > y
+    ... WHERE k = ... AND c1 > x
+
+Single CQL 2 rows with too many columns to fetch at once can be paged
+through column by column with Cursor.iter_columns(), which uses FIRST N
+column range selections:
+
+    >>> for name, value in cursor.iter_columns('Timeline', 'user1', page_size=1000):
+    ...     process(name, value)
+"""
+
+import re
+from Queue import Queue, Empty
+from threading import Thread
+import cql
+from cql.cqltypes import BytesType, DateType, CompositeType
+from cql.query import cql_quote
+
+__all__ = ['QueryPager', 'ReadAhead', 'iter_row_columns']
+
+select_re = re.compile(r'''
+    ^ \s* (?P<select> SELECT \s .+? \s FROM \s+ \S+
+           (?: \s+ USING \s+ CONSISTENCY \s+ \w+ )? )
+    (?: \s+ WHERE \s+ (?P<where> .+? ) )?
+    (?: \s+ ORDER \s+ BY \s+ (?P<order_by> .+? ) )?
+    (?: \s+ LIMIT \s+ (?P<limit> \d+ ) )?
+    (?P<allow_filtering> \s+ ALLOW \s+ FILTERING )?
+    \s* ;? \s* $
+''', re.IGNORECASE | re.VERBOSE | re.DOTALL)
+
+# clauses that would end up in the WHERE clause when select_re can't make
+# sense of what follows it
+trailing_clause_re = re.compile(r'\b(?:ORDER\s+BY|LIMIT|ALLOW\s+FILTERING|USING)\b',
+                                re.IGNORECASE)
+string_literal_re = re.compile(r"'(?:[^']|'')*'")
+
+def cql_literal(value, vtype):
+    """
+    Represent a value decoded from a result set as a CQL term of the given
+    type.
+    """
+
+    if value is None:
+        raise cql.ProgrammingError("Can't page on a null value")
+    if issubclass(vtype, BytesType):
+        return "'%s'" % value.encode('hex')
+    if issubclass(vtype, DateType):
+        return str(long(round(value * 1000)))
+    if isinstance(value, float):
+        return repr(value)
+    return cql_quote(value)
+
+class QueryPager(object):
+    """
+    Works out the query for each page of a paged SELECT. Cursors call
+    next_response() to fetch each page, and page_loaded() once they have
+    processed its results.
+
+    Params:
+    * query ......: the SELECT, with any parameters already substituted.
+                    Must be of the form "SELECT ... FROM cf [WHERE ...]
+                    [ORDER BY ...] [LIMIT n] [ALLOW FILTERING]".
+    * page_size ..: number of rows to ask for at a time.
+    * key ........: name of the partition key column, or a tuple of names for
+                    composite partition keys. Pages are resumed from the token
+                    of the last partition seen. Must be among the selected
+                    columns. Defaults to 'KEY' for CQL 2, and may be left out
+                    for CQL 3 if the WHERE clause selects a single partition.
+    * clustering .: name of the clustering column, or a tuple of the names of
+                    all the clustering columns in order, for tables that have
+                    them. Within a partition, pages are resumed after the last
+                    values seen for them. Naming only some of them skips rows.
+                    Clustering columns are taken to be in ascending order
+                    unless ORDER BY says otherwise, so a table declared WITH
+                    CLUSTERING ORDER BY (c DESC) needs "ORDER BY c DESC".
+    """
+
+    def __init__(self, query, page_size, cql_major_version, key=None, clustering=None,
+                 decoder=None):
+        match = select_re.match(query)
+        if match is None:
+            raise cql.ProgrammingError("Only simple SELECT statements can be paged: %r"
+                                       % (query,))
+        self.select = match.group('select')
+        self.where = match.group('where')
+        if self.where is not None and \
+                trailing_clause_re.search(string_literal_re.sub("''", self.where)):
+            raise cql.ProgrammingError("Unsupported clauses in paged SELECT: %r"
+                                       % (query,))
+        self.order_by = match.group('order_by')
+        self.limit = match.group('limit') and int(match.group('limit'))
+        self.allow_filtering = match.group('allow_filtering') is not None
+        self.page_size = page_size
+        self.cql_major_version = cql_major_version
+        if isinstance(key, basestring):
+            key = (key,)
+        if key is None and cql_major_version < 3:
+            key = ('KEY',)
+        if key is None and clustering is None:
+            raise cql.ProgrammingError("A key or a clustering column must be given"
+                                       " to page through a query")
+        if isinstance(clustering, basestring):
+            clustering = (clustering,)
+        self.key = key
+        self.clustering = clustering
+        self.descending = self.clustering_order()
+        self.decoder = decoder
+
+        self.returned = 0
+        self.page_limit = None
+        self.within_partition = None
+        # the clustering values of the last row of the last full page, and
+        # how many of them the current query holds equal
+        self.bounds = None
+        self.level = 0
+        self.pending_query = self.build_query([])
+
+    def clustering_order(self):
+        """
+        Work out from the ORDER BY clause whether each clustering column is
+        paged through in descending order. Columns it doesn't name follow
+        the first one it does.
+        """
+
+        if self.clustering is None:
+            return None
+        descending = {}
+        first = False
+        if self.order_by is not None:
+            for n, item in enumerate(self.order_by.split(',')):
+                words = item.split()
+                if len(words) not in (1, 2) or \
+                        (len(words) == 2 and words[1].upper() not in ('ASC', 'DESC')):
+                    raise cql.ProgrammingError("Can't page by ORDER BY %s" % self.order_by)
+                desc = len(words) == 2 and words[1].upper() == 'DESC'
+                descending[words[0].lower()] = desc
+                if n == 0:
+                    first = desc
+        return [descending.get(name.lower(), first) for name in self.clustering]
+
+    def build_query(self, conditions):
+        if self.where is not None:
+            conditions = [self.where] + conditions
+        query = self.select
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        if self.order_by is not None:
+            query += ' ORDER BY ' + self.order_by
+        self.page_limit = self.page_size
+        if self.limit is not None:
+            self.page_limit = min(self.page_limit, self.limit - self.returned)
+        query += ' LIMIT %d' % self.page_limit
+        if self.allow_filtering:
+            query += ' ALLOW FILTERING'
+        return query
+
+    def next_response(self, cursor):
+        """
+        Send the query for the next page with the given cursor, and hand back
+        the response, or None if there are no more pages.
+        """
+
+        if self.pending_query is None:
+            return None
+        return cursor.get_page_response(self.pending_query)
+
+    def stop(self):
+        pass
+
+    def page_loaded(self, cursor):
+        """
+        Record the results of the last page in the given cursor, and work
+        out the query for the next one.
+        """
+
+        self.pending_query = None
+        numrows = len(cursor.result)
+        self.returned += numrows
+        if self.limit is not None and self.returned >= self.limit:
+            return
+        if numrows == 0:
+            lastvals = None
+        else:
+            lastvals = self.last_row_values(cursor)
+        within_partition = self.within_partition
+        if numrows < self.page_limit:
+            if self.level > 0:
+                # the end of a slice of the partition; widen it by one column
+                self.level -= 1
+                self.pending_query = self.build_query(self.in_partition(within_partition)
+                                                      + self.after_clustering())
+                return
+            # the end of the partition, or of the whole result
+            if within_partition is None or self.key is None:
+                return
+            self.within_partition = None
+            self.pending_query = self.build_query([self.after_partition(within_partition)])
+            return
+        if self.clustering is not None:
+            if self.key is not None:
+                within_partition = [lastvals[k] for k in self.key]
+            self.within_partition = within_partition
+            self.bounds = [lastvals[c] for c in self.clustering]
+            self.level = len(self.clustering) - 1
+            self.pending_query = self.build_query(self.in_partition(within_partition)
+                                                  + self.after_clustering())
+        else:
+            self.pending_query = self.build_query(
+                    [self.after_partition([lastvals[k] for k in self.key])])
+
+    def last_row_values(self, cursor):
+        """
+        Hand back a dict mapping the key and clustering column names to their
+        values (as CQL terms) in the last row of the cursor's current page.
+        """
+
+        lastrow = cursor.result[-1]
+        cursor.get_metadata_info(lastrow)
+        values = list(cursor.decode_row(lastrow))
+        names = [d[0] for d in cursor.description]
+        lowernames = [isinstance(n, basestring) and n.lower() for n in names]
+        wanted = list(self.key or ()) + list(self.clustering or ())
+        found = {}
+        for colname in wanted:
+            if colname in names:
+                idx = names.index(colname)
+            elif colname.lower() in lowernames:
+                idx = lowernames.index(colname.lower())
+            else:
+                raise cql.ProgrammingError("Column %r must be selected to page through"
+                                           " the query" % (colname,))
+            found[colname] = cql_literal(values[idx], cursor.column_types[idx])
+        return found
+
+    def in_partition(self, keyvals):
+        if keyvals is None:
+            return []
+        return ['%s = %s' % pair for pair in zip(self.key, keyvals)]
+
+    def after_clustering(self):
+        level = self.level
+        conditions = ['%s = %s' % pair
+                      for pair in zip(self.clustering[:level], self.bounds[:level])]
+        op = self.descending[level] and '<' or '>'
+        conditions.append('%s %s %s' % (self.clustering[level], op, self.bounds[level]))
+        return conditions
+
+    def after_partition(self, keyvals):
+        if self.cql_major_version < 3:
+            return '%s > %s' % (self.key[0], keyvals[0])
+        return 'token(%s) > token(%s)' % (', '.join(self.key), ', '.join(keyvals))
+
+class ReadAhead(object):
+    """
+    Wraps another pager (like a QueryPager), fetching up to depth pages
+    ahead of the cursor consuming them, on a background thread with its own
+    connection. The connection is closed when the pages run out or the
+    cursor stops paging.
+    """
+
+    def __init__(self, pager, connection, depth, statement_class=None):
+        self.pager = pager
+        self.statement_class = statement_class
+        self.decoder = pager.decoder
+        self.connection = connection
+        self.pages = Queue(maxsize=depth)
+        self.stopped = False
+        self.finished = False
+        self.worker = Thread(target=self.fetch_pages)
+        self.worker.setDaemon(True)
+        self.worker.start()
+
+    def fetch_pages(self):
+        try:
+            try:
+                cursor = self.connection.cursor()
+                cursor.statement_class = self.statement_class
+                while not self.stopped:
+                    response = self.pager.next_response(cursor)
+                    if response is None:
+                        break
+                    # the next page's query may depend on this one's rows
+                    cursor.reset_result_info()
+                    cursor.process_execution_results(response, decoder=self.decoder)
+                    self.pager.page_loaded(cursor)
+                    self.pages.put(('page', response))
+            except Exception, e:
+                self.pages.put(('error', e))
+        finally:
+            self.connection.close()
+            self.pages.put(('done', None))
+
+    def next_response(self, cursor):
+        if self.finished:
+            return None
+        kind, val = self.pages.get()
+        if kind == 'error':
+            self.finished = True
+            raise val
+        if kind == 'done':
+            self.finished = True
+            return None
+        return val
+
+    def page_loaded(self, cursor):
+        pass
+
+    def stop(self):
+        """
+        Stop fetching, discarding any pages fetched but not consumed yet.
+        """
+
+        self.stopped = True
+        while self.worker.isAlive():
+            try:
+                self.pages.get(timeout=0.1)
+            except Empty:
+                pass
+        self.worker.join()
+
+def iter_row_columns(cursor, column_family, key, page_size=1000, start='', decoder=None,
+                     key_alias='KEY'):
+    """
+    Page through the columns of one CQL 2 row, page_size columns at a time,
+    starting at the column named start (or at the first column), and yield
+    a (name, value) tuple for each. The key is quoted as a CQL term like
+    query parameters are; key_alias is the name the row key comes back
+    under. All the pages are decoded with one decoder, made from the schema
+    of the first, so that the types it has parsed carry over from page to
+    page; the column names it caches are dropped after each page.
+    """
+
+    if cursor.cql_major_version >= 3:
+        raise cql.NotSupportedError("Column paging is only supported for CQL 2; use"
+                                    " Cursor.execute_paged() with a clustering column")
+    # the range start is inclusive, so every page after the first repeats a
+    # column
+    page_size = max(page_size, 2)
+    query = "SELECT FIRST %d %%s..'' FROM %s WHERE KEY = %s" \
+            % (page_size, cql_quote(column_family), cql_quote(key))
+    startterm = cql_quote(start)
+    lastname = None
+    rowdecoder = None
+    while True:
+        cursor.pre_execution_setup()
+        response = cursor.get_response(query % (startterm,))
+        if rowdecoder is None:
+            rowdecoder = (decoder or cursor.default_decoder)(response.schema)
+        else:
+            rowdecoder.forget_column_names()
+        cursor.decoder = rowdecoder
+        cursor.load_rows(response)
+        if not cursor.result:
+            return
+        row = cursor.result[0]
+        names = list(cursor.columninfo(row))
+        values = cursor.columnvalues(row)
+        # CQL 2 includes the row key in column range selections, ahead of
+        # the columns, unless it was asked for as a column itself
+        first = 0
+        if names and names[0] == key_alias:
+            # going by the value type alone, as the name needn't be declared
+            schema = rowdecoder.schema
+            vtype = rowdecoder.lookup_casstype(schema.value_types.get(key_alias,
+                                                                      schema.default_value_type))
+            try:
+                if rowdecoder.decode_value(values[0], vtype, key_alias) == key:
+                    first = 1
+            except cql.ProgrammingError:
+                pass
+        numcolumns = len(names) - first
+        if first < len(names) and names[first] == lastname:
+            first += 1
+        for n in xrange(first, len(names)):
+            name, nbytes, vtype, ctype = rowdecoder.decode_metadata_and_type(names[n])
+            yield name, rowdecoder.decode_value(values[n], vtype, name)
+        if numcolumns < page_size:
+            return
+        lastname = names[-1]
+        name, nbytes, vtype, ctype = rowdecoder.decode_metadata_and_type(lastname)
+        if issubclass(ctype, CompositeType):
+            raise cql.NotSupportedError("Column paging is not supported for composite"
+                                        " column names")
+        startterm = cql_literal(name, ctype)
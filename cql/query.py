@@ -52,6 +52,8 @@ class PreparedQuery(object):
         self.itemid = itemid
         self.vartypes = map(lookup_casstype, vartypes)
         self.paramnames = paramnames
+        # the columns of the query's results, where known (see NativeCursor)
+        self.result_metadata = None
         if len(self.vartypes) != len(self.paramnames):
             raise ProgrammingError("Length of variable types list is not the same"
                                    " length as the list of parameter names")
@@ -59,6 +61,14 @@ class PreparedQuery(object):
     def encode_params(self, params):
         return [t.to_binary(t.validate(params[n])) for (n, t) in zip(self.paramnames, self.vartypes)]
 
+def values_size(values):
+    """
+    The number of bytes in a list of encoded values, as handed back by
+    PreparedQuery.encode_params().
+    """
+
+    return sum([len(v) for v in values if v is not None])
+
 def prepare_inline(query, params):
     """
     For every match of the form ":param_name", call cql_quote
@@ -0,0 +1,328 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+An event loop driving the sockets of any number of native protocol
+connections from one I/O thread, so that the number of connections open
+doesn't depend on the number of threads using them:
+
+    >>> reactor = Reactor()
+    >>> conns = [cql.connect(host, 9042, 'ks', reactor=reactor) for host in hosts]
+    >>> cursor = conns[0].cursor()
+    >>> cursor.execute("SELECT * FROM users")
+
+Passing a reactor to cql.connect() is the same as passing its
+transport_factory method to NativeConnection (see cql.native.Transport).
+
+The sockets are non-blocking, and polled with epoll (or poll, where epoll
+is not available). The bytes read are parsed into frames as they arrive,
+and responses are handed to the threads waiting for them, or to their
+callbacks (see NativeConnection.request_and_callback()), which are called
+on the I/O thread; an exception raised by a callback is reported with
+warnings.warn() and otherwise ignored. Should the I/O thread itself fail,
+the connections it drives are cut off with the error.
+"""
+
+import os
+import errno
+import select
+import socket
+from threading import Thread, Lock
+import cql
+from cql.native import Transport
+
+__all__ = ['Reactor', 'ReactorTransport', 'default_reactor']
+
+if hasattr(select, 'epoll'):
+    POLL_READ = select.EPOLLIN
+    POLL_WRITE = select.EPOLLOUT
+    POLL_ERROR = select.EPOLLERR | select.EPOLLHUP
+elif hasattr(select, 'poll'):
+    POLL_READ = select.POLLIN
+    POLL_WRITE = select.POLLOUT
+    POLL_ERROR = select.POLLERR | select.POLLHUP | select.POLLNVAL
+
+RECV_SIZE = 65536
+
+class Poller(object):
+    """
+    epoll or poll, whichever is available, with timeouts in seconds.
+    """
+
+    def __init__(self):
+        if hasattr(select, 'epoll'):
+            self.poller = select.epoll()
+            self.timeout_scale = 1
+        elif hasattr(select, 'poll'):
+            self.poller = select.poll()
+            self.timeout_scale = 1000
+        else:
+            raise cql.NotSupportedError("The reactor needs select.epoll or select.poll")
+
+    def register(self, fd, events):
+        self.poller.register(fd, events)
+
+    def modify(self, fd, events):
+        self.poller.modify(fd, events)
+
+    def unregister(self, fd):
+        self.poller.unregister(fd)
+
+    def poll(self, timeout):
+        return self.poller.poll(timeout * self.timeout_scale)
+
+class Reactor(object):
+    """
+    Polls the sockets of its transports on one background thread, handing
+    what arrives to their connections and writing out what they send.
+    """
+
+    def __init__(self, poll_interval=1.0):
+        self.poll_interval = poll_interval
+        self.poller = Poller()
+        self.lock = Lock()
+        # fd -> ReactorTransport
+        self.transports = {}
+        # fd -> list of strings waiting to be written
+        self.outgoing = {}
+        # fds with outgoing data the poller doesn't know of yet
+        self.new_writes = set()
+        self.closed = False
+        # what stopped the I/O thread, if it failed
+        self.error = None
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        for fd in (self.wakeup_r, self.wakeup_w):
+            set_nonblocking(fd)
+        self.poller.register(self.wakeup_r, POLL_READ)
+        self.thread = Thread(target=self.run)
+        self.thread.setDaemon(True)
+        self.thread.setName("CQL-REACTOR")
+        self.thread.start()
+
+    def transport_factory(self, connection):
+        """
+        Open a ReactorTransport for a NativeConnection (see
+        cql.native.Transport).
+        """
+
+        return ReactorTransport(self, connection)
+
+    def add_transport(self, transport):
+        fd = transport.fd
+        self.lock.acquire()
+        try:
+            if self.error is not None:
+                raise cql.OperationalError("Reactor has failed: %s" % (self.error,))
+            self.transports[fd] = transport
+            self.outgoing[fd] = []
+            self.poller.register(fd, POLL_READ)
+        finally:
+            self.lock.release()
+
+    def remove_transport(self, transport):
+        fd = transport.fd
+        self.lock.acquire()
+        try:
+            if self.transports.get(fd) is not transport:
+                return
+            del self.transports[fd]
+            del self.outgoing[fd]
+            self.new_writes.discard(fd)
+            try:
+                self.poller.unregister(fd)
+            except (IOError, OSError, KeyError):
+                # the socket is closed already
+                pass
+        finally:
+            self.lock.release()
+
+    def write(self, transport, data):
+        """
+        Queue data to be written to the transport's socket.
+        """
+
+        fd = transport.fd
+        self.lock.acquire()
+        try:
+            try:
+                pending = self.outgoing[fd]
+            except KeyError:
+                raise cql.OperationalError("Connection has been closed.")
+            pending.append(data)
+            if len(pending) > 1:
+                # already waiting to be written
+                return
+            self.new_writes.add(fd)
+        finally:
+            self.lock.release()
+        self.wakeup()
+
+    def wakeup(self):
+        try:
+            os.write(self.wakeup_w, 'x')
+        except OSError, e:
+            # the pipe being full is as good as the byte getting through
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def run(self):
+        try:
+            self.poll_loop()
+        except Exception, e:
+            # the sockets won't be polled any more; rather than leave threads
+            # waiting for responses that can't arrive, fail the connections
+            self.lock.acquire()
+            try:
+                self.error = e
+            finally:
+                self.lock.release()
+            self.fail_transports(e)
+
+    def fail_transports(self, error):
+        for transport in self.transports.values():
+            self.remove_transport(transport)
+            transport.connection.connection_lost(error)
+
+    def poll_loop(self):
+        while not self.closed:
+            self.lock.acquire()
+            try:
+                for fd in self.new_writes:
+                    self.poller.modify(fd, POLL_READ | POLL_WRITE)
+                self.new_writes.clear()
+            finally:
+                self.lock.release()
+            try:
+                events = self.poller.poll(self.poll_interval)
+            except (IOError, select.error), e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd, event in events:
+                if fd == self.wakeup_r:
+                    self.drain_wakeups()
+                    continue
+                transport = self.transports.get(fd)
+                if transport is None:
+                    continue
+                try:
+                    if event & POLL_WRITE:
+                        self.handle_write(fd, transport)
+                    if event & (POLL_READ | POLL_ERROR):
+                        self.handle_read(fd, transport)
+                except Exception, e:
+                    self.remove_transport(transport)
+                    transport.connection.connection_lost(e)
+
+    def drain_wakeups(self):
+        try:
+            while os.read(self.wakeup_r, 4096):
+                pass
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def handle_read(self, fd, transport):
+        try:
+            data = transport.sock.recv(RECV_SIZE)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EINTR):
+                return
+            raise
+        if not data:
+            raise cql.InternalError("Connection closed by the server")
+        transport.connection.data_received(data)
+
+    def handle_write(self, fd, transport):
+        self.lock.acquire()
+        try:
+            pending = self.outgoing.get(fd)
+            if not pending:
+                return
+            data = ''.join(pending)
+            try:
+                sent = transport.sock.send(data)
+            except socket.error, e:
+                if e.args[0] in (errno.EAGAIN, errno.EINTR):
+                    sent = 0
+                else:
+                    raise
+            if sent < len(data):
+                pending[:] = [data[sent:]]
+            else:
+                del pending[:]
+                self.poller.modify(fd, POLL_READ)
+        finally:
+            self.lock.release()
+
+    def close(self):
+        """
+        Stop the I/O thread. Connections still open are cut off.
+        """
+
+        if self.closed:
+            return
+        self.closed = True
+        self.wakeup()
+        self.thread.join()
+        self.fail_transports(cql.OperationalError("Reactor has been closed."))
+        os.close(self.wakeup_r)
+        os.close(self.wakeup_w)
+
+def set_nonblocking(fd):
+    import fcntl
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+_default_reactor = None
+_default_reactor_lock = Lock()
+
+def default_reactor():
+    """
+    A reactor for connections to share, started when first needed.
+    """
+
+    global _default_reactor
+    _default_reactor_lock.acquire()
+    try:
+        if _default_reactor is None:
+            _default_reactor = Reactor()
+        return _default_reactor
+    finally:
+        _default_reactor_lock.release()
+
+class ReactorTransport(Transport):
+    """
+    A non-blocking socket, driven by a Reactor.
+    """
+
+    background_reads = True
+
+    def __init__(self, reactor, connection):
+        self.reactor = reactor
+        self.connection = connection
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.connect((connection.host, connection.port))
+        self.sock.setblocking(0)
+        self.fd = self.sock.fileno()
+        reactor.add_transport(self)
+
+    def write(self, data):
+        self.reactor.write(self, data)
+
+    def close(self):
+        self.reactor.remove_transport(self)
+        self.sock.close()
@@ -0,0 +1,108 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Row factories for Cursor objects. By default, cursors return each row as a
+list of values. Setting a cursor's row_factory attribute to a callable
+changes that: the callable is given the list of column names for a result
+set (once per distinct set of names, not once per row) and must return a
+callable that builds a row object out of a list of decoded values.
+
+    >>> cursor.row_factory = cql.rows.named_row_factory
+    >>> cursor.execute("SELECT KEY, name FROM users")
+    >>> row = cursor.fetchone()
+    >>> row.name == row[1]
+    True
+"""
+
+from operator import itemgetter
+import keyword
+import re
+
+__all__ = ['named_row_factory', 'tuple_row_factory']
+
+identifier_re = re.compile(r'^[a-zA-Z][a-zA-Z0-9_]*$')
+
+# row classes are shared between cursors. CQL 2 result sets can have a
+# different set of column names in every row, so don't let this grow forever.
+MAX_CACHED_ROW_CLASSES = 1000
+_row_classes = {}
+
+class _Row(tuple):
+    __slots__ = ()
+    _fields = ()
+
+    def _asdict(self):
+        return dict(zip(self._fields, self))
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__,
+                           ', '.join(['%s=%r' % pair for pair in zip(self._fields, self)]))
+
+def attribute_name(colname):
+    """
+    Hand back the attribute name under which a column should be exposed on
+    row objects, or None if it can't be used as one (not a string, not a
+    valid identifier, or clashing with a tuple or row class attribute).
+    """
+
+    if isinstance(colname, unicode):
+        try:
+            colname = colname.encode('ascii')
+        except UnicodeEncodeError:
+            return None
+    if not isinstance(colname, str) or not identifier_re.match(colname):
+        return None
+    if keyword.iskeyword(colname) or hasattr(_Row, colname):
+        return None
+    return colname
+
+def make_row_class(colnames):
+    """
+    Build a tuple subclass whose instances expose the values for the given
+    columns both by index and, where the name permits, by attribute. Instances
+    carry no per-row __dict__.
+    """
+
+    dct = {'__slots__': (), '_fields': tuple(colnames)}
+    for n, colname in enumerate(colnames):
+        attrname = attribute_name(colname)
+        if attrname is not None and attrname not in dct:
+            dct[attrname] = property(itemgetter(n))
+    return type('Row', (_Row,), dct)
+
+def named_row_factory(colnames):
+    """
+    Row factory producing instances of a (cached) row class made by
+    make_row_class().
+    """
+
+    key = tuple(colnames)
+    try:
+        return _row_classes[key]
+    except KeyError:
+        pass
+    if len(_row_classes) >= MAX_CACHED_ROW_CLASSES:
+        _row_classes.clear()
+    rowclass = _row_classes[key] = make_row_class(key)
+    return rowclass
+
+def tuple_row_factory(colnames):
+    """
+    Row factory producing plain tuples.
+    """
+
+    return tuple
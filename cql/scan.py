@@ -0,0 +1,216 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Parallel full scans of a column family over Thrift. The ring is divided into
+splits of roughly keys_per_split rows each with describe_ring and
+describe_splits, and the splits are paged through with get_range_slices by a
+pool of worker threads, each talking to a replica for the split it is
+reading where possible. Usually obtained via ThriftConnection.scan():
+
+    >>> for key, columns in conn.scan('Users', num_workers=8):
+    ...     process(key, dict(columns))
+
+Rows come back in no particular order. At most buffer_pages pages of rows
+are held in memory at a time, no matter how big the column family is.
+"""
+
+from Queue import Queue, Empty
+from threading import Thread
+import cql
+from cql.thrifteries import ThriftRowDecoder, lookup_consistency_level
+from cql.cassandra.ttypes import ColumnParent, SlicePredicate, SliceRange, KeyRange
+
+__all__ = ['RangeScan', 'split_token_ranges']
+
+# partitioner name -> (function making a token string comparable, minimum token)
+partitioner_tokens = {
+    'RandomPartitioner':          (long, '-1'),
+    'Murmur3Partitioner':         (long, str(-2 ** 63)),
+    'ByteOrderedPartitioner':     (str, ''),
+    'OrderPreservingPartitioner': (str, ''),
+}
+
+def unwrap_token_range(start, end, partitioner):
+    """
+    Split a token range that wraps around the end of the ring in two at the
+    ring's minimum token, so that each piece can be paged through by key.
+    """
+
+    try:
+        tokenkey, mintoken = partitioner_tokens[partitioner.split('.')[-1]]
+    except KeyError:
+        return [(start, end)]
+    if end == mintoken or tokenkey(start) < tokenkey(end):
+        return [(start, end)]
+    if start == mintoken:
+        return [(start, end)]
+    return [(start, mintoken), (mintoken, end)]
+
+def split_token_ranges(client, keyspace, column_family, keys_per_split):
+    """
+    Hand back a list of (start_token, end_token, hosts) tuples covering the
+    whole ring, where hosts are the addresses of the replicas for that range.
+    """
+
+    partitioner = client.describe_partitioner()
+    splits = []
+    for tokenrange in client.describe_ring(keyspace):
+        hosts = [h for h in tokenrange.rpc_endpoints or () if h != '0.0.0.0'] \
+                or tokenrange.endpoints
+        tokens = client.describe_splits(column_family, tokenrange.start_token,
+                                        tokenrange.end_token, keys_per_split)
+        for start, end in zip(tokens[:-1], tokens[1:]):
+            for piece in unwrap_token_range(start, end, partitioner):
+                splits.append(piece + (hosts,))
+    return splits
+
+class RangeScan(object):
+    """
+    A full scan of one column family. Iterating over a RangeScan starts the
+    workers and yields (key, [(name, value), ...]) tuples for every row with
+    at least one live column. Only the first max_columns columns of each row
+    are read.
+
+    Params:
+    * connection .......: a ThriftConnection, used to work out the splits and
+                          as a template for the workers' own connections.
+    * cfdef ............: the CfDef of the column family to scan.
+    * num_workers ......: number of splits to read concurrently.
+    * keys_per_split ...: approximate number of rows per split.
+    * page_size ........: number of rows to ask for per get_range_slices call.
+    * max_columns ......: number of columns to read from each row.
+    * buffer_pages .....: number of pages that may be waiting to be consumed.
+    * consistency_level : consistency level name for the reads.
+    """
+
+    def __init__(self, connection, cfdef, num_workers=4, keys_per_split=65536,
+                 page_size=1000, max_columns=1000, buffer_pages=None,
+                 consistency_level='ONE'):
+        self.connection = connection
+        self.cfdef = cfdef
+        self.num_workers = num_workers
+        self.keys_per_split = keys_per_split
+        # get_range_slices is start-inclusive when paging by key, so every page
+        # after the first repeats a row
+        self.page_size = max(page_size, 2)
+        self.buffer_pages = buffer_pages or 2 * num_workers
+        self.consistency_level = lookup_consistency_level(consistency_level)
+        self.column_parent = ColumnParent(column_family=cfdef.name)
+        self.predicate = SlicePredicate(slice_range=SliceRange(start='', finish='',
+                                                               reversed=False,
+                                                               count=max_columns))
+        self.workers = []
+        self.stopped = False
+
+    def __iter__(self):
+        splits = split_token_ranges(self.connection.client, self.cfdef.keyspace,
+                                    self.cfdef.name, self.keys_per_split)
+        self.splits = Queue()
+        for split in splits:
+            self.splits.put(split)
+        self.results = Queue(maxsize=self.buffer_pages)
+        self.stopped = False
+        self.workers = []
+        for n in xrange(min(self.num_workers, len(splits))):
+            worker = Thread(target=self.scan_splits)
+            worker.setDaemon(True)
+            worker.start()
+            self.workers.append(worker)
+
+        try:
+            finished = 0
+            while finished < len(self.workers):
+                kind, val = self.results.get()
+                if kind == 'done':
+                    finished += 1
+                elif kind == 'error':
+                    raise val
+                else:
+                    for row in val:
+                        yield row
+        finally:
+            self.stop()
+
+    def stop(self):
+        """
+        Stop the workers, discarding anything they have read but not handed
+        back yet.
+        """
+
+        self.stopped = True
+        while [w for w in self.workers if w.isAlive()]:
+            try:
+                self.results.get(timeout=0.1)
+            except Empty:
+                pass
+        for worker in self.workers:
+            worker.join()
+
+    def scan_splits(self):
+        conns = {}
+        try:
+            try:
+                while not self.stopped:
+                    try:
+                        start, end, hosts = self.splits.get_nowait()
+                    except Empty:
+                        break
+                    self.scan_split(self.connection_for(conns, hosts), start, end)
+            except Exception, e:
+                self.results.put(('error', e))
+        finally:
+            for conn in conns.values():
+                conn.close()
+            self.results.put(('done', None))
+
+    def connection_for(self, conns, hosts):
+        for host in hosts:
+            try:
+                return conns[host]
+            except KeyError:
+                pass
+            try:
+                conn = conns[host] = self.connection.clone(self.cfdef.keyspace, host=host)
+                return conn
+            except Exception:
+                continue
+        try:
+            return conns[None]
+        except KeyError:
+            conn = conns[None] = self.connection.clone(self.cfdef.keyspace)
+            return conn
+
+    def scan_split(self, conn, start, end):
+        rowdecoder = ThriftRowDecoder(self.cfdef)
+        cursor = conn.cursor()
+        keyrange = KeyRange(start_token=start, end_token=end, count=self.page_size)
+        while not self.stopped:
+            slices = cursor.handle_cql_execution_errors(
+                    conn.client.get_range_slices, self.column_parent, self.predicate,
+                    keyrange, self.consistency_level)
+            newslices = slices
+            if keyrange.start_key is not None and slices and slices[0].key == keyrange.start_key:
+                newslices = slices[1:]
+            page = [(rowdecoder.decode_key(ks.key), rowdecoder.decode_columns(ks.columns))
+                    for ks in newslices if ks.columns]
+            # dynamic column names would otherwise pile up page after page
+            rowdecoder.forget_column_names()
+            if page:
+                self.results.put(('page', page))
+            if len(slices) < self.page_size:
+                break
+            keyrange = KeyRange(start_key=slices[-1].key, end_token=end, count=self.page_size)
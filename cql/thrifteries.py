@@ -14,42 +14,185 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import re
 import zlib
+from collections import deque
 import cql
 from cql.cursor import Cursor, _VOID_DESCRIPTION, _COUNT_DESCRIPTION
-from cql.query import cql_quote, cql_quote_name, prepare_query, PreparedQuery
+from cql.cqltypes import lookup_casstype
+from cql.decoders import SchemaDecoder
+from cql.query import cql_quote, cql_quote_name, prepare_query, PreparedQuery, values_size
 from cql.connection import Connection
+from cql.fastthrift import RawCqlResult, read_cql_result, fastbinary
 from cql.cassandra import Cassandra
 from thrift.Thrift import TApplicationException
 from thrift.transport import TTransport, TSocket
 from thrift.protocol import TBinaryProtocol
 from cql.cassandra.ttypes import (AuthenticationRequest, Compression,
         CqlResultType, InvalidRequestException, UnavailableException,
-        TimedOutException, SchemaDisagreementException)
+        TimedOutException, SchemaDisagreementException, NotFoundException,
+        CqlMetadata, ConsistencyLevel)
 
 MIN_THRIFT_FOR_PREPARED_QUERIES = (19, 27, 0)
 
+# query texts shorter than this (in bytes) are sent uncompressed even when
+# GZIP compression is asked for; zlib overhead eats up any gain on them
+MIN_COMPRESSION_SIZE = 512
+
+# (maximum query text size, zlib level) pairs. Mid-sized texts get the
+# default level; very big ones a cheaper level, to bound the CPU spent.
+compression_levels = (
+    (16384, 6),
+    (262144, 3),
+    (None, 1),
+)
+
+# compressed forms of recently prepared query texts, so that preparing the
+# same query on many connections doesn't recompress it every time. Other
+# queries (often one-offs, with their values inline) aren't cached.
+MAX_CACHED_COMPRESSED_QUERIES = 200
+MAX_CACHED_QUERY_SIZE = 65536
+_compressed_queries = {}
+
+# prepared queries handed back by ThriftCursor.prepare_query, per connection
+# (or per ConnectionPool, if it shares them), keyed by host, port, keyspace
+# and query text
+MAX_CACHED_PREPARED_QUERIES = 1000
+
+# how Cassandra reports an execute_prepared_cql_query call with an item id
+# it doesn't know (e.g., after a restart, or once it has been evicted)
+unknown_prepared_query_re = re.compile(r'Prepared query with ID -?\d+ not found')
+
+use_statement_re = re.compile(r'''^\s*USE\s+("(?:[^"]|"")+"|'[^']+'|\w+)\s*;?\s*$''',
+                              re.IGNORECASE)
+
+def compression_level(size):
+    for maxsize, level in compression_levels:
+        if maxsize is None or size <= maxsize:
+            return level
+
+def gzip_query_text(querytext, cache=False):
+    if not cache:
+        return zlib.compress(querytext, compression_level(len(querytext)))
+    try:
+        return _compressed_queries[querytext]
+    except KeyError:
+        pass
+    compressed = zlib.compress(querytext, compression_level(len(querytext)))
+    if len(querytext) <= MAX_CACHED_QUERY_SIZE:
+        if len(_compressed_queries) >= MAX_CACHED_COMPRESSED_QUERIES:
+            _compressed_queries.clear()
+        _compressed_queries[querytext] = compressed
+    return compressed
+
+def column_family_metadata(cfdef):
+    """
+    Build a CqlMetadata describing the columns of a column family from its
+    CfDef, suitable for handing to a SchemaDecoder. The row key is included
+    under its alias (or 'KEY'), like it would be in a CQL 2 result.
+    """
+
+    keyname = cfdef.key_alias or 'KEY'
+    name_types = {keyname: 'UTF8Type'}
+    value_types = {keyname: cfdef.key_validation_class or 'BytesType'}
+    for coldef in cfdef.column_metadata or ():
+        name_types[coldef.name] = cfdef.comparator_type
+        value_types[coldef.name] = coldef.validation_class
+    return CqlMetadata(name_types=name_types, value_types=value_types,
+                       default_name_type=cfdef.comparator_type or 'BytesType',
+                       default_value_type=cfdef.default_validation_class or 'BytesType')
+
+class ThriftRowDecoder(object):
+    """
+    Decodes keys and columns returned by the column-oriented Thrift calls
+    (get_range_slices, multiget_slice, etc) for one column family, using the
+    same decoder classes as cursors. Super columns are not supported.
+    """
+
+    def __init__(self, cfdef, decoder_class=SchemaDecoder):
+        schema = column_family_metadata(cfdef)
+        self.decoder = decoder_class(schema)
+        self.key_type = lookup_casstype(schema.value_types[cfdef.key_alias or 'KEY'])
+
+    def decode_key(self, keybytes):
+        return self.decoder.decode_value(keybytes, self.key_type, 'KEY')
+
+    def forget_column_names(self):
+        self.decoder.forget_column_names()
+
+    def decode_columns(self, coscs):
+        """
+        Given a list of ColumnOrSuperColumn objects, hand back a list of
+        (name, value) pairs.
+        """
+
+        decoder = self.decoder
+        columns = []
+        for cosc in coscs:
+            column = cosc.column
+            if column is None:
+                column = cosc.counter_column
+                if column is None:
+                    raise cql.NotSupportedError("Super columns are not supported")
+                name = decoder.decode_metadata_and_type(column.name)[0]
+                columns.append((name, column.value))
+                continue
+            name, nbytes, vtype, ctype = decoder.decode_metadata_and_type(column.name)
+            columns.append((name, decoder.decode_value(column.value, vtype, name)))
+        return columns
+
+def lookup_consistency_level(name):
+    try:
+        return getattr(ConsistencyLevel, name.upper())
+    except AttributeError:
+        raise cql.ProgrammingError("Unknown consistency level %r" % (name,))
+
 class ThriftCursor(Cursor):
+    compression_threshold = MIN_COMPRESSION_SIZE
+
     def __init__(self, parent_connection):
         Cursor.__init__(self, parent_connection)
 
+        # whether self.result holds (names, values) pairs from a RawCqlResult
+        # rather than lists of thrift Column objects
+        self.raw_rows = False
+
         if hasattr(parent_connection.client, 'execute_prepared_cql_query') \
                 and parent_connection.remote_thrift_version >= MIN_THRIFT_FOR_PREPARED_QUERIES:
             self.supports_prepared_queries = True
 
-    def compress_query_text(self, querytext):
+    def compress_query_text(self, querytext, cache=False):
         if self.compression == 'GZIP':
-            compressed_q = zlib.compress(querytext)
-        else:
-            compressed_q = querytext
-        req_compression = getattr(Compression, self.compression or 'NONE')
-        return compressed_q, req_compression
+            if len(querytext) < self.compression_threshold:
+                return querytext, Compression.NONE
+            return gzip_query_text(querytext, cache), Compression.GZIP
+        return querytext, getattr(Compression, self.compression or 'NONE')
 
     def prepare_query(self, query):
+        """
+        Prepare the given query on the server, or hand back the PreparedQuery
+        already made for the same query text on this connection's host and
+        keyspace.
+        """
+
         if isinstance(query, unicode):
             raise ValueError("CQL query must be bytes, not unicode")
+        conn = self._connection
+        cache = conn.prepared_queries
+        key = (conn.host, conn.port, conn.keyspace, query)
+        try:
+            return cache[key]
+        except KeyError:
+            pass
+        pquery = self.prepare_query_uncached(query)
+        if len(cache) >= MAX_CACHED_PREPARED_QUERIES:
+            cache.clear()
+        cache[key] = pquery
+        return pquery
+
+    def prepare_query_uncached(self, query):
         prepared_q_text, paramnames = prepare_query(query)
-        compressed_q, compression = self.compress_query_text(prepared_q_text)
+        compressed_q, compression = self.compress_query_text(prepared_q_text, cache=True)
         presult = self._connection.client.prepare_cql_query(compressed_q, compression)
         assert presult.count == len(paramnames)
         if presult.variable_types is None and presult.count > 0:
@@ -59,14 +202,62 @@ class ThriftCursor(Cursor):
         return PreparedQuery(query, presult.itemId, presult.variable_types, paramnames)
 
     def get_response(self, cql_query):
-        compressed_q, compress = self.compress_query_text(cql_query)
-        doquery = self._connection.client.execute_cql_query
-        return self.handle_cql_execution_errors(doquery, compressed_q, compress)
+        response = self.handle_cql_execution_errors(self.send_query(cql_query))
+        match = use_statement_re.match(cql_query)
+        if match:
+            # keep track, so that prepared queries are only shared among
+            # cursors using the same keyspace
+            ksname = match.group(1)
+            if ksname[0] in '"\'':
+                ksname = ksname[1:-1].replace(ksname[0] * 2, ksname[0])
+            self._connection.keyspace_changed(ksname)
+        return response
 
     def get_response_prepared(self, prepared_query, params):
-        doquery = self._connection.client.execute_prepared_cql_query
-        paramvals = prepared_query.encode_params(params)
-        return self.handle_cql_execution_errors(doquery, prepared_query.itemid, paramvals)
+        recv = self.send_prepared_query(prepared_query, params)
+        try:
+            return self.handle_cql_execution_errors(recv)
+        except cql.ProgrammingError, e:
+            if unknown_prepared_query_re.search(str(e)) is None:
+                raise
+        # the server has forgotten about this query; prepare it again and
+        # retry, once
+        fresh = self.prepare_query_uncached(prepared_query.querytext)
+        prepared_query.itemid = fresh.itemid
+        return self.handle_cql_execution_errors(self.send_prepared_query(prepared_query, params))
+
+    def recv_function(self, method):
+        conn = self._connection
+        if conn.direct_decoding:
+            return lambda: read_cql_result(conn.tsocket, method)
+        return getattr(conn.client, 'recv_' + method)
+
+    def send_query(self, cql_query):
+        """
+        Send a query without waiting for the response. Hands back the
+        callable which reads the response once it is due.
+        """
+
+        compressed_q, compress = self.compress_query_text(cql_query)
+        self.throttle(len(compressed_q))
+        self._connection.client.send_execute_cql_query(compressed_q, compress)
+        return self.recv_function('execute_cql_query')
+
+    def send_prepared_query(self, prepared_query, params):
+        """
+        Like send_query(), for a prepared query and its parameters.
+        """
+
+        return self.send_encoded_query(prepared_query, prepared_query.encode_params(params))
+
+    def send_encoded_query(self, prepared_query, paramvals):
+        """
+        Like send_prepared_query(), with the parameters already encoded.
+        """
+
+        self.throttle(values_size(paramvals))
+        self._connection.client.send_execute_prepared_cql_query(prepared_query.itemid, paramvals)
+        return self.recv_function('execute_prepared_cql_query')
 
     def handle_cql_execution_errors(self, executor, *args, **kwargs):
         try:
@@ -86,9 +277,7 @@ class ThriftCursor(Cursor):
     def process_execution_results(self, response, decoder=None):
         if response.type == CqlResultType.ROWS:
             self.decoder = (decoder or self.default_decoder)(response.schema)
-            self.result = [r.columns for r in response.rows]
-            self.rs_idx = 0
-            self.rowcount = len(self.result)
+            self.load_rows(response)
             if self.result:
                 self.get_metadata_info(self.result[0])
         elif response.type == CqlResultType.INT:
@@ -110,10 +299,28 @@ class ThriftCursor(Cursor):
         # 'Return values are not defined.'
         return True
 
+    def load_rows(self, response):
+        """
+        Take the rows of a ROWS response as the current result, without
+        working out their metadata.
+        """
+
+        self.raw_rows = isinstance(response, RawCqlResult)
+        if self.raw_rows:
+            self.result = response.rows
+        else:
+            self.result = [r.columns for r in response.rows]
+        self.rs_idx = 0
+        self.rowcount = len(self.result)
+
     def columnvalues(self, row):
+        if self.raw_rows:
+            return row[1]
         return [column.value for column in row]
 
     def columninfo(self, row):
+        if self.raw_rows:
+            return row[0]
         return (column.name for column in row)
 
 class ThriftConnection(Connection):
@@ -121,11 +328,20 @@ class ThriftConnection(Connection):
 
     def establish_connection(self):
         socket = TSocket.TSocket(self.host, self.port)
+        self.tsocket = socket
         self.transport = TTransport.TFramedTransport(socket)
         protocol = TBinaryProtocol.TBinaryProtocolAccelerated(self.transport)
         self.client = Cassandra.Client(protocol)
         socket.open()
 
+        # Without the fastbinary extension, query results are read straight
+        # off the socket by cql.fastthrift instead of the generated code
+        self.direct_decoding = fastbinary is None
+
+        # see ThriftCursor.prepare_query; may be replaced with a dict shared
+        # among several connections
+        self.prepared_queries = {}
+
         if self.credentials:
             self.client.login(AuthenticationRequest(credentials=self.credentials))
 
@@ -141,6 +357,136 @@ class ThriftConnection(Connection):
         except ValueError:
             pass
 
+    def execute_pipelined(self, statements, depth=32, decoder=None):
+        """
+        Execute a sequence of statements, each a (query, params) pair where
+        query is either CQL text or a PreparedQuery, by writing up to depth
+        requests to the server before reading their responses. This hides
+        the round trip time of all but the first request on slow links.
+
+        Hands back a list of cursors holding the results for each statement,
+        in order. If any statements fail, all of the responses are still
+        read, and then the first error is raised. If the connection itself
+        fails part way, it is closed, since the responses still due can no
+        longer be matched up with their requests.
+        """
+
+        requests = []
+        for query, params in statements:
+            cursor = self.cursor()
+            cursor.pre_execution_setup()
+            # get any substitution or encoding errors out of the way before
+            # anything is sent, so that no responses are left unread
+            if isinstance(query, PreparedQuery):
+                params = query.encode_params(params)
+            else:
+                query = cursor.prepare_inline(query, params)
+            requests.append((cursor, query, params))
+
+        cursors = []
+        pending = deque()
+        errors = []
+        turned_away = None
+        try:
+            for cursor, query, params in requests:
+                try:
+                    if isinstance(query, PreparedQuery):
+                        recv = cursor.send_encoded_query(query, params)
+                    else:
+                        recv = cursor.send_query(query)
+                except cql.TooManyRequests, e:
+                    # turned away by a rate limiter before being sent; the
+                    # responses already due are still read
+                    turned_away = e
+                    break
+                pending.append((cursor, recv))
+                cursors.append(cursor)
+                if len(pending) >= depth:
+                    self.receive_pipelined(pending, errors, decoder)
+            while pending:
+                self.receive_pipelined(pending, errors, decoder)
+        except:
+            self.close()
+            raise
+        if turned_away is not None:
+            raise turned_away
+        if errors:
+            raise errors[0]
+        return cursors
+
+    def receive_pipelined(self, pending, errors, decoder):
+        cursor, recv = pending.popleft()
+        try:
+            response = cursor.handle_cql_execution_errors(recv)
+        except cql.Error, e:
+            errors.append(e)
+            return
+        try:
+            cursor.process_execution_results(response, decoder=decoder)
+        except Exception, e:
+            # the response has been read in full, so the others still can be
+            errors.append(e)
+
+    def describe_column_family(self, column_family, keyspace=None):
+        """
+        Look up the CfDef for the given column family, in the given keyspace
+        or the one this connection was opened with.
+        """
+
+        keyspace = keyspace or self.keyspace
+        if keyspace is None:
+            raise cql.ProgrammingError("No keyspace given")
+        try:
+            ksdef = self.client.describe_keyspace(keyspace)
+        except NotFoundException:
+            raise cql.ProgrammingError("Keyspace %r does not exist" % (keyspace,))
+        cfdefs = dict((cfdef.name, cfdef) for cfdef in ksdef.cf_defs)
+        try:
+            return cfdefs[column_family]
+        except KeyError:
+            pass
+        # CQL 2 treats column family names case-insensitively
+        for name, cfdef in cfdefs.items():
+            if name.lower() == column_family.lower():
+                return cfdef
+        raise cql.ProgrammingError("Column family %r does not exist in keyspace %r"
+                                   % (column_family, keyspace))
+
+    def bulk_writer(self, column_family, keyspace=None, num_connections=4,
+                    batch_size=500, consistency_level='ONE'):
+        """
+        Create a BulkWriter for the given column family (see cql.bulk). It
+        writes over num_connections new connections to the same host.
+        """
+
+        from cql.bulk import BulkWriter
+        cfdef = self.describe_column_family(column_family, keyspace)
+        conns = [self.clone(cfdef.keyspace) for n in xrange(num_connections)]
+        return BulkWriter(conns, cfdef, batch_size=batch_size,
+                          consistency_level=consistency_level)
+
+    def multigetter(self, column_family, keyspace=None, num_connections=4, **kwargs):
+        """
+        Create a MultiGetter for the given column family (see cql.multiget),
+        which fetches over num_connections new connections to the same host.
+        """
+
+        from cql.multiget import MultiGetter
+        cfdef = self.describe_column_family(column_family, keyspace)
+        conns = [self.clone(cfdef.keyspace) for n in xrange(num_connections)]
+        return MultiGetter(conns, cfdef, **kwargs)
+
+    def scan(self, column_family, keyspace=None, **kwargs):
+        """
+        Iterate over every row of the given column family, reading token
+        range splits concurrently. Yields (key, [(name, value), ...]) tuples.
+        See cql.scan.RangeScan for the keyword arguments accepted.
+        """
+
+        from cql.scan import RangeScan
+        cfdef = self.describe_column_family(column_family, keyspace)
+        return iter(RangeScan(self, cfdef, **kwargs))
+
     def set_initial_keyspace(self, keyspace):
         c = self.cursor()
         if self.cql_major_version >= 3:
@@ -0,0 +1,358 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Client-side limits on the load put on the cluster. An InFlightLimiter caps
+the requests in flight on a NativeConnection, or the connections borrowed
+from a ConnectionPool at once:
+
+    >>> limiter = InFlightLimiter(64, max_queued=256, mode='timeout', timeout=2.0)
+    >>> conn = NativeConnection(host, 9042, 'ks', in_flight_limiter=limiter)
+
+Requests past the limit wait for others to finish, or are turned away with
+cql.TooManyRequests, so that a slow cluster shows up as errors callers can
+back off on rather than as ever longer queues. An AdaptiveLimiter works out
+the limit for itself, from the latency of responses and from the errors
+overloaded nodes send back.
+
+A RateLimiter caps the rate of requests, and of the bytes they carry, with
+token buckets. Connections take one for all of their requests, one per
+host (from a HostLimiters) and one per statement class, named by setting
+statement_class on a cursor:
+
+    >>> conn.rate_limiter = RateLimiter(requests_per_second=5000)
+    >>> conn.statement_rate_limiters = {
+    ...     'bulk-import': RateLimiter(bytes_per_second=2 ** 20)}
+    >>> cursor = conn.cursor()
+    >>> cursor.statement_class = 'bulk-import'
+"""
+
+from threading import Condition, Lock
+from time import time, sleep
+import cql
+
+__all__ = ['InFlightLimiter', 'AdaptiveLimiter', 'HostLimiters', 'TokenBucket',
+           'RateLimiter']
+
+class InFlightLimiter(object):
+    """
+    Admits up to max_in_flight requests at a time. Past that, what happens
+    depends on the mode:
+
+    * 'block' .: wait until enough requests have finished.
+    * 'timeout': wait up to timeout seconds, and then raise TooManyRequests.
+    * 'reject' : raise TooManyRequests straight away.
+
+    At most max_queued callers wait at once (any number, if None); any more
+    are rejected. The counters admitted, queued, rejected and timed_out
+    count what happened to each request.
+    """
+
+    modes = ('block', 'timeout', 'reject')
+
+    def __init__(self, max_in_flight, max_queued=None, mode='block', timeout=None):
+        if mode not in self.modes:
+            raise ValueError("Unknown mode %r; expected one of %r" % (mode, self.modes))
+        if mode == 'timeout' and timeout is None:
+            raise ValueError("A timeout is needed for the 'timeout' mode")
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.mode = mode
+        self.timeout = timeout
+        self.lock = Condition()
+        self.in_flight = 0
+        self.num_waiting = 0
+
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def acquire(self):
+        """
+        Admit one request, waiting (or not) as the mode says. Every
+        request admitted must be released.
+        """
+
+        self.lock.acquire()
+        try:
+            if self.in_flight >= self.max_in_flight:
+                self.wait_turn()
+            self.in_flight += 1
+            self.admitted += 1
+        finally:
+            self.lock.release()
+
+    def wait_turn(self):
+        if self.mode == 'reject' or (self.max_queued is not None
+                                     and self.num_waiting >= self.max_queued):
+            self.rejected += 1
+            raise cql.TooManyRequests("Too many requests in flight (%d)" % self.in_flight)
+        self.queued += 1
+        self.num_waiting += 1
+        try:
+            deadline = None
+            if self.mode == 'timeout':
+                deadline = time() + self.timeout
+            while self.in_flight >= self.max_in_flight:
+                if deadline is None:
+                    self.lock.wait()
+                    continue
+                remaining = deadline - time()
+                if remaining <= 0:
+                    self.timed_out += 1
+                    raise cql.TooManyRequests("Timed out waiting for one of %d requests"
+                                              " in flight to finish" % self.in_flight)
+                self.lock.wait(remaining)
+        finally:
+            self.num_waiting -= 1
+
+    def acquire_available(self, count):
+        """
+        Admit up to count requests without waiting, and return how many were
+        admitted.
+        """
+
+        self.lock.acquire()
+        try:
+            count = max(0, min(count, self.max_in_flight - self.in_flight))
+            self.in_flight += count
+            self.admitted += count
+            return count
+        finally:
+            self.lock.release()
+
+    def release(self, count=1):
+        self.lock.acquire()
+        try:
+            self.in_flight -= count
+            self.lock.notifyAll()
+        finally:
+            self.lock.release()
+
+    def finished(self, latency, overloaded):
+        """
+        Release one request, which got a response after latency seconds;
+        overloaded says whether the response was an error showing that the
+        server is struggling (see cql.native.overload_errors).
+        """
+
+        self.release()
+
+class AdaptiveLimiter(InFlightLimiter):
+    """
+    An InFlightLimiter whose limit follows what the server can take, by
+    additive increase and multiplicative decrease: each healthy response
+    raises the limit by 1/limit (so by about one per round of requests),
+    and an overload error, or the smoothed latency rising past
+    latency_tolerance times the lowest latency seen lately, multiplies it
+    by backoff (at most once per smoothed round trip). The limit stays
+    between min_limit and max_limit. With latency_tolerance None, only
+    errors bring the limit down.
+
+    Give each host its own (see HostLimiters), since one struggling node
+    says little about the others.
+    """
+
+    def __init__(self, initial_limit=16, min_limit=1, max_limit=128, backoff=0.5,
+                 latency_tolerance=2.0, max_queued=None, mode='block', timeout=None):
+        InFlightLimiter.__init__(self, initial_limit, max_queued=max_queued, mode=mode,
+                                 timeout=timeout)
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.smoothed_latency = None
+        # creeps up with each response, so as to follow lasting changes
+        self.baseline_latency = None
+        self.last_decrease = 0
+
+        self.decreases = 0
+
+    def finished(self, latency, overloaded):
+        self.lock.acquire()
+        try:
+            if self.smoothed_latency is None:
+                self.smoothed_latency = self.baseline_latency = latency
+            else:
+                self.smoothed_latency = 0.9 * self.smoothed_latency + 0.1 * latency
+                self.baseline_latency = min(self.baseline_latency * 1.001, latency)
+            if overloaded or self.latency_rising():
+                self.decrease()
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.max_in_flight = int(self.limit)
+            self.in_flight -= 1
+            self.lock.notifyAll()
+        finally:
+            self.lock.release()
+
+    def latency_rising(self):
+        if self.latency_tolerance is None or self.baseline_latency <= 0:
+            return False
+        return self.smoothed_latency > self.baseline_latency * self.latency_tolerance
+
+    def decrease(self):
+        now = time()
+        if now - self.last_decrease < self.smoothed_latency:
+            # the requests in flight were sent before the last decrease
+            return
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        self.last_decrease = now
+        self.decreases += 1
+
+class HostLimiters(object):
+    """
+    Hands out one limiter per host, made by calling limiter_class with the
+    given keyword arguments:
+
+        >>> limiters = HostLimiters(max_limit=256)
+        >>> conn = NativeConnection(host, 9042, 'ks',
+        ...                         in_flight_limiter=limiters.for_host(host))
+
+    Connections look up their host's RateLimiter in one given as their
+    host_rate_limiters:
+
+        >>> conn.host_rate_limiters = HostLimiters(RateLimiter, requests_per_second=2000)
+    """
+
+    def __init__(self, limiter_class=AdaptiveLimiter, **kwargs):
+        self.limiter_class = limiter_class
+        self.kwargs = kwargs
+        self.limiters = {}
+        self.lock = Lock()
+
+    def for_host(self, host):
+        self.lock.acquire()
+        try:
+            try:
+                return self.limiters[host]
+            except KeyError:
+                limiter = self.limiters[host] = self.limiter_class(**self.kwargs)
+                return limiter
+        finally:
+            self.lock.release()
+
+class TokenBucket(object):
+    """
+    Fills with rate tokens a second, up to burst tokens. Takings may leave
+    it in debt, so that one taking larger than burst can still go through,
+    once the bucket is full, and is paid off before the next.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.last_fill = time()
+
+    def fill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last_fill) * self.rate)
+        self.last_fill = now
+
+    def delay(self, amount):
+        """
+        Seconds until amount tokens can be taken; call fill() first.
+        """
+
+        return max(0.0, min(amount, self.burst) - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= amount
+
+class RateLimiter(object):
+    """
+    Admits up to requests_per_second requests, carrying up to
+    bytes_per_second bytes of query text and values, with bursts of up to
+    burst seconds' worth of either; None means no limit. Past that, what
+    happens depends on the mode, as for InFlightLimiter: 'block' waits for
+    the tokens, 'timeout' waits for them only if they come within timeout
+    seconds, and 'reject' raises TooManyRequests straight away.
+
+    The counters admitted, delayed, rejected and timed_out count what
+    happened to each request.
+    """
+
+    modes = InFlightLimiter.modes
+
+    def __init__(self, requests_per_second=None, bytes_per_second=None, burst=1.0,
+                 mode='block', timeout=None):
+        if mode not in self.modes:
+            raise ValueError("Unknown mode %r; expected one of %r" % (mode, self.modes))
+        if mode == 'timeout' and timeout is None:
+            raise ValueError("A timeout is needed for the 'timeout' mode")
+        self.request_bucket = self.byte_bucket = None
+        if requests_per_second is not None:
+            self.request_bucket = TokenBucket(requests_per_second,
+                                              max(1, requests_per_second * burst))
+        if bytes_per_second is not None:
+            self.byte_bucket = TokenBucket(bytes_per_second, bytes_per_second * burst)
+        self.mode = mode
+        self.timeout = timeout
+        self.lock = Lock()
+
+        self.admitted = 0
+        self.delayed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def admit(self, nbytes=0):
+        """
+        Admit one request of nbytes bytes, waiting (or not) as the mode says.
+        """
+
+        deadline = None
+        if self.mode == 'timeout':
+            deadline = time() + self.timeout
+        waited = False
+        while True:
+            self.lock.acquire()
+            try:
+                now = time()
+                delay = self.delay(nbytes, now)
+                if delay <= 0:
+                    if self.request_bucket is not None:
+                        self.request_bucket.take(1)
+                    if self.byte_bucket is not None:
+                        self.byte_bucket.take(nbytes)
+                    self.admitted += 1
+                    return
+                if self.mode == 'reject':
+                    self.rejected += 1
+                    raise cql.TooManyRequests("Request rate limit exceeded")
+                if deadline is not None and now + delay > deadline:
+                    # no use waiting for tokens that won't come in time
+                    self.timed_out += 1
+                    raise cql.TooManyRequests("Request rate limit exceeded for over"
+                                              " %.3f seconds" % self.timeout)
+                if not waited:
+                    self.delayed += 1
+                    waited = True
+            finally:
+                self.lock.release()
+            # other callers may take the tokens in the meantime, so check again
+            sleep(delay)
+
+    def delay(self, nbytes, now):
+        delay = 0.0
+        if self.request_bucket is not None:
+            self.request_bucket.fill(now)
+            delay = self.request_bucket.delay(1)
+        if self.byte_bucket is not None:
+            self.byte_bucket.fill(now)
+            delay = max(delay, self.byte_bucket.delay(nbytes))
+        return delay
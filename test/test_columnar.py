@@ -0,0 +1,69 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import cql
+from cql import columnar
+from cql.cursor import Cursor
+from cql.cqltypes import lookup_casstype
+from cql.decoders import SchemaDecoder
+
+class TestColumnarDecoding(unittest.TestCase):
+    def setUp(self):
+        if columnar.numpy is None:
+            self.skipTest('NumPy not available')
+
+    def decode(self, rawvals, typename):
+        return columnar.decode_column(rawvals, lookup_casstype(typename), 'col',
+                                      SchemaDecoder(None))
+
+    def test_fixed_width_columns(self):
+        col = self.decode(['\x00\x00\x00\x00\x00\x00\x00\x05', None,
+                           '\xff\xff\xff\xff\xff\xff\xff\xff', ''], 'LongType')
+        self.assertEqual(col.dtype, columnar.numpy.dtype('i8'))
+        self.assertEqual(list(col.mask), [False, True, False, True])
+        self.assertEqual(col.compressed().tolist(), [5, -1])
+
+        col = self.decode(['@\xd2\xfa\x08\x00\x00\x00\x00'], 'DoubleType')
+        self.assertEqual(col.dtype, columnar.numpy.dtype('f8'))
+        self.assertEqual(col.tolist(), [19432.125])
+
+        col = self.decode(['\x00\x00\x013\x7fb\xeey'], 'DateType')
+        self.assertEqual(col.dtype, columnar.numpy.dtype('datetime64[ms]'))
+        self.assertEqual(col.astype('i8').tolist(), [1320692149881])
+
+    def test_object_columns(self):
+        col = self.decode(['abc', None], 'AsciiType')
+        self.assertEqual(col.dtype, columnar.numpy.dtype(object))
+        self.assertEqual(list(col.mask), [False, True])
+        self.assertEqual(col[0], 'abc')
+
+        # values of the wrong width go through the regular decoder
+        from cql.apivalues import ProgrammingError
+        self.assertRaises(ProgrammingError, self.decode, ['\x00\x01'], 'Int32Type')
+
+class FakeConnection:
+    cql_major_version = 2
+
+class TestFetchColumns(unittest.TestCase):
+    def test_unsupported_leaves_rows(self):
+        cursor = Cursor(FakeConnection())
+        cursor.result = [['k1', 'a'], ['k2', 'b']]
+        cursor.rs_idx = 0
+        cursor.description = [('KEY', None, None, None, None, None, True)]
+        # either NumPy is missing, or CQL 2 results aren't supported
+        self.assertRaises(cql.NotSupportedError, cursor.fetch_columns)
+        self.assertEqual(cursor.rs_idx, 0)
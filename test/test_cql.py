@@ -1486,3 +1486,77 @@ class TestCql(unittest.TestCase):
 
     def test_reject_unicode(self):
         self.assertRaises(ValueError, self.cursor.execute, u'select * from system.schema_keyspaces')
+
+    def test_bulk_writer(self):
+        "writing rows through the thrift bulk writer"
+        cursor = self.cursor
+        writer = cursor._connection.bulk_writer('StandardString1', keyspace=self.keyspace,
+                                                num_connections=2, batch_size=3)
+        writer.write('kbulk1', {'c1': 'v1', 'c2': 'v2'})
+        writer.write_rows([{'KEY': 'kbulk%d' % n, 'col': 'val%d' % n} for n in range(2, 10)])
+        writer.close()
+
+        cursor.execute("SELECT c1, c2 FROM StandardString1 WHERE KEY = 'kbulk1'")
+        self.assertEqual(['v1', 'v2'], cursor.fetchone())
+        for n in range(2, 10):
+            cursor.execute("SELECT col FROM StandardString1 WHERE KEY = :key",
+                           dict(key='kbulk%d' % n))
+            self.assertEqual(['val%d' % n], cursor.fetchone())
+        self.assertRaises(cql.ProgrammingError, writer.write, 'k', {'c': 'v'})
+
+    def test_scan(self):
+        "full column family scans over token range splits"
+        conn = self.cursor._connection
+        rows = dict(conn.scan('StandardString1', keyspace=self.keyspace,
+                              num_workers=2, page_size=2))
+        self.assertEqual(['ka', 'kb', 'kc', 'kd'], sorted(rows.keys()))
+        self.assertEqual([('cb1', 'vb1'), ('col', 'val')], rows['kb'])
+
+    def test_multiget(self):
+        "fetching many rows by key in chunks"
+        getter = self.cursor._connection.multigetter('StandardString1', keyspace=self.keyspace,
+                                                     num_connections=2, chunk_size=2)
+        try:
+            rows = getter.get(['kd', 'ka', 'nonexistent', 'kc'])
+            self.assertEqual(['kd', 'ka', 'nonexistent', 'kc'], [r[0] for r in rows])
+            self.assertEqual([('cd1', 'vd1'), ('col', 'val')], rows[0][1])
+            self.assertEqual([], rows[2][1])
+
+            rows = getter.get(['ka', 'kb'], columns=['col'])
+            self.assertEqual([('ka', [('col', 'val')]), ('kb', [('col', 'val')])], rows)
+
+            self.assertEqual([('ka', 2), ('nonexistent', 0)], getter.count(['ka', 'nonexistent']))
+
+            # repeated keys get an entry each
+            rows = getter.get(['kb', 'ka', 'kb'], columns=['col'])
+            self.assertEqual(['kb', 'ka', 'kb'], [r[0] for r in rows])
+            self.assertEqual(rows[0], rows[2])
+            self.assertEqual([('ka', 2), ('ka', 2)], getter.count(['ka', 'ka']))
+        finally:
+            getter.close()
+
+    def test_execute_pipelined(self):
+        "several requests written before reading any responses"
+        conn = self.cursor._connection
+        self.cursor.execute("USE :ks", dict(ks=self.keyspace))
+        cursors = conn.execute_pipelined(
+                [("SELECT col FROM StandardString1 WHERE KEY = :key", dict(key=key))
+                 for key in ('ka', 'kb', 'kc', 'kd')], depth=2)
+        self.assertEqual([['val']] * 4, [c.fetchall() for c in cursors])
+
+        self.assertRaises(cql.ProgrammingError, conn.execute_pipelined,
+                          [("SELECT * FROM StandardString1", {}),
+                           ("SELECT * FROM NoSuchCF", {})])
+        # the connection should still be usable afterwards
+        self.cursor.execute("SELECT col FROM StandardString1 WHERE KEY = 'ka'")
+        self.assertEqual(['val'], self.cursor.fetchone())
+
+        # bad params for a prepared query are caught before anything is sent
+        from cql.query import PreparedQuery
+        pquery = PreparedQuery("SELECT col FROM StandardString1 WHERE KEY = :key", 1,
+                               ['UTF8Type'], ['key'])
+        self.assertRaises(KeyError, conn.execute_pipelined,
+                          [("SELECT col FROM StandardString1 WHERE KEY = 'ka'", {}),
+                           (pquery, {})])
+        self.cursor.execute("SELECT col FROM StandardString1 WHERE KEY = 'kb'")
+        self.assertEqual(['val'], self.cursor.fetchone())
@@ -0,0 +1,56 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from cql import decoders
+from cql.decoders import SchemaDecoder
+from cql.cqltypes import LongType, UTF8Type, AsciiType
+
+class FakeSchema:
+    # looks enough like a thrift CqlMetadata
+    name_types = {'KEY': 'AsciiType'}
+    value_types = {'KEY': 'AsciiType'}
+    default_name_type = 'LongType'
+    default_value_type = 'UTF8Type'
+
+class TestSchemaDecoder(unittest.TestCase):
+    def test_decode_metadata_and_type(self):
+        decoder = SchemaDecoder(FakeSchema())
+        name, nbytes, vtype, ctype = decoder.decode_metadata_and_type('\x00' * 7 + '\x05')
+        self.assertEqual((name, vtype, ctype), (5, UTF8Type, LongType))
+        name, nbytes, vtype, ctype = decoder.decode_metadata_and_type('KEY')
+        self.assertEqual((name, vtype, ctype), ('KEY', AsciiType, AsciiType))
+
+    def test_metadata_is_cached(self):
+        decoder = SchemaDecoder(FakeSchema())
+        first = decoder.decode_metadata_and_type('\x00' * 7 + '\x05')
+        self.assertTrue(decoder.decode_metadata_and_type('\x00' * 7 + '\x05') is first)
+        other = decoder.decode_metadata_and_type('\x00' * 7 + '\x06')
+        self.assertEqual(other[0], 6)
+        self.assertTrue(other[2] is first[2])
+
+    def test_cache_bounded(self):
+        decoder = SchemaDecoder(FakeSchema())
+        names = ['\x00' * 4 + chr(n) * 4 for n in range(30)]
+        saved = decoders.MAX_CACHED_COLUMN_NAMES
+        decoders.MAX_CACHED_COLUMN_NAMES = 10
+        try:
+            for name in names:
+                decoder.decode_metadata_and_type(name)
+        finally:
+            decoders.MAX_CACHED_COLUMN_NAMES = saved
+        self.assertTrue(len(decoder.column_metadata_cache) <= 10)
+        self.assertEqual(decoder.decode_metadata_and_type(names[3])[0], 0x03030303)
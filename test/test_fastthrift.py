@@ -0,0 +1,60 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import struct
+from thrift.Thrift import TMessageType, TApplicationException
+from thrift.transport import TTransport
+from thrift.protocol import TBinaryProtocol
+from cql.cassandra import Cassandra
+from cql.cassandra.ttypes import (CqlResult, CqlResultType, CqlRow, Column,
+                                  CqlMetadata, InvalidRequestException)
+from cql.fastthrift import read_cql_result
+
+def framed_reply(result, mtype=TMessageType.REPLY):
+    buf = TTransport.TMemoryBuffer()
+    prot = TBinaryProtocol.TBinaryProtocol(buf)
+    prot.writeMessageBegin('execute_cql_query', mtype, 1)
+    result.write(prot)
+    prot.writeMessageEnd()
+    return TTransport.TMemoryBuffer(struct.pack('>i', len(buf.getvalue())) + buf.getvalue())
+
+class TestReadCqlResult(unittest.TestCase):
+    def test_rows(self):
+        schema = CqlMetadata(name_types={'KEY': 'AsciiType'}, value_types={'KEY': 'AsciiType'},
+                             default_name_type='UTF8Type', default_value_type='LongType')
+        rows = [CqlRow(key='k1', columns=[Column(name='KEY', value='k1', timestamp=3),
+                                          Column(name='a', value=None)]),
+                CqlRow(key='k2', columns=[])]
+        result = CqlResult(type=CqlResultType.ROWS, rows=rows, schema=schema)
+        sock = framed_reply(Cassandra.execute_cql_query_result(success=result))
+        raw = read_cql_result(sock, 'execute_cql_query')
+        self.assertEqual(raw.type, CqlResultType.ROWS)
+        self.assertEqual(raw.rows, [(['KEY', 'a'], ['k1', None]), ([], [])])
+        self.assertEqual(raw.schema, schema)
+
+    def test_int(self):
+        result = CqlResult(type=CqlResultType.INT, num=42)
+        sock = framed_reply(Cassandra.execute_cql_query_result(success=result))
+        raw = read_cql_result(sock, 'execute_cql_query')
+        self.assertEqual((raw.type, raw.num), (CqlResultType.INT, 42))
+
+    def test_errors(self):
+        ire = InvalidRequestException(why='no such column family')
+        sock = framed_reply(Cassandra.execute_cql_query_result(ire=ire))
+        self.assertRaises(InvalidRequestException, read_cql_result, sock, 'execute_cql_query')
+        sock = framed_reply(TApplicationException(message='oops'), mtype=TMessageType.EXCEPTION)
+        self.assertRaises(TApplicationException, read_cql_result, sock, 'execute_cql_query')
@@ -72,6 +72,10 @@ marshalled_value_pairs = (
     ('\x00\x00', 'ListType(FloatType)', ()),
     ('\x00\x00', 'SetType(IntegerType)', set()),
     ('\x00\x01\x00\x10\xafYC\xa3\xea<\x11\xe1\xabc\xc4,\x03"y\xf0', 'ListType(TimeUUIDType)', (UUID(bytes='\xafYC\xa3\xea<\x11\xe1\xabc\xc4,\x03"y\xf0'),)),
+    ('\x00\x02\x00\x04\x00\x00\x00\x01\x00\x04\xff\xff\xff\xff', 'ListType(Int32Type)', (1, -1)),
+    ('\x00\x02\x00\x08\x00\x00\x013\x7fb\xeey\x00\x08\x00\x00\x00\x00\x00\x00\x00\x00', 'ListType(DateType)', (1320692149.881, 0.0)),
+    ('\x00\x01\x00\x04\x00\x00\x00\x07\x00\x08\x80\x00\x00\x00\x00\x00\x00\x00', 'MapType(Int32Type, LongType)', {7: -9223372036854775808}),
+    ('\x00\x01\x00\x04\x00\x00\x00\x07\x00\x03abc', 'MapType(Int32Type, AsciiType)', {7: 'abc'}),
     # these following entries work for me right now, but they're dependent on
     # vagaries of internal python ordering for unordered types
     ('\x00\x03\x00\x06\xe3\x81\xbfbob\x00\x04\x00\x00\x00\xc7\x00\x00\x00\x04\xff\xff\xff\xff\x00\x01\\\x00\x04\x00\x00\x00\x00', 'MapType(UTF8Type, Int32Type)', {u'\u307fbob': 199, u'': -1, u'\\': 0}),
@@ -90,6 +94,13 @@ class TestUnmarshal(unittest.TestCase):
                              msg='Unmarshaller for %s (%s) gave wrong type (%s instead of %s)'
                                  % (valtype, unmarshaller, type(whatwegot), type(nativeval)))
 
+    def test_unmarshalling_irregular_fixed_width_items(self):
+        # items that don't have the expected width for their type can't take
+        # the bulk-unpacking path, but should still decode as before
+        self.assertEqual(lookup_casstype('ListType(Int32Type)').from_binary(
+                             '\x00\x02\x00\x00\x00\x04\x00\x00\x00\x05'),
+                         (None, 5))
+
     def test_marshalling(self):
         for serializedval, valtype, nativeval in marshalled_value_pairs:
             marshaller = lookup_casstype(valtype)
@@ -0,0 +1,515 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import socket
+import errno
+from cStringIO import StringIO
+from threading import Thread, Lock, Event
+from cql.cqltypes import lookup_cqltype
+from cql.native import (ResultMessage, NativeCursor, NativeConnection, QueryMessage,
+                        ExecuteMessage, BatchMessage, ErrorMessage, ReadTimeoutErrorMessage,
+                        Transport, MAX_STREAM_IDS, write_int, write_short, write_string,
+                        write_value, write_short_bytes)
+from cql.query import PreparedQuery
+from cql.rows import named_row_factory
+from cql.marshal import int32_pack, int32_unpack
+import cql
+
+def rows_body(rows, paging_state=None):
+    f = StringIO()
+    write_int(f, ResultMessage.KIND_ROWS)
+    if paging_state is None:
+        write_int(f, ResultMessage.FLAGS_GLOBAL_TABLES_SPEC)
+        write_int(f, 2)
+    else:
+        write_int(f, ResultMessage.FLAGS_GLOBAL_TABLES_SPEC | ResultMessage.FLAGS_HAS_MORE_PAGES)
+        write_int(f, 2)
+        write_value(f, paging_state)
+    write_string(f, 'ks')
+    write_string(f, 'cf')
+    write_string(f, 'id')
+    write_short(f, 0x0009)
+    write_string(f, 'tags')
+    write_short(f, ResultMessage.TYPE_CODE_MAP)
+    write_short(f, 0x000D)
+    write_short(f, 0x0002)
+    write_int(f, len(rows))
+    for row in rows:
+        for val in row:
+            write_value(f, val)
+    return f.getvalue()
+
+def bare_rows_body(rows):
+    f = StringIO()
+    write_int(f, ResultMessage.KIND_ROWS)
+    write_int(f, ResultMessage.FLAGS_NO_METADATA)
+    write_int(f, 2)
+    write_int(f, len(rows))
+    for row in rows:
+        for val in row:
+            write_value(f, val)
+    return f.getvalue()
+
+class FakeConnection:
+    cql_major_version = 3
+    rate_limiter = host_rate_limiters = statement_rate_limiters = None
+
+class FakeSkipMetadataConnection(FakeConnection):
+    def __init__(self):
+        self.requests = []
+
+    def wait_for_request(self, msg):
+        self.requests.append(msg)
+        if msg.skip_metadata:
+            body = bare_rows_body([[int32_pack(7), None]])
+        else:
+            body = rows_body([[int32_pack(7), None]])
+        return ResultMessage.recv_body(StringIO(body))
+
+class FakePreparingConnection(FakeConnection):
+    """
+    Speaks protocol v2 frames: PREPARE gets a query id of '\xab\xcd' with the
+    columns of rows_body() as result metadata, and EXECUTE gets a row, left
+    without metadata if the request asks for that.
+    """
+
+    protocol_version = 2
+
+    def __init__(self):
+        self.frames = []
+
+    def wait_for_request(self, msg):
+        f = StringIO()
+        msg.send(f, 0, protocol_version=self.protocol_version)
+        frame = f.getvalue()
+        self.frames.append(frame)
+        if frame[3] == '\x09':
+            body = StringIO()
+            write_int(body, ResultMessage.KIND_PREPARED)
+            # [short bytes]
+            body.write('\x00\x02\xab\xcd')
+            write_int(body, ResultMessage.FLAGS_GLOBAL_TABLES_SPEC)
+            write_int(body, 1)
+            write_string(body, 'ks')
+            write_string(body, 'cf')
+            write_string(body, 'id')
+            write_short(body, 0x0009)
+            # the result metadata, as in rows_body()
+            body.write(rows_body([])[4:-4])
+            return ResultMessage.recv_body(StringIO(body.getvalue()), self.protocol_version)
+        # the id, the consistency level and then the flags
+        assert frame[8:12] == '\x00\x02\xab\xcd'
+        if ord(frame[14]) & 0x02:
+            body = bare_rows_body([[int32_pack(7), None]])
+        else:
+            body = rows_body([[int32_pack(7), None]])
+        return ResultMessage.recv_body(StringIO(body), self.protocol_version)
+
+class FakePagingConnection(FakeConnection):
+    """
+    Serves pages of the requested size (all the rows, if None), out of five,
+    with the paging state holding the index of the next row.
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    def wait_for_request(self, msg):
+        self.requests.append((msg.page_size, msg.paging_state))
+        start = int(msg.paging_state or 0)
+        end = min(start + (msg.page_size or 5), 5)
+        rows = [[int32_pack(n), None] for n in range(start, end)]
+        paging_state = None
+        if end < 5:
+            paging_state = str(end)
+        return ResultMessage.recv_body(StringIO(rows_body(rows, paging_state)))
+
+class TestResultMessage(unittest.TestCase):
+    def test_recv_rows(self):
+        msg = ResultMessage.recv_body(StringIO(rows_body([['\x00\x00\x00\x01', None]])))
+        self.assertEqual(msg.kind, ResultMessage.KIND_ROWS)
+        self.assertEqual(list(msg.results.column_metadata),
+                         [(u'ks', u'cf', u'id', lookup_cqltype('int')),
+                          (u'ks', u'cf', u'tags', msg.results.column_metadata[1][3])])
+        self.assertEqual(msg.results.column_metadata[1][3].cql_parameterized_type(),
+                         'map<text, bigint>')
+        self.assertEqual(msg.results.rows, [['\x00\x00\x00\x01', None]])
+
+    def test_metadata_cached(self):
+        first = ResultMessage.recv_body(StringIO(rows_body([])))
+        second = ResultMessage.recv_body(StringIO(rows_body([['\x00\x00\x00\x02', None]])))
+        self.assertTrue(first.results.column_metadata is second.results.column_metadata)
+        self.assertEqual(second.results.rows, [['\x00\x00\x00\x02', None]])
+
+    def test_row_factory(self):
+        cursor = NativeCursor(FakeConnection())
+        cursor.row_factory = named_row_factory
+        cursor.pre_execution_setup()
+        cursor.process_execution_results(
+                ResultMessage.recv_body(StringIO(rows_body([['\x00\x00\x00\x03', None]]))))
+        row = cursor.fetchone()
+        self.assertEqual((row.id, row.tags), (3, None))
+
+    def test_paging_state(self):
+        msg = ResultMessage.recv_body(StringIO(rows_body([], paging_state='\x01\x02')))
+        self.assertEqual(msg.results.paging_state, '\x01\x02')
+        self.assertEqual(msg.results.rows, [])
+        # the paging state doesn't keep the metadata from being cached
+        other = ResultMessage.recv_body(StringIO(rows_body([], paging_state='\x03')))
+        self.assertTrue(msg.results.column_metadata is other.results.column_metadata)
+        self.assertEqual(other.results.paging_state, '\x03')
+        self.assertEqual(msg.results.column_metadata[1][2], u'tags')
+
+    def test_prepared_v2(self):
+        f = StringIO()
+        write_int(f, ResultMessage.KIND_PREPARED)
+        write_short_bytes(f, '\xab\xcd')
+        for colname in ('id', 'x'):
+            write_int(f, ResultMessage.FLAGS_GLOBAL_TABLES_SPEC)
+            write_int(f, 1)
+            write_string(f, 'ks')
+            write_string(f, 'cf')
+            write_string(f, colname)
+            write_short(f, 0x0009)
+        msg = ResultMessage.recv_body(StringIO(f.getvalue()), 2)
+        queryid, params, results = msg.results
+        self.assertEqual(queryid, '\xab\xcd')
+        self.assertEqual([spec[2] for spec in params], [u'id'])
+        self.assertEqual([spec[2] for spec in results], [u'x'])
+
+    def test_error_info(self):
+        f = StringIO()
+        write_int(f, 0x1200)
+        write_string(f, 'timed out')
+        write_string(f, 'QUORUM')
+        write_int(f, 1)
+        write_int(f, 2)
+        f.write('\x00')
+        msg = ErrorMessage.recv_body(StringIO(f.getvalue()))
+        self.assertTrue(isinstance(msg, ReadTimeoutErrorMessage))
+        self.assertTrue("'blockfor': 2" in msg.summarymsg())
+
+    def test_no_metadata(self):
+        msg = ResultMessage.recv_body(StringIO(bare_rows_body([['\x00\x00\x00\x01', None]])))
+        self.assertEqual(msg.results.column_metadata, None)
+        self.assertEqual(msg.results.rows, [['\x00\x00\x00\x01', None]])
+
+class TestRequestMessages(unittest.TestCase):
+    def body(self, msg, protocol_version):
+        f = StringIO()
+        msg.send(f, 1, protocol_version=protocol_version)
+        return f.getvalue()[8:]
+
+    def test_query(self):
+        msg = QueryMessage(query='SELECT * FROM t', page_size=100, paging_state='\x07')
+        self.assertEqual(self.body(msg, 1), '\x00\x00\x00\x0fSELECT * FROM t')
+        self.assertEqual(self.body(msg, 2), '\x00\x00\x00\x0fSELECT * FROM t'
+                                            '\x00\x01\x0c\x00\x00\x00\x64'
+                                            '\x00\x00\x00\x01\x07')
+
+    def test_execute(self):
+        msg = ExecuteMessage(queryid='\xab', queryparams=['\x01'], consistency_level='quorum')
+        self.assertEqual(self.body(msg, 2), '\x00\x01\xab\x00\x04\x01'
+                                            '\x00\x01\x00\x00\x00\x01\x01')
+        msg = ExecuteMessage(queryid='\xab', queryparams=[], skip_metadata=True)
+        self.assertEqual(self.body(msg, 2), '\x00\x01\xab\x00\x01\x02')
+
+class TestSkipMetadata(unittest.TestCase):
+    def test_cached_metadata(self):
+        conn = FakeSkipMetadataConnection()
+        cursor = NativeCursor(conn)
+        metadata = ResultMessage.recv_body(StringIO(rows_body([]))).results.column_metadata
+        prepared = PreparedQuery('SELECT id, tags FROM t', '\xab', [], [])
+        cursor.execute_prepared(prepared)
+        self.assertFalse(conn.requests[-1].skip_metadata)
+        prepared.result_metadata = metadata
+        cursor.execute_prepared(prepared)
+        self.assertTrue(conn.requests[-1].skip_metadata)
+        self.assertEqual(cursor.fetchall(), [[7, None]])
+        self.assertEqual([d[0] for d in cursor.description], [u'id', u'tags'])
+
+    def test_prepared_metadata(self):
+        conn = FakePreparingConnection()
+        cursor = NativeCursor(conn)
+        prepared = cursor.prepare_query('SELECT id, tags FROM t WHERE id = :id')
+        self.assertEqual(prepared.itemid, '\xab\xcd')
+        self.assertEqual([spec[2] for spec in prepared.result_metadata], [u'id', u'tags'])
+        cursor.execute_prepared(prepared, {'id': 7})
+        self.assertTrue(ord(conn.frames[-1][14]) & 0x02)
+        self.assertEqual(cursor.fetchall(), [[7, None]])
+        self.assertEqual([d[0] for d in cursor.description], [u'id', u'tags'])
+
+class TestNativeCursorPaging(unittest.TestCase):
+    def test_fetch_pages(self):
+        conn = FakePagingConnection()
+        cursor = NativeCursor(conn)
+        cursor.page_size = 2
+        cursor.execute('SELECT id, tags FROM t')
+        self.assertEqual(cursor.rowcount, 2)
+        self.assertEqual([row[0] for row in cursor], range(5))
+        self.assertEqual(conn.requests, [(2, None), (2, '2'), (2, '4')])
+
+    def test_fetchall(self):
+        cursor = NativeCursor(FakePagingConnection())
+        cursor.page_size = 2
+        cursor.execute('SELECT id, tags FROM t')
+        self.assertEqual(cursor.fetchmany(3), [[0, None], [1, None], [2, None]])
+        self.assertEqual(cursor.fetchall(), [[3, None], [4, None]])
+        self.assertEqual(cursor.fetchone(), None)
+
+    def test_client_paging(self):
+        conn = FakePagingConnection()
+        cursor = NativeCursor(conn)
+        cursor.page_size = 2
+        # the pages of execute_paged() are not paged again by the server
+        cursor.execute_paged('SELECT id, tags FROM t', page_size=10, key='id')
+        self.assertEqual([row[0] for row in cursor], range(5))
+        self.assertEqual(conn.requests, [(None, None)])
+
+class FakeBatchConnection(FakeConnection):
+    protocol_version = 2
+
+    def __init__(self):
+        self.batches = []
+
+    def wait_for_requests(self, *msgs):
+        self.batches.extend([msg.statements for msg in msgs])
+        void = StringIO()
+        write_int(void, ResultMessage.KIND_VOID)
+        return [ResultMessage.recv_body(StringIO(void.getvalue())) for msg in msgs]
+
+class TestBatches(unittest.TestCase):
+    def test_batch_message(self):
+        msg = BatchMessage(batch_type='unlogged', consistency_level='QUORUM',
+                           statements=[(BatchMessage.KIND_PREPARED, '\xab', ['\x01', None]),
+                                       (BatchMessage.KIND_QUERY, 'DELETE FROM t', [])])
+        f = StringIO()
+        msg.send(f, 1, protocol_version=2)
+        self.assertEqual(f.getvalue()[3:8], '\x0d\x00\x00\x00\x28')
+        self.assertEqual(f.getvalue()[8:],
+                         '\x01\x00\x02'
+                         '\x01\x00\x01\xab\x00\x02\x00\x00\x00\x01\x01\xff\xff\xff\xff'
+                         '\x00\x00\x00\x00\x0dDELETE FROM t\x00\x00'
+                         '\x00\x04')
+
+    def test_execute_batch(self):
+        conn = FakeBatchConnection()
+        cursor = NativeCursor(conn)
+        cursor.max_batch_statements = 3
+        insert = PreparedQuery('INSERT INTO t (k) VALUES (:k)', '\x01', ['Int32Type'], ['k'])
+        statements = [(insert, {'k': n}) for n in range(7)]
+        statements.append(("DELETE FROM t WHERE k = :k", {'k': 'x'}))
+        cursor.execute_batch(statements)
+        self.assertEqual([len(batch) for batch in conn.batches], [3, 3, 2])
+        self.assertEqual(conn.batches[0][1], (BatchMessage.KIND_PREPARED, '\x01', [int32_pack(1)]))
+        self.assertEqual(conn.batches[2][1], (BatchMessage.KIND_QUERY,
+                                              "DELETE FROM t WHERE k = 'x'", []))
+
+        conn.batches = []
+        cursor.max_batch_statements = 100
+        cursor.max_batch_size = 9
+        cursor.execute_batch(statements[:5])
+        self.assertEqual([len(batch) for batch in conn.batches], [1, 1, 1, 1, 1])
+        self.assertEqual(cursor.description, None)
+
+class FakeServerTransport(Transport):
+    """
+    Stands in for a native connection's transport. Each QUERY written is
+    answered with a row holding the number at the end of the query text, or
+    an error (by default, Invalid) if the query mentions 'bad'. Each protocol
+    v1 EXECUTE gets a row holding its first value. Replies to the requests
+    written since the last read are sent in reverse order.
+    """
+
+    def __init__(self, connection):
+        self.written = ''
+        self.replies = []
+        self.readbuf = ''
+        self.max_inflight = 0
+        self.error_code = 0x2200
+        self.lock = Lock()
+
+    def write(self, data):
+        self.lock.acquire()
+        try:
+            self.add_replies(data)
+        finally:
+            self.lock.release()
+
+    def add_replies(self, data):
+        self.written += data
+        while len(self.written) >= 8:
+            bodylen = int32_unpack(self.written[4:8])
+            if len(self.written) < 8 + bodylen:
+                break
+            stream, opcode = self.written[2:4]
+            query = self.written[12:8 + bodylen]
+            self.written = self.written[8 + bodylen:]
+            if opcode == '\x0a':
+                # past the query id: the value count, then the first value
+                opcode, body = '\x08', rows_body([[query[6:10], None]])
+            elif 'bad' in query:
+                body = StringIO()
+                write_int(body, self.error_code)
+                write_string(body, 'bad query')
+                opcode, body = '\x00', body.getvalue()
+            else:
+                opcode, body = '\x08', rows_body([[int32_pack(int(query.split()[-1])), None]])
+            self.replies.append('\x81\x00' + stream + opcode + int32_pack(len(body)) + body)
+        self.max_inflight = max(self.max_inflight, len(self.replies))
+
+    def read(self, size):
+        self.lock.acquire()
+        try:
+            if not self.readbuf:
+                self.replies.reverse()
+                self.readbuf = ''.join(self.replies)
+                self.replies = []
+            data, self.readbuf = self.readbuf[:size], self.readbuf[size:]
+            return data
+        finally:
+            self.lock.release()
+
+    def close(self):
+        pass
+
+class BrokenTransport(FakeServerTransport):
+    """
+    Fails the first read, once released, as if the connection was reset.
+    """
+
+    def __init__(self, connection):
+        FakeServerTransport.__init__(self, connection)
+        self.reads = 0
+        self.released = Event()
+
+    def read(self, size):
+        self.reads += 1
+        self.released.wait(5)
+        raise socket.error(errno.ECONNRESET, 'Connection reset by peer')
+
+class FakeNativeConnection(NativeConnection):
+    def __init__(self, *args, **kwargs):
+        kwargs['transport_factory'] = FakeServerTransport
+        NativeConnection.__init__(self, *args, **kwargs)
+
+    def establish_connection(self):
+        # no handshake
+        self.protocol_version = 1
+        self.reset_streams()
+        self.open_connection_socket()
+
+class TestConcurrentExecution(unittest.TestCase):
+    def setUp(self):
+        self.conn = FakeNativeConnection('localhost', 9042, None)
+        self.conn.cql_major_version = 3
+
+    def test_stream_ids_reused(self):
+        msgs = [QueryMessage(query='SELECT id, tags FROM t WHERE id = %d' % n)
+                for n in range(300)]
+        responses = self.conn.wait_for_requests(*msgs)
+        self.assertEqual([int32_unpack(r.results.rows[0][0]) for r in responses], range(300))
+        self.assertEqual(self.conn.transport.max_inflight, MAX_STREAM_IDS)
+        self.assertEqual(len(self.conn.free_reqids), MAX_STREAM_IDS)
+
+    def test_execute_concurrent(self):
+        cursor = self.conn.cursor()
+        param_sets = [{'n': n} for n in range(10)]
+        param_sets[4] = {'n': 'bad'}
+        param_sets[7] = {}
+        results = cursor.execute_concurrent("SELECT id, tags FROM t WHERE id = :n", param_sets,
+                                            concurrency=3)
+        self.assertEqual(self.conn.transport.max_inflight, 3)
+        self.assertEqual([r[1] for r in results if r[0]],
+                         [[[n, None]] for n in (0, 1, 2, 3, 5, 6, 8, 9)])
+        self.assertTrue(isinstance(results[4][1], cql.ProgrammingError))
+        self.assertTrue(isinstance(results[7][1], cql.ProgrammingError))
+        self.assertEqual(len(self.conn.free_reqids), MAX_STREAM_IDS)
+
+    def test_iter_concurrent(self):
+        cursor = self.conn.cursor()
+        param_sets = [{'n': n} for n in range(6)]
+        found = [(n, rows[0][0]) for n, success, rows in
+                 cursor.iter_concurrent("SELECT id, tags FROM t WHERE id = :n", param_sets,
+                                        concurrency=3)]
+        # replies to each window come back in reverse
+        self.assertEqual(found, [(2, 2), (1, 1), (0, 0), (5, 5), (4, 4), (3, 3)])
+
+        # abandoning the iteration still frees the stream ids
+        results = cursor.iter_concurrent("SELECT id, tags FROM t WHERE id = :n", param_sets)
+        results.next()
+        results.close()
+        self.assertEqual(len(self.conn.free_reqids), MAX_STREAM_IDS)
+
+class TestSharedConnection(unittest.TestCase):
+    def test_threads(self):
+        conn = FakeNativeConnection('localhost', 9042, None)
+        conn.cql_major_version = 3
+        failures = []
+
+        def run_queries(first):
+            cursor = conn.cursor()
+            for n in range(first, first + 50):
+                cursor.execute("SELECT id, tags FROM t WHERE id = :n", {'n': n})
+                row = cursor.fetchone()
+                if row != [n, None]:
+                    failures.append((n, row))
+
+        threads = [Thread(target=run_queries, args=(n * 1000,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(failures, [])
+        self.assertEqual(len(conn.free_reqids), MAX_STREAM_IDS)
+
+    def test_read_error(self):
+        conn = FakeNativeConnection('localhost', 9042, None)
+        conn.transport = BrokenTransport(conn)
+        errors = []
+
+        def query():
+            try:
+                conn.wait_for_request(QueryMessage(query='SELECT 1'))
+            except socket.error, e:
+                errors.append(e)
+
+        threads = [Thread(target=query) for n in range(3)]
+        for t in threads:
+            t.start()
+        while not conn.transport.reads:
+            conn.transport.released.wait(0.01)
+        conn.transport.released.set()
+        for t in threads:
+            t.join()
+        # one read failed, and all the threads got its error
+        self.assertEqual(conn.transport.reads, 1)
+        self.assertEqual(len(errors), 3)
+        self.assertTrue(conn.error is errors[0])
+        self.assertRaises(socket.error, conn.wait_for_request, QueryMessage(query='SELECT 2'))
+
+    def test_callbacks(self):
+        conn = FakeNativeConnection('localhost', 9042, None)
+        got = []
+        for n in range(MAX_STREAM_IDS + 10):
+            conn.request_and_callback(QueryMessage(query='SELECT id, tags FROM t WHERE id = %d'
+                                                         % n),
+                                      lambda msg: got.append(int32_unpack(msg.results.rows[0][0])))
+        # running out of stream-ids made the first callbacks get called
+        self.assertTrue(len(got) >= 10)
+        self.assertEqual(len(conn.free_reqids) + len(conn.waiting), MAX_STREAM_IDS)
+        self.assertEqual(len(set(got)), len(got))
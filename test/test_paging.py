@@ -0,0 +1,281 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import struct
+import unittest
+import cql
+from cql.cursor import Cursor
+from cql.cqltypes import Int32Type, UTF8Type
+from cql.paging import QueryPager
+
+class FakeConnection:
+    cql_major_version = 3
+    closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def clone(self):
+        self.cloned = FakeConnection()
+        return self.cloned
+
+    def close(self):
+        self.closed = True
+
+class FakeCursor(Cursor):
+    """
+    Answers paged queries from an in-memory table of (k, c, v) rows, where
+    the token of a partition key is the key itself.
+    """
+
+    table = [(k, c, u'v%d.%d' % (k, c)) for k in range(6) for c in range(k * 2)]
+
+    def __init__(self, *args):
+        Cursor.__init__(self, *args)
+        self.queries = []
+
+    def get_response(self, query):
+        self.queries.append(query)
+        rows = self.table
+        for pattern, test in ((r'token\(k\) > token\((\d+)\)', lambda r, n: r[0] > n),
+                              (r'\bk = (\d+)', lambda r, n: r[0] == n),
+                              (r'\bk < (\d+)', lambda r, n: r[0] < n),
+                              (r'\bc > (\d+)', lambda r, n: r[1] > n)):
+            match = re.search(pattern, query)
+            if match:
+                rows = [r for r in rows if test(r, int(match.group(1)))]
+        return rows[:int(re.search(r'LIMIT (\d+)$', query).group(1))]
+
+    def process_execution_results(self, response, decoder=None):
+        self.result = response
+        self.rs_idx = 0
+        self.rowcount = len(response)
+        self.description = [(u'k',), (u'c',), (u'v',)]
+        self.column_types = [Int32Type, Int32Type, UTF8Type]
+
+    def get_metadata_info(self, row):
+        pass
+
+    def decode_row(self, row):
+        return list(row)
+
+class FakeCompoundCursor(FakeCursor):
+    """
+    Like FakeCursor, for a table of (k, c1, c2, v) rows, with two clustering
+    columns. ORDER BY c1 DESC reverses the rows within each partition.
+    """
+
+    table = [(k, c1, c2, u'v%d.%d.%d' % (k, c1, c2))
+             for k in range(3) for c1 in range(3) for c2 in range(k + c1)]
+
+    def get_response(self, query):
+        self.queries.append(query)
+        rows = self.table
+        if 'ORDER BY c1 DESC' in query:
+            rows = sorted(rows, key=lambda r: (r[0], -r[1], -r[2]))
+        tests = {('token(k)', '>'): lambda r, n: r[0] > n,
+                 ('k', '='): lambda r, n: r[0] == n,
+                 ('c1', '='): lambda r, n: r[1] == n,
+                 ('c1', '>'): lambda r, n: r[1] > n,
+                 ('c1', '<'): lambda r, n: r[1] < n,
+                 ('c2', '>'): lambda r, n: r[2] > n,
+                 ('c2', '<'): lambda r, n: r[2] < n}
+        for col, op, val in re.findall(r'(token\(k\)|\bk|\bc1|\bc2) ([=<>]) (?:token\()?(\d+)',
+                                       query):
+            rows = [r for r in rows if tests[col, op](r, int(val))]
+        return rows[:int(re.search(r'LIMIT (\d+)', query).group(1))]
+
+    def process_execution_results(self, response, decoder=None):
+        FakeCursor.process_execution_results(self, response, decoder)
+        self.description = [(u'k',), (u'c1',), (u'c2',), (u'v',)]
+        self.column_types = [Int32Type, Int32Type, Int32Type, UTF8Type]
+
+class TestPaging(unittest.TestCase):
+    def test_partitions_and_clustering(self):
+        for page_size in (1, 2, 3, 100):
+            cursor = FakeCursor(FakeConnection())
+            cursor.execute_paged('SELECT * FROM t', page_size=page_size, key='k',
+                                 clustering='c')
+            self.assertEqual([tuple(row) for row in cursor], FakeCursor.table)
+
+    def test_read_ahead(self):
+        for page_size, read_ahead in ((1, 1), (2, 3), (100, 2)):
+            conn = FakeConnection()
+            cursor = FakeCursor(conn)
+            cursor.execute_paged('SELECT * FROM t', page_size=page_size, key='k',
+                                 clustering='c', read_ahead=read_ahead)
+            self.assertEqual([tuple(row) for row in cursor], FakeCursor.table)
+            self.assertEqual(cursor.queries, [])
+            self.assertTrue(conn.cloned.closed)
+
+        # abandoning a read-ahead query part way through
+        conn = FakeConnection()
+        cursor = FakeCursor(conn)
+        cursor.execute_paged('SELECT * FROM t', page_size=1, key='k', clustering='c',
+                             read_ahead=2)
+        self.assertEqual(cursor.fetchone(), [1, 0, u'v1.0'])
+        cursor.execute('SELECT * FROM t LIMIT 1')
+        self.assertTrue(conn.cloned.closed)
+        self.assertEqual(cursor.fetchall(), [[1, 0, u'v1.0']])
+
+    def test_where_and_limit(self):
+        cursor = FakeCursor(FakeConnection())
+        cursor.execute_paged('SELECT * FROM t WHERE k < :k LIMIT 5;', {'k': 4}, page_size=2,
+                             key='k', clustering='c')
+        self.assertEqual(cursor.fetchmany(3), [[1, 0, u'v1.0'], [1, 1, u'v1.1'],
+                                               [2, 0, u'v2.0']])
+        self.assertEqual(cursor.fetchall(), [[2, 1, u'v2.1'], [2, 2, u'v2.2']])
+        self.assertEqual(cursor.queries, ['SELECT * FROM t WHERE k < 4 LIMIT 2',
+                                          'SELECT * FROM t WHERE k < 4 AND k = 1 AND c > 1 LIMIT 2',
+                                          'SELECT * FROM t WHERE k < 4 AND token(k) > token(1) LIMIT 2',
+                                          'SELECT * FROM t WHERE k < 4 AND k = 2 AND c > 1 LIMIT 1'])
+
+    def test_single_partition(self):
+        cursor = FakeCursor(FakeConnection())
+        cursor.execute_paged('SELECT * FROM t WHERE k = 5', page_size=4, clustering='c')
+        self.assertEqual([row[1] for row in cursor.fetchall()], range(10))
+
+    def test_compound_clustering(self):
+        for page_size in (1, 2, 3, 5, 100):
+            cursor = FakeCompoundCursor(FakeConnection())
+            cursor.execute_paged('SELECT * FROM t', page_size=page_size, key='k',
+                                 clustering=('c1', 'c2'))
+            self.assertEqual([tuple(row) for row in cursor], FakeCompoundCursor.table)
+        cursor = FakeCompoundCursor(FakeConnection())
+        cursor.execute_paged('SELECT * FROM t WHERE k = 2', page_size=3,
+                             clustering=('c1', 'c2'))
+        cursor.fetchall()
+        self.assertEqual(cursor.queries[:3],
+                         ['SELECT * FROM t WHERE k = 2 LIMIT 3',
+                          'SELECT * FROM t WHERE k = 2 AND c1 = 1 AND c2 > 0 LIMIT 3',
+                          'SELECT * FROM t WHERE k = 2 AND c1 > 1 LIMIT 3'])
+
+    def test_order_by(self):
+        expected = [row for row in FakeCompoundCursor.table if row[0] == 1]
+        expected.reverse()
+        for page_size in (1, 2, 4, 100):
+            cursor = FakeCompoundCursor(FakeConnection())
+            cursor.execute_paged('SELECT * FROM t WHERE k = 1 ORDER BY c1 DESC LIMIT 50',
+                                 page_size=page_size, clustering=('c1', 'c2'))
+            self.assertEqual([tuple(row) for row in cursor], expected)
+        self.assertEqual(cursor.queries,
+                         ['SELECT * FROM t WHERE k = 1 ORDER BY c1 DESC LIMIT 50'])
+
+        pager = QueryPager('SELECT * FROM t WHERE k = 1 ORDER BY c1 DESC, c2 ASC'
+                           ' ALLOW FILTERING', 10, 3, clustering=('c1', 'c2'))
+        self.assertEqual(pager.descending, [True, False])
+        self.assertEqual(pager.pending_query, 'SELECT * FROM t WHERE k = 1'
+                         ' ORDER BY c1 DESC, c2 ASC LIMIT 10 ALLOW FILTERING')
+        self.assertRaises(cql.ProgrammingError, QueryPager,
+                          'SELECT * FROM t WHERE k = 1 ORDER BY c1 DESC LIMIT x', 10, 3,
+                          clustering='c1')
+        # quoted text is no clause
+        QueryPager("SELECT * FROM t WHERE k = 'ORDER BY'", 10, 3, clustering='c1')
+
+    def test_cql2_keys(self):
+        pager = QueryPager("SELECT FIRST 10 * FROM cf USING CONSISTENCY ONE", 100, 2)
+        self.assertEqual(pager.after_partition(["'abc'"]), "KEY > 'abc'")
+        self.assertRaises(cql.ProgrammingError, QueryPager, 'SELECT * FROM t', 100, 3)
+        self.assertRaises(cql.ProgrammingError, QueryPager, 'UPDATE t SET a = 1', 100, 2)
+
+class FakeClient:
+    """
+    Answers CQL 2 column range selections on one row with LongType column
+    names 0..24.
+    """
+
+    # the schema's declared columns
+    name_types = {'KEY': 'AsciiType'}
+    # whether the row key comes back ahead of the columns
+    include_key = True
+
+    def __init__(self):
+        self.queries = []
+
+    def send_execute_cql_query(self, query, compression):
+        self.queries.append(query)
+
+    def recv_execute_cql_query(self):
+        from cql.cassandra.ttypes import CqlResult, CqlResultType, CqlRow, Column, CqlMetadata
+        match = re.match(r"SELECT FIRST (\d+) (\d+|'')\.\.'' FROM 'Wide' WHERE KEY = 'k1'",
+                         self.queries[-1])
+        count, start = int(match.group(1)), match.group(2)
+        start = 0 if start == "''" else int(start)
+        columns = []
+        if self.include_key:
+            columns.append(Column(name='KEY', value='k1'))
+        columns += [Column(name=struct.pack('>q', n), value=struct.pack('>q', n * n))
+                    for n in range(start, min(start + count, 25))]
+        schema = CqlMetadata(name_types=self.name_types, value_types={'KEY': 'AsciiType'},
+                             default_name_type='LongType', default_value_type='LongType')
+        return CqlResult(type=CqlResultType.ROWS, schema=schema,
+                         rows=[CqlRow(key='k1', columns=columns)])
+
+class FakeThriftConnection:
+    cql_major_version = 2
+    direct_decoding = False
+    rate_limiter = host_rate_limiters = statement_rate_limiters = None
+
+    def __init__(self):
+        self.client = FakeClient()
+
+class TestColumnPaging(unittest.TestCase):
+    def test_iter_columns(self):
+        from cql.thrifteries import ThriftCursor
+        for page_size in (2, 5, 7, 25, 100):
+            conn = FakeThriftConnection()
+            cursor = ThriftCursor(conn)
+            columns = list(cursor.iter_columns('Wide', 'k1', page_size=page_size))
+            self.assertEqual(columns, [(n, n * n) for n in range(25)])
+        self.assertEqual(conn.client.queries, ["SELECT FIRST 100 ''..'' FROM 'Wide' WHERE KEY = 'k1'"])
+
+    def test_iter_columns_decoder(self):
+        from cql.thrifteries import ThriftCursor
+        from cql.decoders import SchemaDecoder
+        made = []
+        cached = []
+
+        class CountingDecoder(SchemaDecoder):
+            def __init__(self, schema):
+                SchemaDecoder.__init__(self, schema)
+                made.append(self)
+
+            def decode_metadata_and_type(self, namebytes):
+                result = SchemaDecoder.decode_metadata_and_type(self, namebytes)
+                cached.append(len(self.column_metadata_cache))
+                return result
+
+        conn = FakeThriftConnection()
+        # the key is recognized by its name and value, whatever the schema
+        # declares
+        conn.client.name_types = {}
+        cursor = ThriftCursor(conn)
+        columns = list(cursor.iter_columns('Wide', 'k1', page_size=5, decoder=CountingDecoder))
+        self.assertEqual(columns, [(n, n * n) for n in range(25)])
+        self.assertEqual(len(conn.client.queries), 7)
+        self.assertEqual(len(made), 1)
+        # no more than a page of names (and the key) cached at a time
+        self.assertTrue(max(cached) <= 6)
+
+    def test_iter_columns_without_key(self):
+        from cql.thrifteries import ThriftCursor
+        for page_size in (2, 5, 25, 100):
+            conn = FakeThriftConnection()
+            conn.client.include_key = False
+            cursor = ThriftCursor(conn)
+            columns = list(cursor.iter_columns('Wide', 'k1', page_size=page_size))
+            self.assertEqual(columns, [(n, n * n) for n in range(25)])
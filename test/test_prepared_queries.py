@@ -180,3 +180,18 @@ class TestPreparedQueries(unittest.TestCase):
             return
 
         self.assertRaises(ValueError, self.cursor.prepare_query, u'select * from system.schema_keyspaces')
+
+    def test_prepared_query_cache(self):
+        if self.cursor is None:
+            return
+
+        querytext = "select thekey, theint from abc where thekey=:key"
+        q = self.cursor.prepare_query(querytext)
+        self.assertTrue(self.dbconn.cursor().prepare_query(querytext) is q)
+
+        # an item id the server doesn't know gets transparently re-prepared
+        realid = q.itemid
+        q.itemid = realid + 1000
+        self.cursor.execute_prepared(q, {'key': '2012-12-21+0000'})
+        self.assertEqual(self.cursor.fetchone()[1], 666)
+        self.assertEqual(q.itemid, realid)
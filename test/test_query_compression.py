@@ -24,3 +24,28 @@ class TestCompression(unittest.TestCase):
         compressed = zlib.compress(query)
         decompressed = zlib.decompress(compressed)
         self.assertEqual(query, decompressed)
+
+    def test_adaptive_gzip(self):
+        "only compressing queries that are big enough"
+        from cql.thrifteries import ThriftCursor, gzip_query_text
+        from cql.cassandra.ttypes import Compression
+
+        class FakeConnection:
+            cql_major_version = 3
+            client = None
+
+        cursor = ThriftCursor(FakeConnection())
+        cursor.compression = 'GZIP'
+        small = "SELECT * FROM Standard1 WHERE KEY = 'bar';"
+        self.assertEqual(cursor.compress_query_text(small), (small, Compression.NONE))
+        big = "BEGIN BATCH " + "INSERT INTO Standard1 (KEY, a) VALUES ('bar', 'baz');" * 100 \
+              + " APPLY BATCH"
+        compressed, compression = cursor.compress_query_text(big)
+        self.assertEqual(compression, Compression.GZIP)
+        self.assertEqual(zlib.decompress(compressed), big)
+        # only the texts of prepared queries are kept
+        self.assertFalse(gzip_query_text(big) is compressed)
+        compressed, compression = cursor.compress_query_text(big, cache=True)
+        self.assertTrue(gzip_query_text(big, cache=True) is compressed)
+        cursor.compression = None
+        self.assertEqual(cursor.compress_query_text(big), (big, Compression.NONE))
@@ -0,0 +1,243 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import socket
+import select
+import errno
+import warnings
+from cStringIO import StringIO
+from threading import Thread, Condition, Event
+import cql
+import cql.native
+from cql.marshal import int32_pack, int32_unpack
+from cql.native import (NativeConnection, QueryMessage, write_int, write_short, write_string,
+                        write_stringlist, write_value)
+from cql.reactor import Reactor
+from test.test_native import rows_body
+
+def reply_to(frame, auth=False):
+    """
+    The reply of a tiny native protocol v2 server to one request frame.
+    QUERY requests get a row holding the number at the end of the query.
+    With auth, connections have to log in as cassandra/secret first.
+    """
+
+    stream, opcode = frame[2], ord(frame[3])
+    body = StringIO()
+    if opcode == 0x05:
+        # OPTIONS
+        write_short(body, 2)
+        write_string(body, 'CQL_VERSION')
+        write_stringlist(body, ['3.0.0'])
+        write_string(body, 'COMPRESSION')
+        write_stringlist(body, [])
+        ropcode, body = 0x06, body.getvalue()
+    elif opcode == 0x01 and auth:
+        # STARTUP
+        write_string(body, 'org.apache.cassandra.auth.PasswordAuthenticator')
+        ropcode, body = 0x03, body.getvalue()
+    elif opcode == 0x01:
+        ropcode, body = 0x02, ''
+    elif opcode == 0x0F:
+        # AUTH_RESPONSE
+        token = frame[12:12 + int32_unpack(frame[8:12])]
+        if token == '\x00cassandra\x00secret':
+            write_value(body, None)
+            ropcode = 0x10
+        else:
+            write_int(body, 0x0100)
+            write_string(body, 'Username and/or password are incorrect')
+            ropcode = 0x00
+        body = body.getvalue()
+    else:
+        query = frame[12:12 + int32_unpack(frame[8:12])]
+        if query == 'CLOSE':
+            return None
+        ropcode, body = 0x08, rows_body([[int32_pack(int(query.split()[-1])), None]])
+    return '\x82\x00' + stream + chr(ropcode) + int32_pack(len(body)) + body
+
+def serve(sock, auth=False):
+    while True:
+        try:
+            c, addr = sock.accept()
+        except (socket.error, TypeError):
+            # closed
+            return
+        handler = Thread(target=serve_client, args=(c, auth))
+        handler.setDaemon(True)
+        handler.start()
+
+def serve_client(c, auth=False):
+    buf = ''
+    while True:
+        data = c.recv(4096)
+        if not data:
+            break
+        buf += data
+        out = []
+        closing = False
+        while len(buf) >= 8 and len(buf) >= 8 + int32_unpack(buf[4:8]):
+            size = 8 + int32_unpack(buf[4:8])
+            reply = reply_to(buf[:size], auth)
+            buf = buf[size:]
+            if reply is None:
+                closing = True
+                break
+            out.append(reply)
+        if closing:
+            break
+        # the replies go out in reverse, in one piece
+        out.reverse()
+        c.sendall(''.join(out))
+    c.close()
+
+class TestDataReceived(unittest.TestCase):
+    def test_partial_frames(self):
+        conn = NativeConnection.__new__(NativeConnection)
+        NativeConnection.reset_streams(conn)
+        conn.lock = Condition()
+        frames = ''.join([reply_to('\x02\x00%c\x07' % n + int32_pack(len(q) + 4)
+                                   + int32_pack(len(q)) + q)
+                          for n, q in enumerate(['SELECT 1', 'SELECT 22'])])
+        for n in range(0, len(frames), 5):
+            conn.data_received(frames[n:n + 5])
+        self.assertEqual(sorted(conn.responses.keys()), [0, 1])
+        self.assertEqual(conn.responses[1].results.rows, [[int32_pack(22), None]])
+        self.assertEqual(conn.in_len, 0)
+
+class TestReactor(unittest.TestCase):
+    def setUp(self):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        server = Thread(target=serve, args=(self.sock,))
+        server.setDaemon(True)
+        server.start()
+        self.reactor = Reactor(poll_interval=0.1)
+
+    def tearDown(self):
+        self.reactor.close()
+        self.sock.close()
+
+    def connect(self):
+        conn = cql.connect('127.0.0.1', self.sock.getsockname()[1], reactor=self.reactor)
+        conn.cql_major_version = 3
+        return conn
+
+    def test_many_connections(self):
+        conns = [self.connect() for n in range(5)]
+        self.assertEqual(conns[0].protocol_version, 2)
+        for n, conn in enumerate(conns):
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, tags FROM t WHERE id = :n", {'n': n})
+            self.assertEqual(cursor.fetchall(), [[n, None]])
+        results = conns[1].cursor().execute_concurrent(
+                "SELECT id, tags FROM t WHERE id = :n", [{'n': n} for n in range(300)],
+                concurrency=50)
+        self.assertEqual([rows for success, rows in results],
+                         [[[n, None]] for n in range(300)])
+        clone = conns[2].clone()
+        self.assertTrue(clone.transport.reactor is self.reactor)
+        for conn in conns + [clone]:
+            conn.close()
+        self.assertEqual(self.reactor.transports, {})
+
+    def test_authentication(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(5)
+        server = Thread(target=serve, args=(sock, True))
+        server.setDaemon(True)
+        server.start()
+        try:
+            port = sock.getsockname()[1]
+            conn = cql.connect('127.0.0.1', port, user='cassandra', password='secret',
+                               reactor=self.reactor)
+            self.assertEqual(conn.protocol_version, 2)
+            self.assertEqual(conn.authenticator,
+                             'org.apache.cassandra.auth.PasswordAuthenticator')
+            conn.cql_major_version = 3
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, tags FROM t WHERE id = 7")
+            self.assertEqual(cursor.fetchall(), [[7, None]])
+            conn.close()
+            self.assertRaises(cql.ProgrammingError, cql.connect, '127.0.0.1', port,
+                              user='cassandra', password='wrong', reactor=self.reactor)
+            self.assertRaises(cql.ProgrammingError, cql.connect, '127.0.0.1', port,
+                              reactor=self.reactor)
+        finally:
+            sock.close()
+
+    def test_callbacks(self):
+        conn = self.connect()
+        got = []
+        done = Event()
+
+        def callback(msg):
+            got.append(msg)
+            if len(got) == 10:
+                done.set()
+
+        for n in range(10):
+            conn.request_and_callback(QueryMessage(query='SELECT %d' % n), callback)
+        # the reactor calls callbacks without anybody waiting
+        done.wait(5)
+        self.assertEqual(sorted([int32_unpack(msg.results.rows[0][0]) for msg in got]),
+                         range(10))
+
+    def test_failing_callback(self):
+        conn = self.connect()
+        done = Event()
+
+        def callback(msg):
+            done.set()
+            raise ValueError('callback failed')
+
+        warned = []
+        cql.native.warn = warned.append
+        try:
+            conn.request_and_callback(QueryMessage(query='SELECT 1'), callback)
+            done.wait(5)
+            # the connection and its reactor carry on
+            response = conn.wait_for_request(QueryMessage(query='SELECT 2'))
+        finally:
+            cql.native.warn = warnings.warn
+        self.assertEqual(response.results.rows, [[int32_pack(2), None]])
+        self.assertEqual(len(warned), 1)
+        self.assertTrue('callback failed' in warned[0])
+        self.assertTrue(self.reactor.thread.isAlive())
+
+    def test_reactor_failure(self):
+        conn = self.connect()
+
+        def poll(timeout):
+            raise select.error(errno.EBADF, 'Bad file descriptor')
+
+        self.reactor.poller.poll = poll
+        self.reactor.wakeup()
+        self.reactor.thread.join(5)
+        # the connections are cut off rather than left waiting
+        self.assertEqual(conn.error.args[0], errno.EBADF)
+        self.assertRaises(select.error, conn.wait_for_request, QueryMessage(query='SELECT 1'))
+        self.assertRaises(cql.OperationalError, self.connect)
+
+    def test_connection_lost(self):
+        conn = self.connect()
+        self.assertRaises(cql.InternalError, conn.wait_for_request,
+                          QueryMessage(query='CLOSE'))
+        self.assertRaises(cql.InternalError, conn.cursor().execute, 'SELECT 1')
+        conn.close()
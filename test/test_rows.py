@@ -0,0 +1,35 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from cql.rows import named_row_factory
+
+class TestNamedRows(unittest.TestCase):
+    def test_access(self):
+        rowclass = named_row_factory([u'KEY', u'name', 'count', 5, u'caf\xe9'])
+        row = rowclass(['k1', u'bob', 3, 'five', 'x'])
+        self.assertEqual(row.KEY, 'k1')
+        self.assertEqual(row.name, u'bob')
+        self.assertEqual(row[2], 3)
+        self.assertEqual(list(row), ['k1', u'bob', 3, 'five', 'x'])
+        # names that can't or shouldn't be attributes are only indexable
+        self.assertEqual(row.count('k1'), 1)
+        self.assertEqual(row._fields, (u'KEY', u'name', 'count', 5, u'caf\xe9'))
+        self.assertFalse(hasattr(row, '__dict__'))
+
+    def test_class_shared(self):
+        self.assertTrue(named_row_factory(['a', 'b']) is named_row_factory(['a', 'b']))
+        self.assertFalse(named_row_factory(['a', 'b']) is named_row_factory(['b', 'a']))
@@ -0,0 +1,112 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from threading import Lock
+from cql.scan import RangeScan, unwrap_token_range
+from cql.cassandra.ttypes import (CfDef, TokenRange, KeySlice, ColumnOrSuperColumn,
+                                  Column)
+
+class FakeScanClient:
+    """
+    A RandomPartitioner ring of rows keyed 'kNN', where the token of a row is
+    NN. The ring has two ranges, one of them wrapping; rows 30-50 are
+    missing, so one split is empty, and row k25 has no live columns.
+    """
+
+    tokens = range(0, 10) + range(20, 30) + range(51, 60)
+
+    def __init__(self):
+        self.calls = []
+        self.lock = Lock()
+
+    def describe_partitioner(self):
+        return 'org.apache.cassandra.dht.RandomPartitioner'
+
+    def describe_ring(self, keyspace):
+        return [TokenRange(start_token='50', end_token='10', endpoints=['127.0.0.1']),
+                TokenRange(start_token='10', end_token='50', endpoints=['127.0.0.1'])]
+
+    def describe_splits(self, cfname, start, end, keys_per_split):
+        if start == '10':
+            return ['10', '30', '50']
+        return [start, end]
+
+    def get_range_slices(self, column_parent, predicate, keyrange, consistency_level):
+        self.lock.acquire()
+        try:
+            self.calls.append(keyrange)
+        finally:
+            self.lock.release()
+        end = long(keyrange.end_token)
+        if keyrange.start_key is not None:
+            # start-inclusive, by key
+            first = lambda t: 'k%02d' % t >= keyrange.start_key
+        else:
+            first = lambda t: t > long(keyrange.start_token)
+        tokens = [t for t in self.tokens if first(t) and (end == -1 or t <= end)]
+        slices = []
+        for t in tokens[:keyrange.count]:
+            columns = []
+            if t != 25:
+                columns = [ColumnOrSuperColumn(column=Column(name='col', value='v%d' % t,
+                                                             timestamp=1))]
+            slices.append(KeySlice(key='k%02d' % t, columns=columns))
+        return slices
+
+class FakeCursor:
+    def handle_cql_execution_errors(self, executor, *args):
+        return executor(*args)
+
+class FakeScanConnection:
+    def __init__(self, client):
+        self.client = client
+
+    def clone(self, keyspace=None, host=None):
+        return FakeScanConnection(self.client)
+
+    def cursor(self):
+        return FakeCursor()
+
+    def close(self):
+        pass
+
+class TestRangeScan(unittest.TestCase):
+    def test_unwrap_token_range(self):
+        random = 'org.apache.cassandra.dht.RandomPartitioner'
+        self.assertEqual(unwrap_token_range('10', '50', random), [('10', '50')])
+        self.assertEqual(unwrap_token_range('50', '10', random), [('50', '-1'), ('-1', '10')])
+        self.assertEqual(unwrap_token_range('50', '-1', random), [('50', '-1')])
+        self.assertEqual(unwrap_token_range('-1', '10', random), [('-1', '10')])
+        self.assertEqual(unwrap_token_range('b', 'a', 'ByteOrderedPartitioner'),
+                         [('b', ''), ('', 'a')])
+        self.assertEqual(unwrap_token_range('5', '1', 'SomeOtherPartitioner'), [('5', '1')])
+
+    def test_scan(self):
+        cfdef = CfDef(keyspace='ks', name='cf', key_validation_class='UTF8Type',
+                      comparator_type='UTF8Type', default_validation_class='UTF8Type',
+                      column_metadata=[])
+        client = FakeScanClient()
+        for page_size in (2, 3, 100):
+            scan = RangeScan(FakeScanConnection(client), cfdef, num_workers=2,
+                             page_size=page_size)
+            rows = list(scan)
+            # no row twice, however the pages fall
+            self.assertEqual(sorted([key for key, columns in rows]),
+                             ['k%02d' % t for t in FakeScanClient.tokens if t != 25])
+            self.assertEqual(dict(rows)['k52'], [(u'col', u'v52')])
+        # the empty split took a single call
+        self.assertEqual(len([kr for kr in client.calls if kr.end_token == '50']), 3)
@@ -0,0 +1,218 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from threading import Thread
+from time import sleep, time
+import cql
+from cql.native import QueryMessage
+from cql.query import PreparedQuery
+from cql.throttle import InFlightLimiter, AdaptiveLimiter, HostLimiters, RateLimiter
+from test.test_native import FakeNativeConnection
+from test.test_paging import FakeThriftConnection
+
+class TestInFlightLimiter(unittest.TestCase):
+    def test_reject(self):
+        limiter = InFlightLimiter(2, mode='reject')
+        limiter.acquire()
+        self.assertEqual(limiter.acquire_available(5), 1)
+        self.assertRaises(cql.TooManyRequests, limiter.acquire)
+        limiter.release()
+        limiter.acquire()
+        self.assertEqual((limiter.admitted, limiter.rejected, limiter.in_flight), (3, 1, 2))
+
+    def test_timeout(self):
+        limiter = InFlightLimiter(1, mode='timeout', timeout=0.01)
+        limiter.acquire()
+        self.assertRaises(cql.TooManyRequests, limiter.acquire)
+        self.assertEqual((limiter.queued, limiter.timed_out), (1, 1))
+
+    def test_block(self):
+        limiter = InFlightLimiter(1, max_queued=1)
+        limiter.acquire()
+        waiter = Thread(target=limiter.acquire)
+        waiter.start()
+        while not limiter.num_waiting:
+            sleep(0.001)
+        # the queue is full
+        self.assertRaises(cql.TooManyRequests, limiter.acquire)
+        limiter.release()
+        waiter.join()
+        self.assertEqual((limiter.admitted, limiter.queued, limiter.rejected), (2, 1, 1))
+        self.assertEqual(limiter.in_flight, 1)
+
+    def test_bad_mode(self):
+        self.assertRaises(ValueError, InFlightLimiter, 1, mode='drop')
+        self.assertRaises(ValueError, InFlightLimiter, 1, mode='timeout')
+
+class TestConnectionLimits(unittest.TestCase):
+    def test_in_flight_requests(self):
+        limiter = InFlightLimiter(10, mode='reject')
+        conn = FakeNativeConnection('localhost', 9042, None, in_flight_limiter=limiter)
+        conn.cql_major_version = 3
+        msgs = [QueryMessage(query='SELECT id, tags FROM t WHERE id = %d' % n)
+                for n in range(25)]
+        self.assertEqual(len(conn.wait_for_requests(*msgs)), 25)
+        self.assertEqual(conn.transport.max_inflight, 10)
+        self.assertEqual((limiter.admitted, limiter.in_flight), (25, 0))
+
+        results = conn.cursor().execute_concurrent("SELECT id, tags FROM t WHERE id = :n",
+                                                   [{'n': n} for n in range(30)],
+                                                   concurrency=20)
+        self.assertEqual([r[0] for r in results], [True] * 30)
+        self.assertEqual(conn.transport.max_inflight, 10)
+
+    def test_callbacks_hold_requests(self):
+        limiter = InFlightLimiter(3, mode='reject')
+        conn = FakeNativeConnection('localhost', 9042, None, in_flight_limiter=limiter)
+        got = []
+        for n in range(5):
+            # the responses to earlier callbacks get read to make room
+            conn.request_and_callback(QueryMessage(query='SELECT %d' % n), got.append)
+        self.assertEqual(limiter.rejected, 0)
+        self.assertTrue(len(got) >= 2)
+
+class TestAdaptiveLimiter(unittest.TestCase):
+    def run_requests(self, limiter, count, latency, overloaded=False):
+        for n in range(count):
+            limiter.acquire()
+            limiter.finished(latency, overloaded)
+
+    def test_aimd(self):
+        limiter = AdaptiveLimiter(initial_limit=4, max_limit=6, mode='reject')
+        self.run_requests(limiter, 5, 0.001)
+        self.assertEqual(limiter.max_in_flight, 5)
+        self.run_requests(limiter, 100, 0.001)
+        self.assertEqual(limiter.max_in_flight, 6)
+
+        self.run_requests(limiter, 1, 1.0, overloaded=True)
+        self.assertEqual((limiter.max_in_flight, limiter.decreases), (3, 1))
+        # responses to requests sent before the decrease don't count again
+        self.run_requests(limiter, 1, 1.0, overloaded=True)
+        self.assertEqual(limiter.decreases, 1)
+        limiter.last_decrease -= 1.0
+        self.run_requests(limiter, 1, 1.0, overloaded=True)
+        self.assertEqual((limiter.max_in_flight, limiter.decreases), (1, 2))
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_latency(self):
+        limiter = AdaptiveLimiter(initial_limit=8, latency_tolerance=2.0)
+        self.run_requests(limiter, 10, 0.001)
+        self.assertEqual(limiter.decreases, 0)
+        self.run_requests(limiter, 20, 0.01)
+        self.assertEqual(limiter.decreases, 1)
+        self.assertTrue(limiter.max_in_flight < 8)
+
+    def test_overload_errors(self):
+        limiter = AdaptiveLimiter(initial_limit=4, latency_tolerance=None)
+        conn = FakeNativeConnection('localhost', 9042, None, in_flight_limiter=limiter)
+        conn.wait_for_request(QueryMessage(query='SELECT 1'))
+        self.assertEqual(limiter.decreases, 0)
+        # the fake server answers 'bad' queries with an Invalid error, which
+        # isn't a sign of overload; an Overloaded error is
+        conn.wait_for_request(QueryMessage(query='SELECT bad'))
+        self.assertEqual(limiter.decreases, 0)
+        conn.transport.error_code = 0x1001
+        conn.wait_for_request(QueryMessage(query='SELECT bad'))
+        self.assertEqual(limiter.decreases, 1)
+
+    def test_host_limiters(self):
+        limiters = HostLimiters(initial_limit=3)
+        self.assertTrue(limiters.for_host('a') is limiters.for_host('a'))
+        self.assertFalse(limiters.for_host('a') is limiters.for_host('b'))
+        self.assertEqual(limiters.for_host('b').max_in_flight, 3)
+
+class TestRateLimiter(unittest.TestCase):
+    def test_reject(self):
+        limiter = RateLimiter(requests_per_second=10, burst=0.5, mode='reject')
+        for n in range(5):
+            limiter.admit()
+        self.assertRaises(cql.TooManyRequests, limiter.admit)
+        self.assertEqual((limiter.admitted, limiter.rejected), (5, 1))
+
+    def test_bytes(self):
+        limiter = RateLimiter(bytes_per_second=1000, mode='timeout', timeout=0.05)
+        limiter.admit(600)
+        limiter.admit(400)
+        # half a second's worth of bytes won't come within the timeout
+        self.assertRaises(cql.TooManyRequests, limiter.admit, 500)
+        self.assertEqual((limiter.admitted, limiter.timed_out), (2, 1))
+
+        # a request larger than the burst goes through on a full bucket,
+        # and the next one pays for it
+        limiter = RateLimiter(bytes_per_second=1000, mode='reject')
+        limiter.admit(5000)
+        self.assertRaises(cql.TooManyRequests, limiter.admit, 1)
+
+    def test_block(self):
+        limiter = RateLimiter(requests_per_second=200, burst=0.025)
+        start = time()
+        for n in range(10):
+            limiter.admit()
+        self.assertTrue(time() - start >= 0.02)
+        self.assertEqual(limiter.admitted, 10)
+        self.assertTrue(limiter.delayed >= 1)
+
+    def test_bad_mode(self):
+        self.assertRaises(ValueError, RateLimiter, 1, mode='drop')
+        self.assertRaises(ValueError, RateLimiter, 1, mode='timeout')
+
+class TestConnectionRateLimits(unittest.TestCase):
+    def test_native_cursor(self):
+        conn = FakeNativeConnection('localhost', 9042, None)
+        conn.cql_major_version = 3
+        conn.rate_limiter = RateLimiter(requests_per_second=1000)
+        conn.host_rate_limiters = HostLimiters(RateLimiter, bytes_per_second=10 ** 6)
+        bulk = RateLimiter(requests_per_second=3, mode='reject')
+        conn.statement_rate_limiters = {'bulk-import': bulk}
+
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, tags FROM t WHERE id = 1")
+        self.assertEqual(conn.host_rate_limiters.for_host('localhost').admitted, 1)
+        self.assertEqual(bulk.admitted, 0)
+
+        cursor.statement_class = 'bulk-import'
+        results = cursor.execute_concurrent("SELECT id, tags FROM t WHERE id = :n",
+                                            [{'n': n} for n in range(5)])
+        self.assertEqual([r[0] for r in results], [True] * 3 + [False] * 2)
+        self.assertTrue(isinstance(results[3][1], cql.TooManyRequests))
+        self.assertRaises(cql.TooManyRequests, cursor.execute, "SELECT 1")
+        self.assertEqual(conn.rate_limiter.admitted, 4)
+
+        clone = conn.clone()
+        self.assertTrue(clone.statement_rate_limiters['bulk-import'] is bulk)
+
+    def test_v1_prepared(self):
+        conn = FakeNativeConnection('localhost', 9042, None)
+        conn.cql_major_version = 3
+        conn.rate_limiter = RateLimiter(bytes_per_second=10 ** 6)
+        # protocol v1 query ids are ints
+        pquery = PreparedQuery('SELECT id, tags FROM t WHERE id = :n', 7, ['Int32Type'], ['n'])
+        cursor = conn.cursor()
+        cursor.execute_prepared(pquery, {'n': 5})
+        self.assertEqual(cursor.fetchall(), [[5, None]])
+        results = cursor.execute_concurrent(pquery, [{'n': n} for n in range(3)])
+        self.assertEqual(results, [(True, [[n, None]]) for n in range(3)])
+        self.assertEqual(conn.rate_limiter.admitted, 4)
+
+    def test_thrift_cursor(self):
+        from cql.thrifteries import ThriftCursor
+        conn = FakeThriftConnection()
+        conn.rate_limiter = RateLimiter(bytes_per_second=10 ** 6)
+        cursor = ThriftCursor(conn)
+        list(cursor.iter_columns('Wide', 'k1', page_size=10))
+        self.assertEqual(conn.rate_limiter.admitted, 3)
+        self.assertTrue(conn.rate_limiter.byte_bucket.tokens < 10 ** 6)